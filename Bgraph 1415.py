@@ -1,16 +1,30 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
 import re
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 import json
+import io
+import lzma
+import itertools
+import shutil
+import sqlite3
+import gzip
+import hashlib
 import math
 from datetime import datetime
 import os
+import mmap
+import sys
 import openai
 import threading
+import queue
+from concurrent.futures import ProcessPoolExecutor
 import webbrowser
 from html import escape
 import random
+import heapq
 import networkx as nx
 from sklearn.cluster import KMeans
 import numpy as np
@@ -18,43 +32,428 @@ import logging
 from logging.handlers import RotatingFileHandler
 import uuid
 import time
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+from geocoding import default_geocoder
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.colors import to_hex
 from matplotlib.collections import LineCollection
 
 
+class PersonRelations:
+    """Связи человека: явные связи из хранилища и связи «из одного файла», вычисляемые по запросу"""
+
+    __slots__ = ('store', 'person')
+
+    def __init__(self, store, person):
+        self.store = store
+        self.person = person
+
+    def __iter__(self):
+        explicit = self.store.outgoing.get(self.person.id, {})
+        yield from list(explicit.values())
+        yield from self.store.cooccurrence_relations(self.person)
+
+    def __len__(self):
+        return len(self.store.outgoing.get(self.person.id, ())) + self.store.cooccurrence_count(self.person)
+
+    def __bool__(self):
+        return self.person.id in self.store.outgoing or any(True for _ in self.store.cooccurrence_relations(self.person))
+
+
+class RelationStore:
+    """Хранилище связей между людьми с индексом по (id человека, тип связи, id связанного)
+
+    Люди из одного файла не связываются попарно: файл хранится как гиперребро
+    (файл -> участники), а связи «из одного файла» строятся только при обращении.
+    """
+
+    COOCCURRENCE_TYPE = 'связь'
+    COOCCURRENCE_REASON = 'из одного файла'
+
+    def __init__(self):
+        # id владельца -> {(тип связи, ключ связанного): (тип связи, связанный, детали)}
+        self.outgoing = defaultdict(dict)
+        # id связанного человека -> {id владельца: множество типов связей}
+        self.incoming = defaultdict(dict)
+        # Файл-источник -> {id человека: человек}
+        self.documents = defaultdict(dict)
+        # Пары людей (frozenset из id), связь «из одного файла» между которыми удалена вручную
+        self.hidden_cooccurrences = set()
+        # Подписчики на изменения (relation_added / relation_removed / document_member_*)
+        self.listeners = []
+        # Буфер связей в режиме массовой загрузки (None - обычный режим)
+        self.bulk = None
+
+    @staticmethod
+    def related_key(related_person):
+        """Ключ связанного: id для Person, строка для неразрешенных имен"""
+        return related_person.id if isinstance(related_person, Person) else related_person
+
+    @staticmethod
+    def freeze_details(details):
+        """Детали связи в виде кортежа пар (списки из JSON становятся кортежами)"""
+        return tuple(sorted((key, tuple(value) if isinstance(value, list) else value)
+                            for key, value in details.items()))
+
+    def clear(self):
+        self.outgoing.clear()
+        self.incoming.clear()
+        self.documents.clear()
+        self.hidden_cooccurrences.clear()
+
+    def add(self, person, relation_type, related_person, frozen_details):
+        """Добавляет одностороннюю связь, возвращает False, если такая связь уже есть"""
+        return self._add(person.id, relation_type, related_person, frozen_details)
+
+    def _add(self, owner_id, relation_type, related_person, frozen_details):
+        if self.bulk is not None:
+            # Дубликаты отбрасываются в end_bulk
+            self.bulk.append((owner_id, relation_type, related_person, frozen_details))
+            return True
+
+        if not self._insert(owner_id, relation_type, related_person, frozen_details):
+            return False
+        for listener in self.listeners:
+            listener.relation_added(owner_id, relation_type, related_person, frozen_details)
+        return True
+
+    def _insert(self, owner_id, relation_type, related_person, frozen_details):
+        key = (relation_type, self.related_key(related_person))
+        edges = self.outgoing[owner_id]
+        if key in edges:
+            return False
+
+        edges[key] = (relation_type, related_person, frozen_details)
+        if isinstance(related_person, Person):
+            self.incoming[related_person.id].setdefault(owner_id, set()).add(relation_type)
+        return True
+
+    def begin_bulk(self):
+        """Режим массовой загрузки: связи копятся в буфере без проверки дубликатов, подписчики не уведомляются.
+
+        Чтение и удаление в этом режиме видят только связи, добавленные до begin_bulk.
+        """
+        if self.bulk is None:
+            self.bulk = []
+
+    def end_bulk(self):
+        """Сортирует буфер, отбрасывает дубликаты и строит индексы за один проход.
+
+        Возвращает id людей, у которых появились новые связи.
+        """
+        pending, self.bulk = self.bulk, None
+        if not pending:
+            return set()
+
+        # Сортировка устойчивая: из одинаковых связей остается добавленная первой, как и в обычном режиме
+        pending.sort(key=lambda row: (row[0], row[1], self.related_key(row[2])))
+        return {row[0] for row in pending if self._insert(*row)}
+
+    def remove(self, person, relation_type, related_person):
+        """Удаляет одностороннюю связь, возвращает False, если связи не было"""
+        edges = self.outgoing.get(person.id)
+        if not edges or edges.pop((relation_type, self.related_key(related_person)), None) is None:
+            return False
+
+        if not edges:
+            del self.outgoing[person.id]
+        if isinstance(related_person, Person):
+            self._unlink_incoming(related_person.id, person.id, relation_type)
+        self._notify_removed(person.id, relation_type, related_person)
+        return True
+
+    def _notify_removed(self, owner_id, relation_type, related_person):
+        for listener in self.listeners:
+            listener.relation_removed(owner_id, relation_type, related_person)
+
+    def _unlink_incoming(self, related_id, owner_id, relation_type):
+        owners = self.incoming.get(related_id)
+        if not owners or owner_id not in owners:
+            return
+
+        owners[owner_id].discard(relation_type)
+        if not owners[owner_id]:
+            del owners[owner_id]
+            if not owners:
+                del self.incoming[related_id]
+
+    def relations_of(self, person):
+        """Возвращает связи человека в виде кортежей (тип, связанный, детали)"""
+        return PersonRelations(self, person)
+
+    def explicit_relations(self, person):
+        """Возвращает только явно добавленные связи человека (без связей «из одного файла»)"""
+        edges = self.outgoing.get(person.id)
+        return edges.values() if edges else ()
+
+    def relation_types(self, person, related_person):
+        """Возвращает типы связей от person к related_person"""
+        owners = self.incoming.get(related_person.id)
+        relation_types = set(owners.get(person.id, ())) if owners else set()
+        if self.cooccur(person, related_person):
+            relation_types.add(self.COOCCURRENCE_TYPE)
+        return relation_types
+
+    def connected(self, person, related_person):
+        """Проверяет, есть ли связь между людьми в любом направлении"""
+        return (self.relation_between(person.id, related_person.id) is not None or
+                self.cooccur(person, related_person))
+
+    def add_document_member(self, source_file, person):
+        """Добавляет человека в гиперребро файла-источника"""
+        members = self.documents[source_file]
+        if person.id in members:
+            return
+        members[person.id] = person
+        if self.bulk is None:
+            for listener in self.listeners:
+                listener.document_member_added(source_file, person)
+
+    def remove_document_member(self, source_file, person):
+        members = self.documents.get(source_file)
+        if not members or members.pop(person.id, None) is None:
+            return
+        if not members:
+            del self.documents[source_file]
+        if self.bulk is None:
+            for listener in self.listeners:
+                listener.document_member_removed(source_file, person)
+
+    def cooccur(self, person, related_person):
+        """Проверяет, упоминаются ли люди в одном файле (и связь не скрыта вручную)"""
+        files = person.values('source_files')
+        if person.id == related_person.id or not files or set(files).isdisjoint(related_person.values('source_files')):
+            return False
+        return frozenset((person.id, related_person.id)) not in self.hidden_cooccurrences
+
+    def hide_cooccurrence(self, person, related_person):
+        """Скрывает связь «из одного файла» между двумя людьми"""
+        if not self.cooccur(person, related_person):
+            return False
+        self.hidden_cooccurrences.add(frozenset((person.id, related_person.id)))
+        for listener in self.listeners:
+            listener.cooccurrence_hidden(person, related_person)
+        return True
+
+    def _cooccurring_members(self, person):
+        """Перебирает (id, человек) всех, кто упоминается в одном файле с person, без повторов"""
+        seen = {person.id}
+        explicit = self.outgoing.get(person.id, {})
+        for source_file in person.values('source_files'):
+            for member_id, member in self.documents.get(source_file, {}).items():
+                if member_id in seen:
+                    continue
+                seen.add(member_id)
+                # Явная связь того же типа важнее вычисляемой
+                if (self.COOCCURRENCE_TYPE, member_id) in explicit:
+                    continue
+                if self.hidden_cooccurrences and frozenset((person.id, member_id)) in self.hidden_cooccurrences:
+                    continue
+                yield member_id, member
+
+    def cooccurrence_relations(self, person):
+        """Лениво строит связи «из одного файла» для человека"""
+        for _, member in self._cooccurring_members(person):
+            shared_files = tuple(sorted(person.source_files & member.source_files))
+            yield (self.COOCCURRENCE_TYPE, member,
+                   (('reason', self.COOCCURRENCE_REASON), ('source_files', shared_files)))
+
+    def cooccurrence_count(self, person):
+        """Количество связей «из одного файла» без построения самих связей"""
+        source_files = person.values('source_files')
+        if len(source_files) == 1 and not self.hidden_cooccurrences:
+            # Частый случай: один файл, считаем без перебора участников
+            members = self.documents.get(next(iter(source_files)), {})
+            explicit = self.outgoing.get(person.id, {})
+            duplicates = sum(1 for relation_type, related_key in explicit
+                             if relation_type == self.COOCCURRENCE_TYPE and related_key in members)
+            return max(len(members) - (person.id in members) - duplicates, 0)
+        return sum(1 for _ in self._cooccurring_members(person))
+
+    def relation_between(self, person_id, related_id):
+        """Возвращает любую связь между двумя людьми (в любом направлении) или None"""
+        for owner_id, other_id in ((person_id, related_id), (related_id, person_id)):
+            edges = self.outgoing.get(owner_id)
+            for relation_type in self.incoming.get(other_id, {}).get(owner_id, ()) if edges else ():
+                edge = edges.get((relation_type, other_id))
+                if edge is not None:
+                    return edge
+        return None
+
+    def drop_person(self, person):
+        """Удаляет все связи человека в обе стороны"""
+        for source_file in person.values('source_files'):
+            self.remove_document_member(source_file, person)
+        if self.hidden_cooccurrences:
+            self.hidden_cooccurrences = {pair for pair in self.hidden_cooccurrences if person.id not in pair}
+
+        # Сначала удаляем все связи, затем уведомляем - подписчики видят согласованное хранилище
+        removed = []
+        for relation_type, related_person, _ in self.outgoing.pop(person.id, {}).values():
+            if isinstance(related_person, Person):
+                self._unlink_incoming(related_person.id, person.id, relation_type)
+            removed.append((person.id, relation_type, related_person))
+
+        for owner_id, relation_types in self.incoming.pop(person.id, {}).items():
+            edges = self.outgoing.get(owner_id)
+            if edges is None:
+                continue
+            for relation_type in relation_types:
+                edges.pop((relation_type, person.id), None)
+                removed.append((owner_id, relation_type, person))
+            if not edges:
+                del self.outgoing[owner_id]
+
+        for owner_id, relation_type, related_person in removed:
+            self._notify_removed(owner_id, relation_type, related_person)
+
+    def transfer(self, source, target):
+        """Переносит все связи source на target (используется при объединении)"""
+        outgoing = list(self.outgoing.get(source.id, {}).values())
+        incoming = [
+            (owner_id, self.outgoing[owner_id][(relation_type, source.id)])
+            for owner_id, relation_types in self.incoming.get(source.id, {}).items()
+            for relation_type in relation_types
+        ]
+        self.drop_person(source)
+
+        for relation_type, related_person, frozen_details in outgoing:
+            # Исключаем связи с самим собой
+            if isinstance(related_person, Person) and related_person.id == target.id:
+                continue
+            self._add(target.id, relation_type, related_person, frozen_details)
+
+        for owner_id, (relation_type, _, frozen_details) in incoming:
+            if owner_id != target.id:
+                self._add(owner_id, relation_type, target, frozen_details)
+
+
+def lazy_field(name, factory):
+    """Свойство-контейнер, который создается только при первом обращении.
+
+    Пустой контейнер при присваивании не хранится - у большинства людей заполнены лишь несколько полей.
+    """
+    slot = '_' + name
+
+    def getter(self):
+        value = getattr(self, slot)
+        if value is None:
+            value = factory()
+            setattr(self, slot, value)
+        return value
+
+    def setter(self, value):
+        setattr(self, slot, value if value else None)
+
+    return property(getter, setter)
+
+
+def set_of_sets():
+    return defaultdict(set)
+
+
 class Person:
-    def __init__(self, full_name, birth_date=None, source_file=None):
-        self.full_name = self.normalize_name(full_name)
-        self.birth_date = birth_date
-        self.phones = set()
-        self.emails = set()
-        self.addresses = set()
-        self.passports = set()
-        self.cars = set()
-        self.accounts = defaultdict(set)
-        self.relations = set()
+    # Поля-контейнеры и их фабрики
+    CONTAINER_FIELDS = {
+        'phones': set,
+        'emails': set,
+        'addresses': set,
+        'passports': set,
+        'cars': set,
+        'accounts': set_of_sets,
+        'jobs': set,
+        'social_media': set_of_sets,
+        'bank_accounts': set,
+        'orders': list,
+        'properties': set,
+        'aliases': set,
+        'source_files': set,
+    }
+
+    __slots__ = ('full_name', 'birth_date', 'relation_store', 'driver_license', 'snils', 'inn', 'id',
+                 'created_by', 'updated_by', '_created_ts', '_updated_ts',
+                 *('_' + name for name in CONTAINER_FIELDS))
+
+    phones = lazy_field('phones', set)
+    emails = lazy_field('emails', set)
+    addresses = lazy_field('addresses', set)
+    passports = lazy_field('passports', set)
+    cars = lazy_field('cars', set)
+    accounts = lazy_field('accounts', set_of_sets)
+    jobs = lazy_field('jobs', set)
+    social_media = lazy_field('social_media', set_of_sets)
+    bank_accounts = lazy_field('bank_accounts', set)
+    orders = lazy_field('orders', list)
+    properties = lazy_field('properties', set)
+    aliases = lazy_field('aliases', set)
+    source_files = lazy_field('source_files', set)
+
+    def __init__(self, full_name, birth_date=None, source_file=None, relation_store=None):
+        self.full_name = sys.intern(self.normalize_name(full_name))
+        self.birth_date = sys.intern(birth_date) if birth_date else birth_date
+        for name in self.CONTAINER_FIELDS:
+            setattr(self, '_' + name, None)
+        self.relation_store = relation_store if relation_store is not None else RelationStore()
         self.driver_license = None
         self.snils = None
         self.inn = None
-        self.jobs = set()
-        self.social_media = defaultdict(set)
-        self.bank_accounts = set()
-        self.orders = []
-        self.properties = set()
-        self.aliases = set()
-        self.source_files = set()
         self.id = str(uuid.uuid4())  # Уникальный идентификатор
         if source_file:
-            self.source_files.add(source_file)
-        self.created_at = datetime.now().isoformat()
-        self.updated_at = self.created_at
+            self.add_source_file(source_file)
+        self._created_ts = time.time()
+        self._updated_ts = self._created_ts
         self.created_by = "system"
         self.updated_by = "system"
 
+    def values(self, field):
+        """Содержимое поля-контейнера без его создания (пустой кортеж, если поле пустое)"""
+        return getattr(self, '_' + field) or ()
+
+    @staticmethod
+    def _timestamp(value):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except (TypeError, ValueError):
+            return time.time()
+
+    @property
+    def created_at(self):
+        return datetime.fromtimestamp(self._created_ts).isoformat()
+
+    @created_at.setter
+    def created_at(self, value):
+        self._created_ts = self._timestamp(value)
+
+    @property
+    def updated_at(self):
+        return datetime.fromtimestamp(self._updated_ts).isoformat()
+
+    @updated_at.setter
+    def updated_at(self, value):
+        self._updated_ts = self._timestamp(value)
+
+    def touch(self, updated_by="user"):
+        """Отмечает изменение данных человека"""
+        self._updated_ts = time.time()
+        self.updated_by = updated_by
+
+    @property
+    def relations(self):
+        """Связи человека из хранилища связей"""
+        return self.relation_store.relations_of(self)
+
+    def add_source_file(self, source_file):
+        """Добавляет файл-источник; люди из одного файла связаны через него"""
+        if source_file not in self.values('source_files'):
+            self.source_files.add(sys.intern(source_file))
+            self.relation_store.add_document_member(source_file, self)
+
+    def remove_source_file(self, source_file):
+        """Убирает файл-источник (файл удален или изменился при повторной загрузке папки)"""
+        if source_file in self.values('source_files'):
+            self.source_files.discard(source_file)
+            self.relation_store.remove_document_member(source_file, self)
+
     @staticmethod
     def normalize_name(name):
         """Приводит имя к стандартному формату (Фамилия Имя Отчество)"""
@@ -65,70 +464,66 @@ class Person:
             return f"{parts[0]} {parts[1]} "
         return name.title()
 
-    def add_relation(self, relation_type, related_person, details=None):
-        """Добавляет связь с другим человеком"""
-        if not details:
-            details = {}
+    def _relation_details(self, related_person, details):
+        """Готовит детали связи с точки зрения этого человека"""
+        details = dict(details) if details else {}
 
         # Преобразуем списки в кортежи для хеширования
         if 'source_files' in details:
             details['source_files'] = tuple(details['source_files'])
 
         # Добавляем информацию о файле-источнике, если есть
-        if self.source_files:
-            details['source_files'] = tuple(self.source_files)
+        files = self.values('source_files')
+        if files:
+            details['source_files'] = tuple(files)
 
         # Добавляем причину связи, если не указана
         if 'reason' not in details:
-            if isinstance(related_person, Person) and self.source_files & related_person.source_files:
+            if (isinstance(related_person, Person) and
+                    files and not set(files).isdisjoint(related_person.values('source_files'))):
                 details['reason'] = 'из одного файла'
             elif isinstance(related_person, Person):
                 details['reason'] = 'одинаковые имена в разных файлах'
 
-        # Создаем неизменяемую версию деталей
-        frozen_details = tuple(sorted(details.items()))
+        return details
+
+    def add_relation(self, relation_type, related_person, details=None):
+        """Добавляет связь с другим человеком"""
+        details = self._relation_details(related_person, details)
 
-        # Проверяем, нет ли уже такой связи
-        for rel in self.relations:
-            if (rel[0] == relation_type and
-                    ((isinstance(related_person, Person) and rel[1].full_name == related_person.full_name) or
-                     (not isinstance(related_person, Person) and rel[1] == related_person)) and
-                    rel[2] == frozen_details):
-                return False
+        # Хранилище отклоняет повторную связь того же типа с тем же человеком
+        if not self.relation_store.add(self, relation_type, related_person, tuple(sorted(details.items()))):
+            return False
 
-        self.relations.add((relation_type, related_person, frozen_details))
-        self.updated_at = datetime.now().isoformat()
-        self.updated_by = "user"
+        self.touch()
 
         # Добавляем обратную связь
         if isinstance(related_person, Person):
             reverse_relation = self.get_reverse_relation(relation_type)
-            related_person.add_relation(reverse_relation, self, details)
+            reverse_details = related_person._relation_details(self, details)
+            if related_person.relation_store.add(related_person, reverse_relation, self,
+                                                 tuple(sorted(reverse_details.items()))):
+                related_person.touch()
 
         return True
 
     def remove_relation(self, relation_type, related_person):
         """Удаляет связь с другим человеком"""
-        to_remove = []
-
-        for rel in self.relations:
-            if (rel[0] == relation_type and
-                    ((isinstance(related_person, Person) and rel[1].full_name == related_person.full_name) or
-                     (not isinstance(related_person, Person) and rel[1] == related_person))):
-                to_remove.append(rel)
+        removed = self.relation_store.remove(self, relation_type, related_person)
 
-        for rel in to_remove:
-            self.relations.remove(rel)
+        # Связь «из одного файла» не хранится явно, поэтому ее можно только скрыть
+        if (not removed and isinstance(related_person, Person) and
+                relation_type == RelationStore.COOCCURRENCE_TYPE):
+            removed = self.relation_store.hide_cooccurrence(self, related_person)
 
-        self.updated_at = datetime.now().isoformat()
-        self.updated_by = "user"
+        self.touch()
 
         # Удаляем обратную связь
         if isinstance(related_person, Person):
             reverse_relation = self.get_reverse_relation(relation_type)
-            related_person.remove_relation(reverse_relation, self)
+            related_person.relation_store.remove(related_person, reverse_relation, self)
 
-        return len(to_remove) > 0
+        return removed
 
     @staticmethod
     def get_reverse_relation(relation_type):
@@ -155,70 +550,102 @@ class Person:
         if not isinstance(other_person, Person):
             return False
 
-        # Объединяем данные
-        self.phones.update(other_person.phones)
-        self.emails.update(other_person.emails)
-        self.addresses.update(other_person.addresses)
-        self.passports.update(other_person.passports)
-        self.cars.update(other_person.cars)
-        self.jobs.update(other_person.jobs)
-        self.bank_accounts.update(other_person.bank_accounts)
-        self.source_files.update(other_person.source_files)
+        # Объединяем данные (пустые поля другого человека не создаются)
+        for field in ('phones', 'emails', 'addresses', 'passports', 'cars', 'jobs', 'bank_accounts'):
+            if other_person.values(field):
+                getattr(self, field).update(other_person.values(field))
+        self.snils = self.snils or other_person.snils
+        self.inn = self.inn or other_person.inn
+        self.driver_license = self.driver_license or other_person.driver_license
+        for platform, accounts in dict(other_person.values('social_media')).items():
+            self.social_media[platform].update(accounts)
+        for source_file in other_person.values('source_files'):
+            self.add_source_file(source_file)
         self.aliases.add(other_person.full_name)
-        self.aliases.update(other_person.aliases)
-        self.updated_at = datetime.now().isoformat()
-        self.updated_by = "user"
-
-        # Объединяем связи (без дубликатов)
-        for rel in other_person.relations:
-            # Исключаем связи с самим собой
-            if isinstance(rel[1], Person) and rel[1] == self:
-                continue
-
-            # Проверяем, нет ли уже такой связи
-            exists = False
-            for my_rel in self.relations:
-                if (my_rel[0] == rel[0] and
-                        ((isinstance(rel[1], Person) and isinstance(my_rel[1], Person) and
-                          my_rel[1].full_name == rel[1].full_name) or
-                         (not isinstance(rel[1], Person) and not isinstance(my_rel[1], Person) and
-                          my_rel[1] == rel[1]))):
-                    exists = True
-                    break
+        self.aliases.update(other_person.values('aliases'))
+        self.touch()
 
-            if not exists:
-                self.relations.add(rel)
+        # Объединяем связи (без дубликатов), перенося и обратные связи
+        self.relation_store.transfer(other_person, self)
 
         return True
 
     def __str__(self):
         return f"{self.full_name} ({self.birth_date or 'дата неизвестна'})"
 
+    @classmethod
+    def from_dict(cls, data, relation_store=None):
+        """Создает человека из словаря to_dict или записи снимка (связи восстанавливаются отдельно)"""
+        person = cls(data['full_name'], data.get('birth_date'), relation_store=relation_store)
+        person.id = data.get('id') or str(uuid.uuid4())
+        for field in ('phones', 'emails', 'addresses', 'passports', 'cars', 'jobs', 'bank_accounts', 'aliases'):
+            setattr(person, field, set(data.get(field) or ()))
+        person.social_media = defaultdict(set, {k: set(v) for k, v in (data.get('social_media') or {}).items()})
+        for source_file in data.get('source_files') or ():
+            person.add_source_file(source_file)
+        person.driver_license = data.get('driver_license')
+        person.snils = data.get('snils')
+        person.inn = data.get('inn')
+        if 'created_ts' in data:
+            person._created_ts = data['created_ts']
+            person._updated_ts = data.get('updated_ts', data['created_ts'])
+        else:
+            person.created_at = data.get('created_at', datetime.now().isoformat())
+            person.updated_at = data.get('updated_at', datetime.now().isoformat())
+        person.created_by = data.get('created_by', 'system')
+        person.updated_by = data.get('updated_by', 'system')
+        return person
+
+    def to_row(self):
+        """Компактная запись для снимка: без связей и пустых полей, время - числом"""
+        row = {'id': self.id, 'full_name': self.full_name}
+        if self.birth_date:
+            row['birth_date'] = self.birth_date
+        for field in ('phones', 'emails', 'addresses', 'passports', 'cars', 'jobs', 'bank_accounts', 'aliases',
+                      'source_files'):
+            values = self.values(field)
+            if values:
+                row[field] = list(values)
+        if self.values('social_media'):
+            row['social_media'] = {platform: list(accounts) for platform, accounts in self.social_media.items()}
+        for field in ('driver_license', 'snils', 'inn'):
+            if getattr(self, field):
+                row[field] = getattr(self, field)
+        row['created_ts'] = self._created_ts
+        row['updated_ts'] = self._updated_ts
+        if self.created_by != "system":
+            row['created_by'] = self.created_by
+        if self.updated_by != "system":
+            row['updated_by'] = self.updated_by
+        return row
+
     def to_dict(self):
         return {
             'id': self.id,
             'full_name': self.full_name,
             'birth_date': self.birth_date,
-            'phones': list(self.phones),
-            'emails': list(self.emails),
-            'addresses': list(self.addresses),
-            'passports': list(self.passports),
-            'cars': list(self.cars),
+            'phones': list(self.values('phones')),
+            'emails': list(self.values('emails')),
+            'addresses': list(self.values('addresses')),
+            'passports': list(self.values('passports')),
+            'cars': list(self.values('cars')),
             'driver_license': self.driver_license,
             'snils': self.snils,
             'inn': self.inn,
-            'jobs': list(self.jobs),
-            'social_media': dict(self.social_media),
-            'bank_accounts': list(self.bank_accounts),
-            'aliases': list(self.aliases),
-            'source_files': list(self.source_files),
+            'jobs': list(self.values('jobs')),
+            'social_media': {platform: list(accounts)
+                             for platform, accounts in dict(self.values('social_media')).items()},
+            'bank_accounts': list(self.values('bank_accounts')),
+            'aliases': list(self.values('aliases')),
+            'source_files': list(self.values('source_files')),
             'relations': [
                 {
                     'type': rel[0],
                     'related_person': rel[1].full_name if isinstance(rel[1], Person) else rel[1],
                     'details': dict(rel[2])  # Преобразуем обратно в словарь
                 }
-                for rel in self.relations
+                # Связи «из одного файла» восстанавливаются по source_files
+                for rel in self.relation_store.explicit_relations(self)
             ],
             'created_at': self.created_at,
             'updated_at': self.updated_at,
@@ -227,7 +654,2579 @@ class Person:
         }
 
 
+class PersonRegistry(MutableMapping):
+    """Реестр людей по ключу (имя, дата рождения) с индексами по id, строке списка, тегу узла и имени"""
+
+    def __init__(self):
+        self._people = {}
+        self.by_id = {}
+        self.by_display = {}
+        # Тег узла и имя не уникальны (тезки с разными датами рождения)
+        self.by_tag = defaultdict(dict)
+        self.by_name = defaultdict(dict)
+        # Подписчики на изменения (person_added / person_removed)
+        self.listeners = []
+        # В режиме массовой загрузки подписчики не уведомляются - они перестраиваются в конце
+        self.bulk = False
+        # Источник людей, которых еще нет в памяти (LazyPersonLoader)
+        self.loader = None
+
+    def begin_bulk(self):
+        self.bulk = True
+
+    def end_bulk(self):
+        self.bulk = False
+
+    @staticmethod
+    def node_tag(person):
+        """Тег узла человека на холсте графа"""
+        return f"node_{person.full_name}"
+
+    @staticmethod
+    def person_key(person):
+        """Ключ человека в реестре: (имя в нижнем регистре, дата рождения)"""
+        return person.full_name.lower(), person.birth_date
+
+    @staticmethod
+    def name_key(name):
+        return Person.normalize_name(name).strip().lower()
+
+    def __getitem__(self, key):
+        return self._people[key]
+
+    def __setitem__(self, key, person):
+        old_person = self._people.get(key)
+        if old_person is person:
+            return
+        if old_person is not None:
+            self._unindex(old_person)
+        self._people[key] = person
+        self._index(person)
+
+    def __delitem__(self, key):
+        self._unindex(self._people.pop(key))
+
+    def __iter__(self):
+        return iter(self._people)
+
+    def __len__(self):
+        return len(self._people)
+
+    def __contains__(self, key):
+        return key in self._people
+
+    def keys(self):
+        return self._people.keys()
+
+    def values(self):
+        return self._people.values()
+
+    def items(self):
+        return self._people.items()
+
+    def clear(self):
+        if not self.bulk:
+            for person in self._people.values():
+                for listener in self.listeners:
+                    listener.person_removed(person)
+        self._people.clear()
+        self.by_id.clear()
+        self.by_display.clear()
+        self.by_tag.clear()
+        self.by_name.clear()
+
+    def _index(self, person):
+        self.by_id[person.id] = person
+        self.by_display[str(person)] = person
+        self.by_tag[self.node_tag(person)][person.id] = person
+        self.by_name[self.name_key(person.full_name)][person.id] = person
+        if not self.bulk:
+            for listener in self.listeners:
+                listener.person_added(person)
+
+    def _unindex(self, person):
+        if not self.bulk:
+            for listener in self.listeners:
+                listener.person_removed(person)
+        self.by_id.pop(person.id, None)
+        if self.by_display.get(str(person)) is person:
+            del self.by_display[str(person)]
+        for index, key in ((self.by_tag, self.node_tag(person)),
+                           (self.by_name, self.name_key(person.full_name))):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(person.id, None)
+                if not bucket:
+                    del index[key]
+
+    def get_by_id(self, person_id):
+        person = self.by_id.get(person_id)
+        if person is None and self.loader is not None:
+            person = self.loader.load_by_id(person_id)
+        return person
+
+    def find_by_display(self, display):
+        """Находит человека по строке из списка людей"""
+        person = self.by_display.get(display)
+        if person is None and self.loader is not None:
+            person = self.loader.load_by_display(display)
+        return person
+
+    def find_by_tag(self, node_tag):
+        """Находит человека по тегу узла на холсте"""
+        bucket = self.by_tag.get(node_tag)
+        return next(iter(bucket.values())) if bucket else None
+
+    def find_by_name(self, name):
+        """Находит человека по имени (первого из тезок)"""
+        bucket = self.by_name.get(self.name_key(name))
+        if not bucket and self.loader is not None:
+            return self.loader.load_by_name(name)
+        return next(iter(bucket.values())) if bucket else None
+
+
+class RelationGraph:
+    """Граф связей networkx, поддерживаемый в актуальном состоянии реестром и хранилищем связей
+
+    Граф двудольный по файлам: узел файла соединен со всеми людьми из него ребрами
+    веса 0.5, так что путь «человек - файл - человек» стоит столько же, сколько прямая связь.
+    """
+
+    DOCUMENT_EDGE_WEIGHT = 0.5
+
+    def __init__(self, people, relation_store):
+        self.graph = nx.Graph()
+        self.people = people
+        self.relation_store = relation_store
+        # Увеличивается при каждом изменении графа, чтобы аналитика могла понять, что устарела
+        self.generation = 0
+        people.listeners.append(self)
+        relation_store.listeners.append(self)
+
+    def person_added(self, person):
+        self.graph.add_node(person.id, name=person.full_name, person=person)
+        self.generation += 1
+
+    def person_removed(self, person):
+        if person.id in self.graph:
+            self.graph.remove_node(person.id)
+            self.generation += 1
+
+    @staticmethod
+    def document_node(source_file):
+        return ('file', source_file)
+
+    @staticmethod
+    def is_document_node(node):
+        return isinstance(node, tuple)
+
+    def document_member_added(self, source_file, person):
+        self.graph.add_node(self.document_node(source_file), name=source_file, kind='document')
+        self.graph.add_edge(person.id, self.document_node(source_file), weight=self.DOCUMENT_EDGE_WEIGHT)
+        self.generation += 1
+
+    def document_member_removed(self, source_file, person):
+        document_node = self.document_node(source_file)
+        if self.graph.has_edge(person.id, document_node):
+            self.graph.remove_edge(person.id, document_node)
+        if source_file not in self.relation_store.documents and document_node in self.graph:
+            self.graph.remove_node(document_node)
+        self.generation += 1
+
+    def relation_added(self, owner_id, relation_type, related_person, frozen_details):
+        if isinstance(related_person, Person):
+            self.graph.add_edge(owner_id, related_person.id, type=relation_type, details=dict(frozen_details))
+            self.generation += 1
+
+    def cooccurrence_hidden(self, person, related_person):
+        # Скрытые пары учитываются при построении подграфа людей
+        self.generation += 1
+
+    def relation_removed(self, owner_id, relation_type, related_person):
+        if not isinstance(related_person, Person) or not self.graph.has_edge(owner_id, related_person.id):
+            return
+
+        # Ребро остается, пока между людьми есть хотя бы одна связь
+        remaining = self.relation_store.relation_between(owner_id, related_person.id)
+        if remaining is None:
+            self.graph.remove_edge(owner_id, related_person.id)
+        else:
+            self.graph.add_edge(owner_id, related_person.id, type=remaining[0], details=dict(remaining[2]))
+        self.generation += 1
+
+    def rebuild(self):
+        """Полностью перестраивает граф по реестру и хранилищу связей"""
+        self.graph.clear()
+
+        # Добавляем всех людей как узлы
+        for person in self.people.values():
+            self.graph.add_node(person.id, name=person.full_name, person=person)
+
+        # Добавляем связи между людьми
+        for person in self.people.values():
+            for rel_type, related_person, details in self.relation_store.explicit_relations(person):
+                if isinstance(related_person, Person):
+                    self.graph.add_edge(person.id, related_person.id, type=rel_type, details=dict(details))
+
+        # Добавляем файлы и их участников
+        for source_file, members in self.relation_store.documents.items():
+            for person in members.values():
+                self.document_member_added(source_file, person)
+
+        self.generation += 1
+
+    def people_path(self, source_id, target_id):
+        """Кратчайший путь между людьми (только люди, без узлов файлов)"""
+        path = nx.shortest_path(self.graph, source_id, target_id, weight='weight')
+        return [node for node in path if not self.is_document_node(node)]
+
+    def people_between(self, source_id, target_id, max_hops):
+        """Люди, лежащие на путях длиной не более max_hops связей между двумя людьми"""
+        from_source = nx.single_source_dijkstra_path_length(self.graph, source_id, cutoff=max_hops)
+        if target_id not in from_source:
+            raise nx.NetworkXNoPath(f"Нет пути между {source_id} и {target_id}")
+        from_target = nx.single_source_dijkstra_path_length(self.graph, target_id, cutoff=max_hops)
+        return {node for node, distance in from_source.items()
+                if not self.is_document_node(node) and distance + from_target.get(node, max_hops + 1) <= max_hops}
+
+    def person_subgraph(self, person_ids):
+        """Подграф людей, в котором связи «из одного файла» развернуты в попарные ребра"""
+        person_ids = [person_id for person_id in person_ids if person_id in self.graph]
+        subgraph = nx.Graph(self.graph.subgraph(person_ids))
+
+        # Пары строятся только внутри выбранных людей
+        documents = defaultdict(list)
+        for person_id in person_ids:
+            for neighbor in self.graph[person_id]:
+                if self.is_document_node(neighbor):
+                    documents[neighbor].append(person_id)
+
+        for document_node, members in documents.items():
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    pair = frozenset((members[i], members[j]))
+                    if subgraph.has_edge(members[i], members[j]) or \
+                            pair in self.relation_store.hidden_cooccurrences:
+                        continue
+                    subgraph.add_edge(members[i], members[j], type=RelationStore.COOCCURRENCE_TYPE,
+                                      details={'reason': RelationStore.COOCCURRENCE_REASON,
+                                               'source_files': (document_node[1],)})
+        return subgraph
+
+
+SECTION_HEADER = re.compile(rb'=== (.*?) ===')
+
+
+def iter_sections(file_path):
+    """Лениво разбивает файл на разделы, читая его через mmap.
+
+    Отдает (имя раздела, непустые строки раздела, (начало, конец) раздела в байтах).
+    В памяти держится только текущий раздел.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            section_name = None
+            lines = []
+            start = position = 0
+            while position < size:
+                end = mm.find(b'\n', position)
+                if end == -1:
+                    end = size
+                # Одиночный '\r' тоже перевод строки, как при чтении файла в текстовом режиме
+                for line in mm[position:end].split(b'\r'):
+                    # Заголовок '=== имя ===' может стоять в любом месте строки, в том числе не один
+                    segment_start = 0
+                    for match in SECTION_HEADER.finditer(line):
+                        segment = line[segment_start:match.start()].decode('utf-8').strip()
+                        if section_name is not None:
+                            if segment:
+                                lines.append(segment)
+                            yield section_name, lines, (start, position + match.start())
+                        section_name = match.group(1).decode('utf-8').strip()
+                        lines = []
+                        start = position + match.end()
+                        segment_start = match.end()
+
+                    segment = line[segment_start:].decode('utf-8').strip()
+                    if section_name is not None and segment:
+                        lines.append(segment)
+                    position += len(line) + 1
+                position = end + 1
+
+            if section_name is not None:
+                yield section_name, lines, (start, size)
+
+
+def parse_file_records(file_path):
+    """Лениво разбирает файл на записи о людях - первые люди доступны до чтения всего файла"""
+    for section_name, lines, _ in iter_sections(file_path):
+        if section_name and lines:
+            yield from parse_section_records(section_name, lines)
+
+
+def parse_records(content):
+    """Разбирает текст файла на записи о людях (словари из простых типов)"""
+    records = []
+    sections = re.split(r'=== (.*?) ===', content)[1:]
+
+    for i in range(0, len(sections), 2):
+        section_name = sections[i].strip()
+        lines = [line.strip() for line in sections[i + 1].split('\n') if line.strip()]
+
+        if not section_name or not lines:
+            continue
+
+        records.extend(parse_section_records(section_name, lines))
+
+    return records
+
+
+def parse_section_records(section_name, lines):
+    """Записи о людях из непустых строк раздела"""
+    sections_data = []
+
+    # Общая сводка: несколько людей, разделенных строками '---'
+    if section_name.lower().startswith('общая сводка'):
+        data = {}
+        for line in lines:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                data[key.strip().lower()] = value.strip()
+            elif line.startswith('---'):
+                if data:
+                    sections_data.append(data)
+                    data = {}
+        if data:
+            sections_data.append(data)
+
+    # Все остальные разделы
+    else:
+        person_data = {}
+        for line in lines:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                person_data[key.strip().lower()] = value.strip()
+        sections_data.append(person_data)
+
+    return [record for record in map(extract_person_record, sections_data) if record]
+
+
+def extract_person_record(data):
+    """Извлекает данные о человеке из полей раздела, возвращает словарь или None"""
+    # Извлекаем основные данные о человеке
+    full_name = None
+    birth_date = None
+
+    # Пытаемся найти имя в разных полях
+    for field in ['фио', 'имя клиента', 'наименование клиента', 'фам', 'ф.и.о.', 'личности']:
+        if field in data:
+            name_data = data[field]
+            # Извлекаем все возможные имена из строки
+            names = re.findall(r'[А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)?', name_data)
+            if names:
+                full_name = names[0]
+                break
+
+            # Пробуем извлечь имя из строк типа "Коваль Павел Павлович 05.08.1990"
+            name_parts = re.split(r'\s+', name_data)
+            if len(name_parts) >= 3 and re.match(r'\d{2}\.\d{2}\.\d{4}', name_parts[-1]):
+                full_name = ' '.join(name_parts[:3])
+                birth_date = name_parts[-1]
+                break
+
+    # Если имя не найдено, пропускаем запись
+    if not full_name:
+        return None
+
+    # Пытаемся найти дату рождения
+    if not birth_date:
+        for field in ['день рождения', 'дата рождения', 'birth_date', 'дата']:
+            if field in data:
+                date_str = data[field]
+                if re.match(r'\d{2}\.\d{2}\.\d{4}', date_str):
+                    birth_date = date_str
+                    break
+                elif re.match(r'\d{4}-\d{2}-\d{2}', date_str):
+                    birth_date = datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')
+                    break
+
+    record = {'full_name': full_name, 'birth_date': birth_date}
+
+    # Телефоны
+    if 'телефон' in data:
+        phones = re.findall(r'[\d\(\)\+\- ]{7,}', data['телефон'])
+        clean_phones = [re.sub(r'[^\d]', '', phone) for phone in phones]
+        clean_phones = [phone for phone in clean_phones if len(phone) >= 10]
+        if clean_phones:
+            record['phones'] = clean_phones
+
+    # Email
+    if 'email' in data:
+        emails = re.findall(r'[\w\.-]+@[\w\.-]+', data['email'])
+        if emails:
+            record['emails'] = emails
+
+    # Адреса
+    if 'адрес' in data:
+        address = data['адрес']
+        if address and len(address) > 5:  # Минимальная длина для адреса
+            record['addresses'] = [address]
+
+    # Паспортные данные
+    if 'паспорт' in data:
+        passport = data['паспорт']
+        if passport and len(passport) >= 6:  # Минимальная длина для паспорта
+            record['passports'] = [passport]
+
+    # Автомобили
+    if 'автомобили' in data:
+        cars = re.findall(r'[А-ЯЁа-яё]\d{3}[А-ЯЁа-яё]{2}\d{2,3}', data['автомобили'])
+        if cars:
+            record['cars'] = cars
+
+    # СНИЛС
+    if 'снилс' in data and len(data['снилс']) >= 11:
+        record['snils'] = data['снилс']
+
+    # ИНН
+    if 'инн' in data and len(data['инн']) >= 10:
+        record['inn'] = data['инн']
+
+    # Водительские права
+    if 'водительское удостоверение' in data and len(data['водительское удостоверение']) >= 6:
+        record['driver_license'] = data['водительское удостоверение']
+
+    # Информация о работе
+    if 'место работы' in data:
+        record['jobs'] = [data['место работы']]
+
+    # Социальные сети
+    if 'ссылка' in data and ('vk.com' in data['ссылка'] or 'ok.ru' in data['ссылка']):
+        record['social_media'] = {'vk' if 'vk.com' in data['ссылка'] else 'ok': [data['ссылка']]}
+
+    # Банковские счета
+    if 'банк' in data or 'счет' in data:
+        bank_info = data.get('банк', '') + ' ' + data.get('счет', '')
+        if bank_info.strip():
+            record['bank_accounts'] = [bank_info.strip()]
+
+    return record
+
+
+def parse_file_worker(file_path):
+    """Читает и разбирает файл (выполняется в рабочем процессе)"""
+    return list(parse_file_records(file_path))
+
+
+def file_digest(file_path):
+    """Хеш содержимого файла"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_file_worker(file_path):
+    """Хеш и записи файла (выполняется в рабочем процессе)"""
+    return file_digest(file_path), parse_file_worker(file_path)
+
+
+class FolderIngestion:
+    """Параллельный разбор файлов в пуле процессов с потоковой выдачей готовых результатов"""
+
+    def __init__(self, file_paths, max_workers=None, worker=parse_file_worker):
+        self.total = len(file_paths)
+        self.completed = 0
+        self.cancelled = False
+        self.results = queue.SimpleQueue()
+        # Процессы запускаются только при отправке задач, поэтому пустой список ничего не стоит
+        self.executor = ProcessPoolExecutor(max_workers=max(min(max_workers or os.cpu_count() or 1, self.total), 1))
+        self.pending = set()
+
+        for file_path in file_paths:
+            future = self.executor.submit(worker, file_path)
+            future.file_path = file_path
+            self.pending.add(future)
+            future.add_done_callback(self.results.put)
+
+    def collect(self, time_budget=0.05):
+        """Отдает готовые результаты (путь, записи, ошибка), не блокируясь дольше time_budget секунд"""
+        deadline = time.monotonic() + time_budget
+        while not self.cancelled and time.monotonic() < deadline:
+            try:
+                future = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.pending.discard(future)
+            if future.cancelled():
+                continue
+
+            self.completed += 1
+            error = future.exception()
+            yield future.file_path, (None if error else future.result()), error
+
+    @property
+    def finished(self):
+        return self.cancelled or not self.pending
+
+    def cancel(self):
+        self.cancelled = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class IngestManifest:
+    """Отпечатки файлов папки (размер, время изменения, хеш) и записи, полученные из каждого файла.
+
+    Хранится в backups/ между запусками; при повторной загрузке папки разбираются только
+    новые и измененные файлы, а записи измененных и удаленных файлов отзываются.
+    """
+
+    FORMAT = 'bgraph-ingest-manifest'
+
+    def __init__(self, folder_path, directory='backups'):
+        self.folder_path = os.path.abspath(folder_path)
+        folder_hash = hashlib.blake2b(self.folder_path.encode('utf-8'), digest_size=8).hexdigest()
+        self.path = os.path.join(directory, f"ingest-{folder_hash}.json.gz")
+        # Имя файла -> {'size', 'mtime_ns', 'hash', 'records'}
+        self.files = {}
+        # Ключ человека -> {имя файла: запись}; строится при первом обращении
+        self._by_person = None
+
+        if os.path.exists(self.path):
+            with open_data_input(self.path) as f:
+                data = json.load(f)
+            if data.get('format') == self.FORMAT and data.get('folder') == self.folder_path:
+                self.files = data['files']
+
+    @staticmethod
+    def record_key(record):
+        """Ключ реестра для записи: как в DataVisualizer._get_or_create_person"""
+        return Person.normalize_name(record['full_name']).lower(), record.get('birth_date')
+
+    def scan(self, file_names):
+        """Делит файлы папки на (измененные или новые, неизменные, удаленные) по размеру и времени изменения"""
+        changed, unchanged = [], []
+        for name in file_names:
+            entry = self.files.get(name)
+            stat = os.stat(os.path.join(self.folder_path, name))
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                unchanged.append(name)
+            else:
+                changed.append(name)
+        removed = set(self.files).difference(file_names)
+        return changed, unchanged, sorted(removed)
+
+    def same_content(self, name, digest):
+        """Файл тронут, но содержимое то же - достаточно обновить отпечаток"""
+        entry = self.files.get(name)
+        if entry is None or entry['hash'] != digest:
+            return False
+        self._set_stat(entry, name)
+        return True
+
+    def _set_stat(self, entry, name):
+        stat = os.stat(os.path.join(self.folder_path, name))
+        entry['size'] = stat.st_size
+        entry['mtime_ns'] = stat.st_mtime_ns
+
+    def records(self, name):
+        entry = self.files.get(name)
+        return entry['records'] if entry else []
+
+    def update(self, name, digest, records):
+        self.discard(name)
+        entry = {'hash': digest, 'records': records}
+        self._set_stat(entry, name)
+        self.files[name] = entry
+        if self._by_person is not None:
+            for record in records:
+                self._by_person[self.record_key(record)][name] = record
+
+    def discard(self, name):
+        entry = self.files.pop(name, None)
+        if entry is not None and self._by_person is not None:
+            for record in entry['records']:
+                records = self._by_person.get(self.record_key(record))
+                if records:
+                    records.pop(name, None)
+
+    def person_records(self, key):
+        """(имя файла, запись) всех файлов, где упоминается человек с ключом key"""
+        if self._by_person is None:
+            self._by_person = defaultdict(dict)
+            for name, entry in self.files.items():
+                for record in entry['records']:
+                    self._by_person[self.record_key(record)][name] = record
+        return list(self._by_person.get(key, {}).items())
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with replacing_output(self.path) as f:
+            json.dump({'format': self.FORMAT, 'folder': self.folder_path, 'files': self.files},
+                      f, ensure_ascii=False, separators=(',', ':'))
+
+
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+
+def output_compression(path):
+    """Сжатие по расширению файла: 'gzip', 'lzma' или None"""
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith(('.xz', '.lzma')):
+        return 'lzma'
+    return None
+
+
+def open_data_output(path, compression=None):
+    """Открывает файл данных на запись с буфером и сжатием gzip/lzma"""
+    if compression == 'gzip':
+        raw = io.BufferedWriter(gzip.GzipFile(path, 'wb', compresslevel=6), EXPORT_BUFFER_SIZE)
+    elif compression == 'lzma':
+        raw = io.BufferedWriter(lzma.LZMAFile(path, 'wb'), EXPORT_BUFFER_SIZE)
+    else:
+        raw = open(path, 'wb', buffering=EXPORT_BUFFER_SIZE)
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+def open_data_input(path):
+    """Открывает файл данных на чтение; сжатие gzip/lzma определяется по сигнатуре"""
+    with open(path, 'rb') as f:
+        signature = f.read(6)
+    if signature.startswith(b'\x1f\x8b'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if signature == b'\xfd7zXZ\x00':
+        return lzma.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+@contextmanager
+def replacing_output(path, compression=None):
+    """Пишет во временный файл и подменяет им path только после успешной записи"""
+    temp_path = path + '.tmp'
+    try:
+        with open_data_output(temp_path, compression or output_compression(path)) as f:
+            yield f
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class StreamingExporter:
+    """Потоковый экспорт людей (to_dict) в JSON или JSON Lines, по одному человеку за раз.
+
+    Формат выбирается по расширению: .jsonl - по человеку в строке, иначе JSON
+    {"timestamp": ..., "people": [...]}; .gz и .xz дополнительно сжимаются.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.json_lines = re.sub(r'\.(gz|xz|lzma)$', '', path).endswith('.jsonl')
+        self.dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def write(self, people, **header):
+        """Записывает людей из итератора, возвращает их количество"""
+        count = 0
+        with replacing_output(self.path) as f:
+            if self.json_lines:
+                for person in people:
+                    f.write(self.dumps(person.to_dict()) + '\n')
+                    count += 1
+                return count
+
+            f.write('{')
+            for key, value in header.items():
+                f.write(f"{self.dumps(key)}: {self.dumps(value)}, ")
+            f.write('"people": [')
+            for person in people:
+                f.write((',\n' if count else '\n') + self.dumps(person.to_dict()))
+                count += 1
+            f.write('\n]}\n')
+        return count
+
+
+SNAPSHOT_FORMAT = 'bgraph-snapshot'
+SNAPSHOT_VERSION = 2  # Версия 1 - прежние JSON-копии со списком to_dict()
+
+
+def snapshot_rows(people, relation_store):
+    """Записи снимка (вид, данные) для людей из реестра и их связей"""
+    for person in people.values():
+        yield 'p', person.to_row()
+
+    # Связи - после всех людей, чтобы при чтении id уже были известны
+    for owner_id, edges in relation_store.outgoing.items():
+        for relation_type, related_person, frozen_details in edges.values():
+            if isinstance(related_person, Person):
+                yield 'r', [owner_id, relation_type, related_person.id, dict(frozen_details)]
+            else:
+                # Неразрешенная связь с именем
+                yield 'n', [owner_id, relation_type, related_person, dict(frozen_details)]
+
+    for pair in relation_store.hidden_cooccurrences:
+        yield 'h', sorted(pair)
+
+
+def write_snapshot(path, people, relation_store):
+    write_snapshot_rows(path, snapshot_rows(people, relation_store), people=len(people))
+
+
+def write_snapshot_rows(path, rows, **header):
+    """Пишет снимок потоком: заголовок, затем записи (вид, данные).
+
+    Снимок - gzip со строками компактного JSON, по одной записи в строке.
+    """
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    with replacing_output(path, compression='gzip') as f:
+        f.write(dumps({'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION,
+                       'timestamp': datetime.now().isoformat(), **header}) + '\n')
+        for kind, payload in rows:
+            f.write(dumps({kind: payload}) + '\n')
+
+
+def snapshot_header(line):
+    """Заголовок снимка из первой строки файла или None, если это не снимок"""
+    try:
+        header = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT:
+        return None
+    if header.get('version', 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия снимка: {header.get('version')}")
+    return header
+
+
+def read_snapshot(path):
+    """Читает снимок построчно, отдает записи (вид, данные).
+
+    Первая запись - 'header' (заголовок), далее 'p' - человек, 'r'/'n' - связь, 'h' - скрытая пара.
+    """
+    with open_data_input(path) as f:
+        header = snapshot_header(f.readline())
+        if header is None:
+            raise ValueError("Файл не является снимком данных")
+
+        yield 'header', header
+        for line in f:
+            if line.strip():
+                (kind, payload), = json.loads(line).items()
+                yield kind, payload
+
+
+def person_dict_rows(people_data):
+    """Записи снимка из словарей to_dict (связи в них - по именам)"""
+    relation_rows = []
+    for person_data in people_data:
+        person_data = dict(person_data)
+        person_data.setdefault('id', str(uuid.uuid4()))
+        for rel_data in person_data.pop('relations', None) or ():
+            relation_rows.append(('n', [person_data['id'], rel_data['type'], rel_data['related_person'],
+                                        rel_data.get('details', {})]))
+        yield 'p', person_data
+
+    # Связи - после всех людей, на которых они могут ссылаться
+    yield from relation_rows
+
+
+def json_backup_rows(backup_data):
+    """Записи снимка из прежней JSON-копии"""
+    if not isinstance(backup_data, dict) or not isinstance(backup_data.get('people'), list):
+        raise ValueError("Файл не является резервной копией")
+    return person_dict_rows(backup_data['people'])
+
+
+def backup_rows(path):
+    """Записи снимка из файла любого формата: снимок, JSON или JSON Lines (в том числе сжатые)"""
+    with open_data_input(path) as f:
+        first_line = f.readline()
+        if snapshot_header(first_line) is not None:
+            f.close()
+            yield from read_snapshot(path)
+            return
+
+        try:
+            first = json.loads(first_line)
+        except ValueError:
+            first = None
+        if isinstance(first, dict) and 'full_name' in first:
+            # JSON Lines: по человеку в строке
+            lines = (json.loads(line) for line in f if line.strip())
+            yield from person_dict_rows(itertools.chain([first], lines))
+        else:
+            yield from json_backup_rows(json.loads(first_line + f.read()))
+
+
+def read_backup(path):
+    """Читает резервную копию целиком и проверяет записи людей - до замены текущих данных"""
+    state = JournalState()
+    state.load_base(path)
+    for row in state.people.values():
+        if not isinstance(row.get('full_name'), str):
+            raise ValueError(f"Запись без ФИО в резервной копии: {row.get('id')}")
+    return state
+
+
+class JournalState:
+    """Данные в виде записей снимка - для сжатия журнала и восстановления без объектов Person"""
+
+    def __init__(self):
+        self.people = {}  # id -> запись человека
+        self.relations = {}  # id владельца -> {(тип, связанный): [тип, связанный, это человек, детали]}
+        self.hidden = set()
+        self.journal_seq = 0  # Последний журнал, уже включенный в базовый снимок
+        self.bases = []  # Копии файлов, на которые ссылаются операции 'base'
+
+    def clear(self):
+        self.people.clear()
+        self.relations.clear()
+        self.hidden.clear()
+
+    def load_base(self, path):
+        for kind, payload in backup_rows(path):
+            if kind == 'header':
+                self.journal_seq = payload.get('journal_seq', 0)
+            elif kind == 'p':
+                self.people[payload['id']] = payload
+            elif kind in ('r', 'n'):
+                owner_id, relation_type, related, details = payload
+                self.relations.setdefault(owner_id, {})[(relation_type, related)] = \
+                    [relation_type, related, kind == 'r', details]
+            elif kind == 'h':
+                self.hidden.add(frozenset(payload))
+
+    def apply(self, op):
+        kind = op.get('op')
+        if kind == 'put':
+            row = op['p']
+            person_id = row['id']
+            self.people[person_id] = row
+            self.relations[person_id] = {(relation[0], relation[1]): relation for relation in op.get('r', ())}
+            self.hidden = {pair for pair in self.hidden if person_id not in pair}
+            self.hidden.update(frozenset((person_id, other_id)) for other_id in op.get('h', ()))
+        elif kind == 'del':
+            person_id = op['id']
+            self.people.pop(person_id, None)
+            self.relations.pop(person_id, None)
+            self.hidden = {pair for pair in self.hidden if person_id not in pair}
+        elif kind == 'reset':
+            self.clear()
+        elif kind == 'base':
+            self.clear()
+            self.bases.append(op['path'])
+            self.load_base(op['path'])
+        # 'merge' - только для истории: его результат записан операциями 'put' и 'del'
+
+    def replay(self, journal_path):
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    self.apply(json.loads(line))
+
+    def rows(self):
+        for row in self.people.values():
+            yield 'p', row
+        for owner_id, relations in self.relations.items():
+            if owner_id not in self.people:
+                continue
+            for relation_type, related, is_person, details in relations.values():
+                if not is_person:
+                    yield 'n', [owner_id, relation_type, related, details]
+                elif related in self.people:
+                    yield 'r', [owner_id, relation_type, related, details]
+        for pair in self.hidden:
+            if all(person_id in self.people for person_id in pair):
+                yield 'h', sorted(pair)
+
+
+class ChangeJournal:
+    """Журнал изменений (только дозапись) поверх базового снимка в backups/.
+
+    Изменения копятся как набор измененных людей и сбрасываются одной записью на человека
+    (данные, исходящие связи, скрытые пары). Сжатие журнала идет в фоновом потоке только
+    по файлам - снимку и закрытым журналам. Каждое сжатие пишет новый снимок
+    snapshot-<журнал>-<время>.bgs, прежние снимки остаются резервными копиями на свой момент.
+    """
+
+    BASE_NAME = 'snapshot.bgs'  # Единственный снимок прежних версий
+    BASE_PATTERN = re.compile(r'snapshot-(\d+)-\d{8}-\d{6}\.bgs')
+
+    def __init__(self, directory, schedule=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Вызывается при первом изменении после сброса, чтобы запланировать flush
+        self.schedule = schedule
+        self.people = None
+        self.relation_store = None
+        self.dirty = {}  # id -> измененный человек
+        self.pending = []  # Операции, которые пишутся перед записями людей
+        self.flush_scheduled = False
+        # Номера журналов продолжаются и после сжатия, когда файлов журналов уже нет
+        self.seq = max(self.base_seq(), max(self.journal_seqs(), default=0)) + 1
+        self.file = None
+        self.compaction = None
+        self.copying = None
+        self.error = None
+        self.dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def journal_seqs(self):
+        for name in os.listdir(self.directory):
+            match = re.fullmatch(r'journal-(\d+)\.jsonl', name)
+            if match:
+                yield int(match.group(1))
+
+    def base_snapshots(self):
+        """Базовые снимки (номер последнего включенного журнала, путь)"""
+        for name in os.listdir(self.directory):
+            match = self.BASE_PATTERN.fullmatch(name)
+            if match:
+                yield int(match.group(1)), os.path.join(self.directory, name)
+            elif name == self.BASE_NAME:
+                path = os.path.join(self.directory, name)
+                rows = read_snapshot(path)
+                try:
+                    kind, header = next(rows)
+                finally:
+                    rows.close()
+                yield header.get('journal_seq', 0), path
+
+    @property
+    def base_path(self):
+        """Последний базовый снимок или None"""
+        return max(self.base_snapshots(), default=(0, None))[1]
+
+    def base_seq(self):
+        """Номер последнего журнала, включенного в базовый снимок"""
+        return max(self.base_snapshots(), default=(0, None))[0]
+
+    def journal_path(self, seq):
+        return os.path.join(self.directory, f"journal-{seq:06d}.jsonl")
+
+    def attach(self, people, relation_store):
+        """Начинает журнал для нового набора данных (после сброса данных)"""
+        self.detach()
+        self.people = people
+        self.relation_store = relation_store
+        people.listeners.append(self)
+        relation_store.listeners.append(self)
+        self.dirty.clear()
+        self.pending = [{'op': 'reset'}]
+
+    def detach(self):
+        if self.people is not None:
+            self.flush()
+            self.people.listeners.remove(self)
+            self.relation_store.listeners.remove(self)
+            self.people = self.relation_store = None
+
+    def set_base(self, path):
+        """Данные только что загружены из файла: вместо записи всех людей журнал ссылается на его копию"""
+        self.dirty.clear()
+        base_copy = os.path.join(self.directory,
+                                 f"base-{self.seq:06d}-{uuid.uuid4().hex[:8]}-{os.path.basename(path)}")
+        self.copying = threading.Thread(target=shutil.copyfile, args=(path, base_copy), daemon=True)
+        self.copying.start()
+        self.pending = [{'op': 'base', 'path': base_copy}]
+        self._changed()
+
+    def continue_chain(self):
+        """Данные загружены из самого журнала - они уже записаны"""
+        self.dirty.clear()
+        self.pending = []
+
+    def _changed(self):
+        if not self.flush_scheduled and self.schedule is not None:
+            self.flush_scheduled = True
+            self.schedule()
+
+    def mark(self, *people):
+        """Отмечает людей, чьи данные изменились (без данных, после detach - ничего не делает)"""
+        if self.people is None:
+            return
+        for person in people:
+            self.dirty[person.id] = person
+        self._changed()
+
+    def _mark_id(self, person_id):
+        person = self.people.by_id.get(person_id)
+        if person is not None:
+            self.mark(person)
+
+    # Подписка на реестр и хранилище связей
+    def person_added(self, person):
+        self.mark(person)
+
+    def person_removed(self, person):
+        if self.people is None:
+            return
+        self.dirty.pop(person.id, None)
+        self.pending.append({'op': 'del', 'id': person.id})
+        self._changed()
+
+    def relation_added(self, owner_id, relation_type, related_person, frozen_details):
+        self._mark_id(owner_id)
+
+    def relation_removed(self, owner_id, relation_type, related_person):
+        self._mark_id(owner_id)
+
+    def document_member_added(self, source_file, person):
+        self.mark(person)
+
+    def document_member_removed(self, source_file, person):
+        self.mark(person)
+
+    def cooccurrence_hidden(self, person, related_person):
+        self.mark(person, related_person)
+
+    def merged(self, main_person, merged_people):
+        if self.people is None:
+            return
+        self.pending.append({'op': 'merge', 'into': main_person.id, 'from': [p.id for p in merged_people]})
+        self.mark(main_person)
+
+    def _put(self, person):
+        relations = [[relation_type, RelationStore.related_key(related_person),
+                      isinstance(related_person, Person), dict(frozen_details)]
+                     for relation_type, related_person, frozen_details
+                     in self.relation_store.explicit_relations(person)]
+        hidden = [other_id for pair in self.relation_store.hidden_cooccurrences if person.id in pair
+                  for other_id in pair if other_id != person.id]
+        return {'op': 'put', 'p': person.to_row(), 'r': relations, 'h': hidden}
+
+    def flush(self):
+        """Дописывает накопленные изменения в журнал"""
+        self.flush_scheduled = False
+        if not self.pending and not self.dirty:
+            return
+        # Одна только операция сброса без данных не пишется - прежний журнал остается актуальным
+        if self.pending == [{'op': 'reset'}] and not self.dirty:
+            return
+
+        if self.file is None:
+            self.file = open(self.journal_path(self.seq), 'a', encoding='utf-8')
+        lines = [self.dumps(op) for op in self.pending]
+        lines.extend(self.dumps(self._put(person)) for person in self.dirty.values())
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+        self.pending = []
+        self.dirty.clear()
+
+    def _rotate(self):
+        """Закрывает текущий журнал, следующие изменения пишутся в новый"""
+        sealed = self.seq
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.seq += 1
+        return sealed
+
+    def wait(self):
+        for thread in (self.copying, self.compaction):
+            if thread is not None:
+                thread.join()
+
+    def compact(self):
+        """Запускает сжатие журнала в новый базовый снимок в фоне.
+
+        Возвращает путь нового снимка или None, если сжатие уже идет.
+        """
+        if self.compaction is not None and self.compaction.is_alive():
+            return None
+        self.flush()
+        sealed = self._rotate()
+        path = os.path.join(self.directory, f"snapshot-{sealed:06d}-{datetime.now():%Y%m%d-%H%M%S}.bgs")
+        self.compaction = threading.Thread(target=self._compact, args=(sealed, path), daemon=True)
+        self.compaction.start()
+        return path
+
+    def _compact(self, sealed, path):
+        try:
+            if self.copying is not None:
+                self.copying.join()
+            state = self.load_state(upto=sealed)
+            # Прежний снимок не перезаписывается: в журнале после него мог быть сброс данных
+            write_snapshot_rows(path, state.rows(), people=len(state.people), journal_seq=sealed)
+
+            # Включенные в снимок журналы и копии файлов больше не нужны
+            for seq in list(self.journal_seqs()):
+                if seq <= sealed:
+                    os.remove(self.journal_path(seq))
+            for base_copy in state.bases:
+                if os.path.exists(base_copy):
+                    os.remove(base_copy)
+            self.error = None
+        except Exception as e:
+            self.error = e
+            logging.getLogger("DataVisualizer").error(f"Ошибка при сжатии журнала: {str(e)}")
+
+    def load_state(self, upto=None):
+        """Данные по базовому снимку и журналам после него (до журнала upto включительно)"""
+        state = JournalState()
+        base_path = self.base_path
+        if base_path is not None:
+            state.load_base(base_path)
+        base_seq = state.journal_seq
+        for seq in sorted(self.journal_seqs()):
+            if seq > base_seq and (upto is None or seq <= upto):
+                state.replay(self.journal_path(seq))
+        return state
+
+
+class SearchIndex:
+    """Инвертированный индекс по триграммам всех полей, по которым идет поиск"""
+
+    NGRAM = 3
+
+    def __init__(self, people):
+        # Триграмма -> множество id людей
+        self.postings = defaultdict(set)
+        # id человека -> значения всех полей в нижнем регистре, разделенные '\x00'
+        self.texts = {}
+        people.listeners.append(self)
+
+    @staticmethod
+    def searchable_values(person):
+        """Значения всех полей человека, по которым идет поиск"""
+        yield person.full_name
+        yield from person.values('aliases')
+        yield from person.values('phones')
+        yield from person.values('emails')
+        yield from person.values('addresses')
+        yield from person.values('cars')
+        yield from person.values('passports')
+        yield from (value for value in (person.snils, person.inn, person.driver_license) if value)
+        yield from person.values('jobs')
+        for accounts in dict(person.values('social_media')).values():
+            yield from accounts
+        yield from person.values('bank_accounts')
+        yield from person.values('source_files')
+
+    @classmethod
+    def text_of(cls, person):
+        return '\x00'.join(value.lower() for value in cls.searchable_values(person))
+
+    @classmethod
+    def ngrams(cls, text):
+        grams = set()
+        for value in text.split('\x00'):
+            grams.update(value[i:i + cls.NGRAM] for i in range(len(value) - cls.NGRAM + 1))
+        return grams
+
+    def update(self, person):
+        """Переиндексирует человека после изменения его данных"""
+        text = self.text_of(person)
+        old_text = self.texts.get(person.id)
+        if text == old_text:
+            return
+
+        old_grams = self.ngrams(old_text) if old_text else set()
+        new_grams = self.ngrams(text)
+        for gram in old_grams - new_grams:
+            self._discard(gram, person.id)
+        for gram in new_grams - old_grams:
+            self.postings[gram].add(person.id)
+        self.texts[person.id] = text
+
+    def rebuild(self, people):
+        """Строит индекс заново за один проход (после массовой загрузки)"""
+        self.postings.clear()
+        self.texts.clear()
+        for person in people:
+            text = self.text_of(person)
+            self.texts[person.id] = text
+            for gram in self.ngrams(text):
+                self.postings[gram].add(person.id)
+
+    def remove(self, person_id):
+        text = self.texts.pop(person_id, None)
+        if text:
+            for gram in self.ngrams(text):
+                self._discard(gram, person_id)
+
+    def _discard(self, gram, person_id):
+        ids = self.postings.get(gram)
+        if ids is not None:
+            ids.discard(person_id)
+            if not ids:
+                del self.postings[gram]
+
+    def person_added(self, person):
+        self.update(person)
+
+    def person_removed(self, person):
+        self.remove(person.id)
+
+    def search(self, query):
+        """Возвращает id людей, у которых какое-либо поле содержит query как подстроку"""
+        query = query.lower()
+        if len(query) < self.NGRAM:
+            # Короткий запрос не разбивается на триграммы - проверяем все строки
+            candidates = self.texts.keys()
+        else:
+            candidates = None
+            # Начинаем с самых редких триграмм, чтобы пересечение быстро сужалось
+            for gram in sorted(self.ngrams(query), key=lambda g: len(self.postings.get(g, ()))):
+                ids = self.postings.get(gram)
+                if not ids:
+                    return []
+                candidates = set(ids) if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+
+        # Триграммы дают кандидатов, подстроку проверяем явно
+        return [person_id for person_id in candidates if query in self.texts[person_id]]
+
+
+class EntityResolver:
+    """Поиск дубликатов людей: блокировка по идентификаторам и вариантам имени, оценка пар"""
+
+    # Вклад совпадений в оценку пары
+    WEIGHTS = {
+        'inn': 0.6,
+        'snils': 0.6,
+        'passports': 0.5,
+        'driver_license': 0.4,
+        'phones': 0.25,
+        'emails': 0.25,
+    }
+    CONFLICT_PENALTY = 0.6  # Разные ИНН/СНИЛС у обоих
+    BIRTH_DATE_MATCH = 0.2
+    BIRTH_DATE_CONFLICT = 0.5
+    CANDIDATE_THRESHOLD = 0.5
+    AUTO_MERGE_THRESHOLD = 0.9
+    # Блоки больше этого размера (общий телефон офиса, частое имя) не раскрываются в пары
+    MAX_BLOCK_SIZE = 50
+
+    def __init__(self, people):
+        self.people = people
+
+    @staticmethod
+    def digits(value):
+        return re.sub(r'\D', '', value or '')
+
+    @classmethod
+    def phone_key(cls, phone):
+        # +7/8 в начале не важны - сравниваем последние 10 цифр
+        return cls.digits(phone)[-10:]
+
+    @staticmethod
+    def name_tokens(name):
+        return tuple(name.lower().replace('ё', 'е').split())
+
+    @classmethod
+    def name_variants(cls, person):
+        """Основное имя и все алиасы в виде кортежей слов"""
+        variants = {cls.name_tokens(person.full_name)}
+        variants.update(cls.name_tokens(alias) for alias in person.values('aliases'))
+        variants.discard(())
+        return variants
+
+    @classmethod
+    def identifiers(cls, person):
+        """Нормализованные идентификаторы человека по видам"""
+        return {
+            'inn': {cls.digits(person.inn)} - {''},
+            'snils': {cls.digits(person.snils)} - {''},
+            'passports': {cls.digits(passport) for passport in person.values('passports')} - {''},
+            'driver_license': {cls.digits(person.driver_license)} - {''},
+            'phones': {cls.phone_key(phone) for phone in person.values('phones')} - {''},
+            'emails': {email.lower() for email in person.values('emails')},
+        }
+
+    @classmethod
+    def blocking_keys(cls, person, identifiers=None):
+        identifiers = identifiers if identifiers is not None else cls.identifiers(person)
+        for kind, values in identifiers.items():
+            for value in values:
+                yield kind, value
+
+        for tokens in cls.name_variants(person):
+            surname = tokens[0]
+            first_name = tokens[1] if len(tokens) > 1 else ''
+            # Фамилия + инициал + дата рождения - узкий блок, фамилия + имя - широкий
+            yield 'name_birth', surname, first_name[:1], person.birth_date
+            if first_name:
+                yield 'name', surname, first_name
+
+    @classmethod
+    def name_score(cls, person1, person2):
+        best = 0.0
+        for tokens1 in cls.name_variants(person1):
+            for tokens2 in cls.name_variants(person2):
+                if tokens1 == tokens2:
+                    return 0.3
+                if tokens1[0] != tokens2[0]:
+                    continue
+                if len(tokens1) > 1 and len(tokens2) > 1:
+                    if tokens1[1] == tokens2[1]:
+                        best = max(best, 0.2)
+                    elif tokens1[1][:1] == tokens2[1][:1]:
+                        best = max(best, 0.1)
+        return best
+
+    def score(self, person1, person2, identifiers1=None, identifiers2=None):
+        """Оценка того, что это один и тот же человек, от 0 до 1, и причины"""
+        identifiers1 = identifiers1 if identifiers1 is not None else self.identifiers(person1)
+        identifiers2 = identifiers2 if identifiers2 is not None else self.identifiers(person2)
+        score = 0.0
+        reasons = []
+
+        for kind, weight in self.WEIGHTS.items():
+            values1, values2 = identifiers1[kind], identifiers2[kind]
+            if values1 & values2:
+                score += weight
+                reasons.append(kind)
+            elif kind in ('inn', 'snils') and values1 and values2:
+                score -= self.CONFLICT_PENALTY
+                reasons.append(f"разные {kind}")
+
+        if person1.birth_date and person2.birth_date:
+            if person1.birth_date == person2.birth_date:
+                score += self.BIRTH_DATE_MATCH
+                reasons.append('birth_date')
+            else:
+                score -= self.BIRTH_DATE_CONFLICT
+                reasons.append('разные birth_date')
+
+        name_score = self.name_score(person1, person2)
+        if name_score:
+            score += name_score
+            reasons.append('name')
+
+        return max(0.0, min(1.0, score)), reasons
+
+    def candidates(self, min_score=None):
+        """Ранжированный список кандидатов на объединение: [(оценка, человек1, человек2, причины)]"""
+        min_score = self.CANDIDATE_THRESHOLD if min_score is None else min_score
+        identifiers = {}
+        blocks = defaultdict(list)
+        for person in self.people.values():
+            identifiers[person.id] = self.identifiers(person)
+            for key in set(self.blocking_keys(person, identifiers[person.id])):
+                blocks[key].append(person)
+
+        seen = set()
+        result = []
+        for members in blocks.values():
+            if len(members) < 2 or len(members) > self.MAX_BLOCK_SIZE:
+                continue
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    person1, person2 = members[i], members[j]
+                    pair = (person1.id, person2.id) if person1.id < person2.id else (person2.id, person1.id)
+                    if pair in seen:
+                        continue
+                    seen.add(pair)
+
+                    score, reasons = self.score(person1, person2, identifiers[person1.id], identifiers[person2.id])
+                    if score >= min_score:
+                        result.append((score, person1, person2, reasons))
+
+        result.sort(key=lambda candidate: candidate[0], reverse=True)
+        return result
+
+    def merge_groups(self, candidates, threshold=None):
+        """Объединяет кандидатов выше порога в группы (union-find).
+
+        Группы с разными ИНН или СНИЛС не склеиваются через третьего человека.
+        """
+        threshold = self.AUTO_MERGE_THRESHOLD if threshold is None else threshold
+        parent = {}
+        members = {}
+
+        def find(person):
+            root = person
+            while parent[root.id] is not root:
+                root = parent[root.id]
+            while parent[person.id] is not root:
+                parent[person.id], person = root, parent[person.id]
+            return root
+
+        def group_ids(root, kind):
+            return {value for person in members[root.id] for value in self.identifiers(person)[kind]}
+
+        for score, person1, person2, _ in candidates:
+            if score < threshold:
+                break
+            for person in (person1, person2):
+                if person.id not in parent:
+                    parent[person.id] = person
+                    members[person.id] = [person]
+
+            root1, root2 = find(person1), find(person2)
+            if root1 is root2:
+                continue
+            if any(len(group_ids(root1, kind) | group_ids(root2, kind)) > 1 for kind in ('inn', 'snils')):
+                continue
+
+            if len(members[root1.id]) < len(members[root2.id]):
+                root1, root2 = root2, root1
+            parent[root2.id] = root1
+            members[root1.id].extend(members.pop(root2.id))
+
+        return [group for group in members.values() if len(group) > 1]
+
+
+class SQLiteDataset:
+    """Хранение данных в SQLite (режим WAL): люди, их идентификаторы, связи и файлы-источники"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS persons (
+            id TEXT PRIMARY KEY,
+            full_name TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            birth_date TEXT,
+            display TEXT NOT NULL,
+            search_text TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS identifiers (
+            person_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS relations (
+            owner_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            related TEXT NOT NULL,
+            is_person INTEGER NOT NULL,
+            details TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS documents (
+            source_file TEXT NOT NULL,
+            person_id TEXT NOT NULL,
+            PRIMARY KEY (source_file, person_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS hidden_pairs (
+            a TEXT NOT NULL,
+            b TEXT NOT NULL,
+            PRIMARY KEY (a, b)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS persons_name ON persons (name_key);
+        CREATE INDEX IF NOT EXISTS persons_display ON persons (display);
+        CREATE INDEX IF NOT EXISTS identifiers_value ON identifiers (kind, value);
+        CREATE INDEX IF NOT EXISTS identifiers_person ON identifiers (person_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS relations_key ON relations (owner_id, type, related);
+        CREATE INDEX IF NOT EXISTS relations_related ON relations (related);
+        CREATE INDEX IF NOT EXISTS documents_person ON documents (person_id);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM persons").fetchone()[0]
+
+    def summary_counts(self):
+        """Количества значений полей и связей у каждого человека - по записям базы, без загрузки людей.
+
+        Строки: (id, телефоны, email, адреса, связи, места работы, соцсети, банковские счета).
+        Связи «из одного файла» оцениваются по размерам файлов (без учета скрытых).
+        """
+        return self.connection.execute("""
+            WITH file_sizes AS (SELECT source_file, COUNT(*) AS size FROM documents GROUP BY source_file),
+                 cooccurring AS (SELECT person_id, SUM(size - 1) AS n FROM documents
+                                 JOIN file_sizes USING (source_file) GROUP BY person_id),
+                 owned AS (SELECT owner_id, COUNT(*) AS n FROM relations GROUP BY owner_id)
+            SELECT id,
+                   COALESCE(json_array_length(data, '$.phones'), 0),
+                   COALESCE(json_array_length(data, '$.emails'), 0),
+                   COALESCE(json_array_length(data, '$.addresses'), 0),
+                   COALESCE(owned.n, 0) + COALESCE(cooccurring.n, 0),
+                   COALESCE(json_array_length(data, '$.jobs'), 0),
+                   (SELECT COUNT(*) FROM json_each(data, '$.social_media')),
+                   COALESCE(json_array_length(data, '$.bank_accounts'), 0)
+            FROM persons
+            LEFT JOIN owned ON owned.owner_id = persons.id
+            LEFT JOIN cooccurring ON cooccurring.person_id = persons.id
+        """)
+
+    def shared_identifiers(self, kind, limit=5):
+        """Значения идентификатора, общие у нескольких людей: [(значение, [ФИО])]"""
+        rows = self.connection.execute(
+            "SELECT value, group_concat(full_name, char(31)) FROM identifiers JOIN persons ON persons.id = person_id "
+            "WHERE kind = ? GROUP BY value HAVING COUNT(*) > 1 LIMIT ?", (kind, limit))
+        return [(value, names.split('\x1f')) for value, names in rows]
+
+    def write_people(self, people, relation_store, partial_ids=(), removed_relations=()):
+        """Сохраняет людей, их идентификаторы, файлы и связи одной транзакцией.
+
+        У людей из partial_ids в памяти не все связи, поэтому их связи в базе только дополняются.
+        """
+        dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+        with self.connection:
+            execute = self.connection.execute
+            executemany = self.connection.executemany
+            for person in people:
+                person_id = person.id
+                execute("INSERT OR REPLACE INTO persons VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (person_id, person.full_name, PersonRegistry.name_key(person.full_name), person.birth_date,
+                         str(person), SearchIndex.text_of(person), dumps(person.to_row())))
+
+                execute("DELETE FROM identifiers WHERE person_id = ?", (person_id,))
+                executemany("INSERT INTO identifiers VALUES (?, ?, ?)",
+                            ((person_id, kind, value)
+                             for kind, values in EntityResolver.identifiers(person).items() for value in values))
+
+                execute("DELETE FROM documents WHERE person_id = ?", (person_id,))
+                executemany("INSERT INTO documents VALUES (?, ?)",
+                            ((source_file, person_id) for source_file in person.values('source_files')))
+
+                if person_id not in partial_ids:
+                    execute("DELETE FROM relations WHERE owner_id = ?", (person_id,))
+                executemany("INSERT OR IGNORE INTO relations VALUES (?, ?, ?, ?, ?)",
+                            ((person_id, relation_type, RelationStore.related_key(related_person),
+                              isinstance(related_person, Person), dumps(dict(frozen_details)))
+                             for relation_type, related_person, frozen_details
+                             in relation_store.explicit_relations(person)))
+
+            executemany("DELETE FROM relations WHERE owner_id = ? AND type = ? AND related = ?", removed_relations)
+            executemany("INSERT OR IGNORE INTO hidden_pairs VALUES (?, ?)",
+                        (sorted(pair) for pair in relation_store.hidden_cooccurrences))
+
+    def delete_people(self, person_ids):
+        with self.connection:
+            for person_id in person_ids:
+                self.connection.execute("DELETE FROM persons WHERE id = ?", (person_id,))
+                self.connection.execute("DELETE FROM identifiers WHERE person_id = ?", (person_id,))
+                self.connection.execute("DELETE FROM documents WHERE person_id = ?", (person_id,))
+                self.connection.execute("DELETE FROM relations WHERE owner_id = ? OR (related = ? AND is_person)",
+                                        (person_id, person_id))
+                self.connection.execute("DELETE FROM hidden_pairs WHERE a = ? OR b = ?", (person_id, person_id))
+
+    def displays_after(self, display, limit):
+        """Строки списка (id, строка) по порядку, начиная после display (None - с начала)"""
+        if display is None:
+            return self.connection.execute("SELECT id, display FROM persons ORDER BY display LIMIT ?",
+                                           (limit,)).fetchall()
+        return self.connection.execute("SELECT id, display FROM persons WHERE display > ? ORDER BY display LIMIT ?",
+                                       (display, limit)).fetchall()
+
+    def person_row(self, person_id):
+        row = self.connection.execute("SELECT data FROM persons WHERE id = ?", (person_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _ids(self, query, params):
+        return [row[0] for row in self.connection.execute(query, params)]
+
+    def ids_by_display(self, display):
+        return self._ids("SELECT id FROM persons WHERE display = ?", (display,))
+
+    def ids_by_name(self, name):
+        return self._ids("SELECT id FROM persons WHERE name_key = ?", (PersonRegistry.name_key(name),))
+
+    def ids_by_identifier(self, kind, value):
+        """Люди с идентификатором (kind - как в EntityResolver.identifiers, значение уже нормализовано)"""
+        return self._ids("SELECT person_id FROM identifiers WHERE kind = ? AND value = ?", (kind, value))
+
+    def search_ids(self, query, limit=1000):
+        """Поиск подстроки по всем полям (как в SearchIndex)"""
+        return self._ids("SELECT id FROM persons WHERE instr(search_text, ?) > 0 LIMIT ?", (query.lower(), limit))
+
+    def relations_of(self, person_id):
+        """Связи, где человек - владелец или связанный: (владелец, тип, связанный, это человек, детали)"""
+        return self.connection.execute(
+            "SELECT owner_id, type, related, is_person, details FROM relations WHERE owner_id = ? "
+            "UNION ALL "
+            "SELECT owner_id, type, related, is_person, details FROM relations WHERE related = ? AND is_person",
+            (person_id, person_id)).fetchall()
+
+    def document_members(self, source_files):
+        members = []
+        for source_file in source_files:
+            members.extend(self._ids("SELECT person_id FROM documents WHERE source_file = ?", (source_file,)))
+        return members
+
+    def hidden_pairs(self, person_id):
+        return self.connection.execute("SELECT a, b FROM hidden_pairs WHERE a = ? OR b = ?",
+                                       (person_id, person_id)).fetchall()
+
+
+class LazyPersonLoader:
+    """Подгружает людей из SQLiteDataset в реестр при первом обращении.
+
+    Человек сначала загружается без связей; связи, соседи и люди из тех же файлов
+    подгружаются, когда человек открыт в интерфейсе (hydrate).
+    """
+
+    def __init__(self, dataset, people, relation_store):
+        self.dataset = dataset
+        self.people = people
+        self.relation_store = relation_store
+        self.loaded = set()  # id людей, загруженных из базы
+        self.complete = set()  # id людей, у которых загружены и связи
+        self.deleted = set()
+        self.removed_relations = set()
+        people.loader = self
+        people.listeners.append(self)
+        relation_store.listeners.append(self)
+
+    def person_added(self, person):
+        self.deleted.discard(person.id)
+
+    def person_removed(self, person):
+        if person.id in self.loaded:
+            self.deleted.add(person.id)
+
+    def relation_added(self, owner_id, relation_type, related_person, frozen_details):
+        self.removed_relations.discard((owner_id, relation_type, RelationStore.related_key(related_person)))
+
+    def relation_removed(self, owner_id, relation_type, related_person):
+        self.removed_relations.add((owner_id, relation_type, RelationStore.related_key(related_person)))
+
+    def document_member_added(self, source_file, person):
+        pass
+
+    def document_member_removed(self, source_file, person):
+        pass
+
+    def cooccurrence_hidden(self, person, related_person):
+        pass
+
+    def _load(self, person_id):
+        """Загружает человека без связей"""
+        person = self.people.by_id.get(person_id)
+        if person is not None or person_id in self.deleted:
+            return person
+
+        row = self.dataset.person_row(person_id)
+        if row is None:
+            return None
+        person = Person.from_dict(row, relation_store=self.relation_store)
+        key = PersonRegistry.person_key(person)
+        if key in self.people:
+            # Человек с тем же именем и датой уже создан в памяти
+            return self.people[key]
+        self.loaded.add(person_id)
+        self.people[key] = person
+        return person
+
+    def hydrate(self, person_id):
+        """Загружает человека вместе со связями, соседями и людьми из тех же файлов"""
+        person = self._load(person_id)
+        if person is None or person_id in self.complete or person_id not in self.loaded:
+            return person
+        self.complete.add(person_id)
+
+        for owner_id, relation_type, related, is_person, details in self.dataset.relations_of(person_id):
+            owner = self._load(owner_id)
+            related_person = self._load(related) if is_person else related
+            if owner is not None and related_person is not None:
+                self.relation_store.add(owner, relation_type, related_person,
+                                        RelationStore.freeze_details(json.loads(details)))
+
+        for member_id in self.dataset.document_members(person.values('source_files')):
+            self._load(member_id)
+        for pair in self.dataset.hidden_pairs(person_id):
+            self.relation_store.hidden_cooccurrences.add(frozenset(pair))
+        return person
+
+    def load_by_id(self, person_id):
+        return self.hydrate(person_id)
+
+    def load_by_display(self, display):
+        ids = self.dataset.ids_by_display(display)
+        return self.hydrate(ids[0]) if ids else None
+
+    def load_by_name(self, name):
+        ids = self.dataset.ids_by_name(name)
+        return self.hydrate(ids[0]) if ids else None
+
+    def search(self, query, limit=1000):
+        """Ищет в базе и загружает найденных (без связей), возвращает их id"""
+        found = []
+        for person_id in self.dataset.search_ids(query, limit):
+            person = self._load(person_id)
+            if person is not None:
+                found.append(person.id)
+        return found
+
+    def save(self):
+        """Записывает людей из памяти в базу"""
+        people = list(self.people.values())
+        partial = self.loaded - self.complete
+        self.dataset.write_people(people, self.relation_store, partial, self.removed_relations)
+        self.dataset.delete_people(self.deleted)
+        self.deleted.clear()
+        self.removed_relations.clear()
+        for person in people:
+            self.loaded.add(person.id)
+            if person.id not in partial:
+                self.complete.add(person.id)
+
+
+LAYOUT_PARAMS = {
+    'force_atlas': {'iterations': 100, 'scaling': 2.0, 'gravity': 1.0},
+    'fruchterman': {'k': 0.5},
+    'circular': {},
+}
+LAYOUT_SEED = 42  # Одинаковый граф без кэша раскладывается одинаково
+
+
+class ForceAtlas2:
+    """Раскладка ForceAtlas2 на NumPy
+
+    Масса узла - степень + 1, отталкивание k*m1*m2/d, линейное притяжение по связям,
+    гравитация к центру и адаптивная скорость (общая и для каждого узла), как в Gephi.
+    Отталкивание считается приближенно, по идее Барнса-Хата: квадродерево - это
+    регулярные сетки уровней, ячейки заменяются центрами масс. Поле дальних ячеек
+    собирается в локальные разложения (в 2D сила 1/d - это комплексное поле
+    sum(M / (z - Z))), так что каждая ячейка считается один раз для всех своих узлов.
+    Соседние ячейки самого мелкого уровня считаются точно.
+    """
+
+    JITTER_TOLERANCE = 1.0
+    MAX_NEAR_PAIRS = 64  # в среднем на узел; больше - сетка мельче
+    MAX_LEVEL = 10
+    EXPANSION_TERMS = 4
+    NEAR_OFFSETS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))  # Каждая пара соседних ячеек - один раз
+
+    def __init__(self, graph, initial=None, scaling=2.0, gravity=1.0, seed=LAYOUT_SEED):
+        self.nodes = list(graph)
+        index = {node: i for i, node in enumerate(self.nodes)}
+        n = len(self.nodes)
+        rng = np.random.default_rng(seed)
+        self.pos = rng.uniform(-1, 1, (n, 2)) * max(10.0, math.sqrt(n) * 10)
+        if initial:
+            for node, xy in initial.items():
+                i = index.get(node)
+                if i is not None:
+                    self.pos[i] = xy
+
+        edges = np.array([(index[u], index[v]) for u, v in graph.edges() if u != v], dtype=np.int64).reshape(-1, 2)
+        self.sources, self.targets = edges[:, 0], edges[:, 1]
+        self.mass = np.bincount(edges.ravel(), minlength=n).astype(float) + 1.0
+        self.scaling = scaling
+        self.gravity = gravity
+        self.speed = 1.0
+        self.speed_efficiency = 1.0
+        self.old_forces = np.zeros((n, 2))
+        terms = self.EXPANSION_TERMS
+        self.binomials = np.array([[math.comb(k, m) for k in range(terms)] for m in range(terms)], dtype=float)
+
+    def positions(self):
+        return {node: (float(x), float(y)) for node, (x, y) in zip(self.nodes, self.pos)}
+
+    def run(self, iterations):
+        for _ in range(iterations):
+            self.step()
+        return self.positions()
+
+    def step(self):
+        pos, mass = self.pos, self.mass
+        n = len(pos)
+        if not n:
+            return
+        forces = self._repulsion()
+
+        # Притяжение по связям
+        d = pos[self.targets] - pos[self.sources]
+        for axis in (0, 1):
+            forces[:, axis] += (np.bincount(self.sources, weights=d[:, axis], minlength=n) -
+                                np.bincount(self.targets, weights=d[:, axis], minlength=n))
+
+        # Гравитация
+        distance = np.maximum(np.hypot(pos[:, 0], pos[:, 1]), 1e-9)
+        forces -= pos * (self.gravity * mass / distance)[:, None]
+
+        # Адаптивная скорость: насколько узлы «раскачиваются» и насколько реально движутся
+        swinging = mass * np.hypot(*(self.old_forces - forces).T)
+        traction = mass * 0.5 * np.hypot(*(self.old_forces + forces).T)
+        total_swinging, total_traction = swinging.sum(), traction.sum()
+        estimated_jitter = 0.05 * math.sqrt(n)
+        jitter = self.JITTER_TOLERANCE * max(math.sqrt(estimated_jitter),
+                                             min(10.0, estimated_jitter * total_traction / n ** 2))
+        if total_traction > 0 and total_swinging / total_traction > 2.0:
+            if self.speed_efficiency > 0.05:
+                self.speed_efficiency *= 0.5
+            jitter = max(jitter, self.JITTER_TOLERANCE)
+        target_speed = jitter * self.speed_efficiency * total_traction / max(total_swinging, 1e-12)
+        if total_swinging > jitter * total_traction:
+            if self.speed_efficiency > 0.05:
+                self.speed_efficiency *= 0.7
+        elif self.speed < 1000:
+            self.speed_efficiency *= 1.3
+        self.speed += min(target_speed - self.speed, 0.5 * self.speed)
+
+        pos += forces * (self.speed / (1.0 + np.sqrt(self.speed * swinging)))[:, None]
+        self.old_forces = forces
+
+    def _repulsion(self):
+        pos, mass = self.pos, self.mass
+        n = len(pos)
+        terms = self.EXPANSION_TERMS
+        low = pos.min(axis=0)
+        extent = max(float((pos.max(axis=0) - low).max()), 1e-9) * (1 + 1e-9)
+
+        # Самый мелкий уровень: соседних пар не больше MAX_NEAR_PAIRS на узел
+        level = max(2, min(self.MAX_LEVEL, math.ceil(math.log(max(n, 4) / 4, 4))))
+        while True:
+            size = 1 << level
+            cells = np.minimum(((pos - low) / extent * size).astype(np.int64), size - 1)
+            flat = cells[:, 1] * size + cells[:, 0]
+            counts = np.bincount(flat, minlength=size * size)
+            grid = np.pad(counts.reshape(size, size), 1)
+            around = sum(grid[1 + dy:1 + dy + size, 1 + dx:1 + dx + size] for dy in (-1, 0, 1) for dx in (-1, 0, 1))
+            if (counts.reshape(size, size) * around).sum() <= self.MAX_NEAR_PAIRS * n or level >= self.MAX_LEVEL:
+                break
+            level += 1
+
+        # Ближние пары - точно (сила здесь и ниже - на единицу массы узла)
+        forces = np.zeros((n, 2))
+        self._near_field(forces, cells, flat, counts, size)
+
+        # Массы и центры масс ячеек всех уровней, снизу вверх
+        cell_mass = np.bincount(flat, weights=mass, minlength=size * size)
+        cell_moment = (np.bincount(flat, weights=mass * pos[:, 0], minlength=size * size) +
+                       1j * np.bincount(flat, weights=mass * pos[:, 1], minlength=size * size))
+        levels = []
+        while size >= 4:
+            levels.append((size, cell_mass, cell_moment))
+            size //= 2
+            cell_mass = cell_mass.reshape(size, 2, size, 2).sum(axis=(1, 3)).ravel()
+            cell_moment = cell_moment.reshape(size, 2, size, 2).sum(axis=(1, 3)).ravel()
+
+        # Сверху вниз: разложение поля в центре каждой занятой ячейки. Поле от ячеек,
+        # не соседних с ней, но соседних с ее родителем, добавляется на этом уровне,
+        # остальное приходит от родителя (сдвиг разложения в центр дочерней ячейки).
+        origin = low[0] + 1j * low[1]
+        parent = None
+        for size, cell_mass, cell_moment in reversed(levels):
+            occupied = np.nonzero(cell_mass)[0]
+            tx, ty = occupied % size, occupied // size
+            centers = origin + ((tx + 0.5) + 1j * (ty + 0.5)) * (extent / size)
+            centers_of_mass = np.zeros(size * size, dtype=complex)
+            centers_of_mass[occupied] = cell_moment[occupied] / cell_mass[occupied]
+
+            coeffs = np.zeros((terms, len(occupied)), dtype=complex)
+            if parent is not None:
+                parent_size, parent_index, parent_coeffs, parent_centers = parent
+                pi = parent_index[(ty // 2) * parent_size + tx // 2]
+                powers = (centers - parent_centers[pi])[None, :] ** np.arange(terms)[:, None]
+                inherited = parent_coeffs[:, pi]
+                for m in range(terms):
+                    coeffs[m] = (self.binomials[m, m:, None] * inherited[m:] * powers[:terms - m]).sum(axis=0)
+
+            px, py = tx // 2, ty // 2
+            for ox in range(-2, 4):
+                sx = 2 * px + ox
+                for oy in range(-2, 4):
+                    sy = 2 * py + oy
+                    far = ((sx >= 0) & (sx < size) & (sy >= 0) & (sy < size) &
+                           ~((np.abs(sx - tx) <= 1) & (np.abs(sy - ty) <= 1)))
+                    targets = np.nonzero(far)[0]
+                    sources = sy[targets] * size + sx[targets]
+                    source_mass = cell_mass[sources]
+                    filled = source_mass > 0
+                    targets, sources, source_mass = targets[filled], sources[filled], source_mass[filled]
+                    inverse = 1.0 / (centers_of_mass[sources] - centers[targets])
+                    term = -source_mass * inverse
+                    for k in range(terms):
+                        coeffs[k, targets] += term
+                        term = term * inverse
+
+            index = np.zeros(size * size, dtype=np.int64)
+            index[occupied] = np.arange(len(occupied))
+            parent = (size, index, coeffs, centers)
+
+        # Значение разложения в точках узлов (сила - сопряженное значение поля)
+        _, index, coeffs, centers = parent
+        cell_index = index[flat]
+        offset = (pos[:, 0] + 1j * pos[:, 1]) - centers[cell_index]
+        field = coeffs[terms - 1, cell_index]
+        for k in range(terms - 2, -1, -1):
+            field = field * offset + coeffs[k, cell_index]
+        forces[:, 0] += field.real
+        forces[:, 1] -= field.imag
+        return forces * (self.scaling * mass)[:, None]
+
+    def _near_field(self, forces, cells, flat, counts, size):
+        x, y, mass = self.pos[:, 0], self.pos[:, 1], self.mass
+        n = len(x)
+        order = np.argsort(flat, kind='stable')
+        starts = np.cumsum(counts) - counts
+        for dx, dy in self.NEAR_OFFSETS:
+            cx, cy = cells[:, 0] + dx, cells[:, 1] + dy
+            i = np.nonzero((cx >= 0) & (cx < size) & (cy >= 0) & (cy < size))[0]
+            neighbor_cells = cy[i] * size + cx[i]
+            k = counts[neighbor_cells]
+            total = int(k.sum())
+            if not total:
+                continue
+            # Все пары (узел, узел соседней ячейки) одним массивом
+            ii = np.repeat(i, k)
+            jj = order[np.repeat(starts[neighbor_cells] - (np.cumsum(k) - k), k) + np.arange(total)]
+            if (dx, dy) == (0, 0):
+                keep = ii < jj
+                ii, jj = ii[keep], jj[keep]
+            ddx = x[ii] - x[jj]
+            ddy = y[ii] - y[jj]
+            inverse = 1.0 / np.maximum(ddx * ddx + ddy * ddy, 1e-6)
+            ddx *= inverse
+            ddy *= inverse
+            mi, mj = mass[ii], mass[jj]
+            forces[:, 0] += np.bincount(ii, weights=ddx * mj, minlength=n) - np.bincount(jj, weights=ddx * mi, minlength=n)
+            forces[:, 1] += np.bincount(ii, weights=ddy * mj, minlength=n) - np.bincount(jj, weights=ddy * mi, minlength=n)
+
+
+def force_atlas_engine(graph, params, initial=None):
+    """ForceAtlas2 для графа и число итераций (при теплом старте - меньше)"""
+    params = dict(params)
+    iterations = params.pop('iterations')
+    if initial is not None:
+        iterations = LayoutCache.WARM_ITERATIONS
+    return ForceAtlas2(graph, initial, seed=LAYOUT_SEED, **params), iterations
+
+
+def compute_layout(graph, algorithm, params, initial=None):
+    """Раскладка графа выбранным алгоритмом; initial - начальные позиции (теплый старт)"""
+    if algorithm == 'circular':
+        return nx.circular_layout(graph)
+    if algorithm == 'force_atlas':
+        engine, iterations = force_atlas_engine(graph, params, initial)
+        return engine.run(iterations)
+    if initial is not None:
+        params = dict(params, iterations=LayoutCache.WARM_ITERATIONS)
+    return nx.fruchterman_reingold_layout(graph, pos=initial, seed=LAYOUT_SEED, **params)
+
+
+class LayoutCache:
+    """Кэш раскладок по (хэш узлов и ребер, алгоритм, параметры)
+
+    Повторный показ того же подграфа не пересчитывает раскладку. Если подграф изменился,
+    расчет начинается с позиций последней раскладки с теми же настройками, где есть общие
+    узлы, - картинка почти не сдвигается, а итераций нужно меньше.
+    """
+
+    MAX_ENTRIES = 32
+    WARM_ITERATIONS = 15
+
+    def __init__(self):
+        self.entries = OrderedDict()  # ключ -> {узел: (x, y)}
+
+    @staticmethod
+    def graph_hash(graph):
+        digest = hashlib.blake2b(digest_size=16)
+        for node in sorted(map(repr, graph.nodes)):
+            digest.update(node.encode('utf-8') + b'\0')
+        digest.update(b'\1')
+        for edge in sorted('\0'.join(sorted((repr(u), repr(v)))) for u, v in graph.edges):
+            digest.update(edge.encode('utf-8') + b'\1')
+        return digest.hexdigest()
+
+    def key(self, graph, algorithm, params):
+        return self.graph_hash(graph), algorithm, tuple(sorted(params.items()))
+
+    def get(self, key):
+        positions = self.entries.get(key)
+        if positions is not None:
+            self.entries.move_to_end(key)
+        return positions
+
+    def put(self, key, positions):
+        self.entries[key] = {node: (float(x), float(y)) for node, (x, y) in positions.items()}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.MAX_ENTRIES:
+            self.entries.popitem(last=False)
+        return self.entries[key]
+
+    def warm_start(self, graph, key):
+        """Начальные позиции из последней раскладки с теми же настройками, или None"""
+        _, algorithm, params = key
+        for (_, cached_algorithm, cached_params), positions in reversed(self.entries.items()):
+            if cached_algorithm != algorithm or cached_params != params:
+                continue
+            known = {node: positions[node] for node in graph if node in positions}
+            if not known:
+                continue
+            # Новые узлы - рядом с уже размещенными соседями (разброс - в масштабе этой раскладки)
+            xs = [pos[0] for pos in known.values()]
+            ys = [pos[1] for pos in known.values()]
+            low_x, high_x, low_y, high_y = min(xs), max(xs), min(ys), max(ys)
+            jitter = max(high_x - low_x, high_y - low_y, 1e-3) * 0.025
+            rng = random.Random(LAYOUT_SEED)
+            initial = {}
+            for node in graph:
+                if node in known:
+                    initial[node] = known[node]
+                    continue
+                placed = [known[neighbor] for neighbor in graph[node] if neighbor in known]
+                if placed:
+                    x = sum(pos[0] for pos in placed) / len(placed)
+                    y = sum(pos[1] for pos in placed) / len(placed)
+                    initial[node] = (x + rng.uniform(-jitter, jitter), y + rng.uniform(-jitter, jitter))
+                else:
+                    initial[node] = (rng.uniform(low_x, high_x), rng.uniform(low_y, high_y))
+            return initial
+        return None
+
+    def lookup(self, graph, algorithm, params):
+        """Ключ раскладки и ее позиции из кэша (или None)"""
+        key = self.key(graph, algorithm, params)
+        return key, self.get(key)
+
+    def layout(self, graph, algorithm, params):
+        key, positions = self.lookup(graph, algorithm, params)
+        if positions is None:
+            positions = self.put(key, compute_layout(graph, algorithm, params, self.warm_start(graph, key)))
+        return positions
+
+
+class LayoutJob:
+    """Раскладка графа в фоновом потоке
+
+    ForceAtlas2 отдает промежуточные позиции каждые PROGRESS_ITERATIONS итераций (не чаще
+    PROGRESS_INTERVAL) и останавливается по запросу на текущих позициях. Раскладки
+    networkx считаются целиком, остановка только отменяет ожидание. События забираются
+    из главного потока (после after()): ('progress', итерация, всего, позиции) и
+    ('done', позиции, ошибка).
+    """
+
+    PROGRESS_ITERATIONS = 10
+    PROGRESS_INTERVAL = 0.5  # с
+
+    def __init__(self, graph, algorithm, params, initial=None, key=None):
+        self.key = key
+        self.algorithm = algorithm
+        self.params = params
+        self.initial = initial
+        self.latest = initial  # Последние показанные позиции (обновляет главный поток)
+        # Граф копируется здесь, в главном потоке: пока идет раскладка, его можно менять
+        if algorithm == 'force_atlas':
+            self.engine, self.iterations = force_atlas_engine(graph, params, initial)
+            self.graph = None
+        else:
+            self.engine, self.iterations = None, None
+            self.graph = graph.copy()
+        self.events = queue.SimpleQueue()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Просит закончить раскладку досрочно (ForceAtlas2 вернет текущие позиции)"""
+        self.stop_event.set()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def collect(self):
+        while True:
+            try:
+                yield self.events.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run(self):
+        try:
+            if self.engine is None:
+                positions = compute_layout(self.graph, self.algorithm, self.params, self.initial)
+            else:
+                positions = self._run_force_atlas()
+        except Exception as e:
+            self.events.put(('done', None, e))
+        else:
+            self.events.put(('done', positions, None))
+
+    def _run_force_atlas(self):
+        last_progress = time.monotonic()
+        for iteration in range(1, self.iterations + 1):
+            if self.stopped:
+                break
+            self.engine.step()
+            if (iteration % self.PROGRESS_ITERATIONS == 0 and iteration < self.iterations and
+                    time.monotonic() - last_progress >= self.PROGRESS_INTERVAL):
+                self.events.put(('progress', iteration, self.iterations, self.engine.positions()))
+                last_progress = time.monotonic()
+        return self.engine.positions()
+
+
+class SceneNode:
+    """Узел сцены графа в мировых координатах (человек, имя без карточки, файл или группа соседей)"""
+
+    __slots__ = ('key', 'tag', 'item_tag', 'x', 'y', 'label', 'color', 'outline', 'text_color',
+                 'font_size', 'kind', 'person', 'children', 'expanded')
+
+    serial = itertools.count()
+
+    def __init__(self, key, tag, label, color, outline='#8b4513', text_color='#8b4513', font_size=10,
+                 kind='person', person=None):
+        self.key = key
+        self.tag = tag  # Тег узла для find_by_tag (node_<ФИО>)
+        self.item_tag = f"n{next(self.serial)}"  # Уникальный тег элементов холста этого узла
+        self.x = self.y = 0.0
+        self.label = label
+        self.color = color
+        self.outline = outline
+        self.text_color = text_color
+        self.font_size = font_size
+        self.kind = kind
+        self.person = person
+        # У группы: (узлы, связи) свернутых соседей
+        self.children = None
+        self.expanded = False
+
+
+class SceneEdge:
+    """Связь сцены между узлами с ключами source и target"""
+
+    __slots__ = ('source', 'target', 'label', 'color', 'width', 'arrow', 'label_color')
+
+    def __init__(self, source, target, label='', color='#666666', width=2, arrow=tk.LAST, label_color='#333333'):
+        self.source = source
+        self.target = target
+        self.label = label
+        self.color = color
+        self.width = width
+        self.arrow = arrow
+        self.label_color = label_color
+
+
+class SpatialGrid:
+    """Равномерная сетка над узлами сцены (мировые координаты) для отсечения и поиска узла под курсором.
+
+    Ячейка размером с узел: поиск точки смотрит одну ячейку и соседние, прямоугольник -
+    только пересекающие его ячейки.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+    def cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def build(self, nodes):
+        self.cells.clear()
+        for node in nodes:
+            self.insert(node)
+
+    def insert(self, node):
+        self.cells[self.cell(node.x, node.y)].append(node)
+
+    def remove(self, node):
+        cell = self.cell(node.x, node.y)
+        bucket = self.cells.get(cell)
+        if bucket and node in bucket:
+            bucket.remove(node)
+            if not bucket:
+                del self.cells[cell]
+
+    def query_rect(self, x1, y1, x2, y2):
+        """Узлы, центры которых лежат в прямоугольнике"""
+        cx1, cy1 = self.cell(x1, y1)
+        cx2, cy2 = self.cell(x2, y2)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self.cells):
+            # Прямоугольник больше занятой области - дешевле пройти по занятым ячейкам
+            cells = (bucket for (cx, cy), bucket in self.cells.items() if cx1 <= cx <= cx2 and cy1 <= cy <= cy2)
+        else:
+            cells = (self.cells.get((cx, cy), ()) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1))
+        return [node for bucket in cells for node in bucket
+                if x1 <= node.x <= x2 and y1 <= node.y <= y2]
+
+    def nearest(self, x, y, rx, ry):
+        """Верхний узел, в эллипс (полуоси rx, ry) которого попадает точка, или None"""
+        cx1, cy1 = self.cell(x - rx, y - ry)
+        cx2, cy2 = self.cell(x + rx, y + ry)
+        best, best_distance = None, 1.0
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                for node in self.cells.get((cx, cy), ()):
+                    distance = ((node.x - x) / rx) ** 2 + ((node.y - y) / ry) ** 2
+                    if distance <= best_distance:
+                        best, best_distance = node, distance
+        return best
+
+
+class HighlightManager:
+    """Подсветка узла под курсором и его соседей
+
+    Помнит, какие узлы уже перекрашены, и при смене узла под курсором меняет цвет только
+    у разницы. Соседи узлов считаются один раз на сцену, события движения мыши
+    сливаются в одну проверку за кадр.
+    """
+
+    FRAME_DELAY = 16  # мс
+
+    def __init__(self, renderer, color='#ff0000', neighbor_color='#ffff00'):
+        self.renderer = renderer
+        self.color = color
+        self.neighbor_color = neighbor_color
+        self.neighbors = None  # ключ узла -> ключи соседей
+        self.hovered = None
+        self.applied = {}  # item_tag -> цвет подсветки, уже выставленный на холсте
+        self.pointer = None
+        self.pending = None
+
+    def scene_changed(self):
+        """Сцена изменилась: соседи пересчитываются при следующем наведении, новые элементы рисуются без подсветки"""
+        self.neighbors = None
+        self.hovered = None
+        self.applied = {}
+
+    def fill(self, node):
+        """Цвет, которым рисуется узел с учетом подсветки"""
+        return self.applied.get(node.item_tag, node.color)
+
+    def motion(self, event):
+        self.pointer = (event.x, event.y)
+        if self.pending is None:
+            self.pending = self.renderer.canvas.after(self.FRAME_DELAY, self._update)
+
+    def leave(self, event=None):
+        self.pointer = None
+        if self.pending is None:
+            self._update()
+
+    def _neighbor_map(self):
+        if self.neighbors is None:
+            self.neighbors = defaultdict(set)
+            for edge in self.renderer.edges:
+                self.neighbors[edge.source].add(edge.target)
+                self.neighbors[edge.target].add(edge.source)
+        return self.neighbors
+
+    def _update(self):
+        self.pending = None
+        node = self.renderer.node_at(*self.pointer) if self.pointer is not None else None
+        key = node.key if node is not None else None
+        if key == self.hovered:
+            return
+        self.hovered = key
+
+        target = {}
+        if node is not None:
+            nodes = self.renderer.nodes
+            for neighbor in self._neighbor_map().get(key, ()):
+                neighbor = nodes.get(neighbor)
+                if neighbor is not None:
+                    target[neighbor.item_tag] = self.neighbor_color
+            target[node.item_tag] = self.color
+
+        canvas = self.renderer.canvas
+        for item_tag, color in target.items():
+            if self.applied.get(item_tag) != color:
+                canvas.itemconfig(f"{item_tag}&&shape", fill=color)
+        for item_tag in self.applied.keys() - target.keys():
+            previous = self.renderer.item_nodes.get(item_tag)
+            if previous is not None:
+                canvas.itemconfig(f"{item_tag}&&shape", fill=previous.color)
+        self.applied = target
+
+
+class GraphRenderer:
+    """Отрисовка сцены графа на холсте с уровнями детализации.
+
+    Узлы и связи хранятся в мировых координатах, на холст попадает только видимая область.
+    Элементы создаются пачками через after(), а прежние удаляются, когда новые готовы.
+    Детализация зависит от масштаба и числа видимых узлов: узлы с подписями связей, узлы
+    с именами или точки. Группы соседей раскрываются и сворачиваются щелчком.
+    """
+
+    NODE_RX = 60
+    NODE_RY = 40
+    DOT_RADIUS = 10
+    BATCH_SIZE = 400
+    FULL_DETAIL_NODES = 150
+    NAME_DETAIL_NODES = 800
+    DOTS_EDGE_NODES = 5000  # Больше видимых точек - связи не рисуются
+    RENDER_DELAY = 120  # мс после панорамирования/масштабирования до перерисовки
+    CHILD_SPACING = 160
+    MARGIN = 80
+
+    def __init__(self, canvas, on_activate=None):
+        self.canvas = canvas
+        self.on_activate = on_activate  # Щелчок по узлу человека
+        self.nodes = {}
+        self.edges = []
+        self.item_nodes = {}
+        self.grid = SpatialGrid(2 * self.NODE_RX)
+        self.level = 'full'
+        self.scale = 1.0
+        self.offset_x = 0.0
+        self.offset_y = 0.0
+        self.generation = 0
+        self.drawn_generation = None
+        self.fitted_view = None
+        self.pending_render = None
+        self.drag_start = None
+        self.dragged = False
+        self.highlight = HighlightManager(self)
+
+        canvas.bind("<ButtonPress-1>", self.start_drag)
+        canvas.bind("<B1-Motion>", self.drag)
+        canvas.bind("<ButtonRelease-1>", self.end_drag)
+        canvas.bind("<MouseWheel>", lambda e: self.zoom_at(e.x, e.y, 1.1 if e.delta > 0 else 1 / 1.1))
+        canvas.bind("<Button-4>", lambda e: self.zoom_at(e.x, e.y, 1.1))
+        canvas.bind("<Button-5>", lambda e: self.zoom_at(e.x, e.y, 1 / 1.1))
+
+    # Сцена
+
+    def set_scene(self, nodes, edges):
+        """Новая сцена (узлы уже расставлены); индекс для поиска узлов строится заново"""
+        self.nodes = {node.key: node for node in nodes}
+        self.item_nodes = {node.item_tag: node for node in nodes}
+        self.edges = list(edges)
+        self.grid.build(self.nodes.values())
+        self.highlight.scene_changed()
+
+    def _add_nodes(self, nodes, edges):
+        for node in nodes:
+            self.nodes[node.key] = node
+            self.item_nodes[node.item_tag] = node
+            self.grid.insert(node)
+        self.edges.extend(edges)
+        self.highlight.scene_changed()
+
+    def toggle_group(self, group):
+        """Раскрывает группу (соседи кругом-подсолнухом за узлом группы) или сворачивает ее"""
+        children, child_edges = group.children
+        if group.expanded:
+            keys = {node.key for node in children}
+            for node in children:
+                self.nodes.pop(node.key, None)
+                self.item_nodes.pop(node.item_tag, None)
+                self.grid.remove(node)
+            self.edges = [edge for edge in self.edges if edge.source not in keys and edge.target not in keys]
+            self.highlight.scene_changed()
+        else:
+            # Центр раскрытой группы - дальше от центра сцены, чем узел группы
+            radius = self.CHILD_SPACING * 0.5 * math.sqrt(len(children))
+            distance = math.hypot(group.x, group.y) or 1.0
+            center_x = group.x + group.x / distance * (radius + self.CHILD_SPACING)
+            center_y = group.y + group.y / distance * (radius + self.CHILD_SPACING)
+            golden_angle = math.pi * (3 - math.sqrt(5))
+            for i, node in enumerate(children):
+                r = self.CHILD_SPACING * 0.5 * math.sqrt(i + 0.5)
+                node.x = center_x + r * math.cos(i * golden_angle)
+                node.y = center_y + r * math.sin(i * golden_angle)
+            self._add_nodes(children, child_edges)
+        group.expanded = not group.expanded
+        self.render()
+
+    # Вид
+
+    def size(self):
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        if width <= 1 or height <= 1:  # Холст еще не показан
+            width, height = int(self.canvas.cget('width')), int(self.canvas.cget('height'))
+        return width, height
+
+    def to_screen(self, x, y):
+        return x * self.scale + self.offset_x, y * self.scale + self.offset_y
+
+    def to_world(self, x, y):
+        return (x - self.offset_x) / self.scale, (y - self.offset_y) / self.scale
+
+    def fit(self, max_scale=1.0):
+        """Масштаб и сдвиг, при которых вся сцена помещается на холст"""
+        if not self.nodes:
+            return
+        width, height = self.size()
+        xs = [node.x for node in self.nodes.values()]
+        ys = [node.y for node in self.nodes.values()]
+        span_x = max(xs) - min(xs) + 2 * self.NODE_RX
+        span_y = max(ys) - min(ys) + 2 * self.NODE_RY
+        self.scale = min(max_scale, (width - self.MARGIN) / span_x, (height - self.MARGIN) / span_y)
+        self.offset_x = width / 2 - (max(xs) + min(xs)) / 2 * self.scale
+        self.offset_y = height / 2 - (max(ys) + min(ys)) / 2 * self.scale
+        self.fitted_view = (self.scale, self.offset_x, self.offset_y)
+
+    @property
+    def view_moved(self):
+        """Пользователь сдвигал или масштабировал вид после последнего fit()"""
+        return self.fitted_view is not None and self.fitted_view != (self.scale, self.offset_x, self.offset_y)
+
+    @property
+    def drawing(self):
+        """Последняя перерисовка еще не закончена"""
+        return self.generation != (self.drawn_generation or 0)
+
+    def visible_rect(self):
+        """Видимая область в мировых координатах (с запасом на размер узла)"""
+        width, height = self.size()
+        x1, y1 = self.to_world(-self.NODE_RX * self.scale, -self.NODE_RY * self.scale)
+        x2, y2 = self.to_world(width + self.NODE_RX * self.scale, height + self.NODE_RY * self.scale)
+        return x1, y1, x2, y2
+
+    def visible_nodes(self):
+        return self.grid.query_rect(*self.visible_rect())
+
+    def detail_level(self, visible_count):
+        if visible_count <= self.FULL_DETAIL_NODES and self.scale >= 0.5:
+            return 'full'
+        if visible_count <= self.NAME_DETAIL_NODES and self.scale >= 0.3:
+            return 'names'
+        return 'dots'
+
+    # Отрисовка
+
+    def schedule_render(self, delay=RENDER_DELAY):
+        if self.pending_render is not None:
+            self.canvas.after_cancel(self.pending_render)
+        self.pending_render = self.canvas.after(delay, self.render)
+
+    def render(self):
+        """Перерисовывает видимую часть сцены пачками элементов"""
+        self.pending_render = None
+        if not self.canvas.winfo_exists():
+            return
+        # Недорисованное прежнее поколение не нужно - остается последнее готовое
+        if self.generation != self.drawn_generation:
+            self.canvas.delete(f"g{self.generation}")
+        self.generation += 1
+
+        visible = self.visible_nodes()
+        self.level = level = self.detail_level(len(visible))
+        self._draw_batches(self.generation, self._draw_ops(visible, level))
+
+    def _draw_ops(self, visible, level):
+        """Операции отрисовки: сначала связи (они ниже узлов), затем узлы"""
+        generation_tag = f"g{self.generation}"
+        x1, y1, x2, y2 = self.visible_rect()
+        visible_keys = {node.key for node in visible}
+        full = level == 'full'
+        edges = self.edges if len(visible) <= self.DOTS_EDGE_NODES else ()
+
+        for edge in edges:
+            source = self.nodes.get(edge.source)
+            target = self.nodes.get(edge.target)
+            if source is None or target is None:
+                continue
+            if edge.source not in visible_keys and edge.target not in visible_keys:
+                # Отрезок целиком вне видимой области
+                if (max(source.x, target.x) < x1 or min(source.x, target.x) > x2 or
+                        max(source.y, target.y) < y1 or min(source.y, target.y) > y2):
+                    continue
+            # Подпись - только если середина связи видна
+            labeled = full and x1 <= (source.x + target.x) / 2 <= x2 and y1 <= (source.y + target.y) / 2 <= y2
+            yield self._edge_op(edge, source, target, full, labeled, generation_tag)
+
+        for node in visible:
+            yield self._node_op(node, level, generation_tag)
+
+    def _edge_op(self, edge, source, target, full, labeled, generation_tag):
+        def draw():
+            sx, sy = self.to_screen(source.x, source.y)
+            tx, ty = self.to_screen(target.x, target.y)
+            self.canvas.create_line(sx, sy, tx, ty, arrow=edge.arrow if full else None, fill=edge.color,
+                                    width=edge.width if full else 1, tags=('scene', generation_tag))
+            if labeled and edge.label:
+                self.canvas.create_text((sx + tx) / 2, (sy + ty) / 2, text=edge.label, font=('Arial', 8),
+                                        fill=edge.label_color, tags=('scene', generation_tag))
+        return draw
+
+    def _node_op(self, node, level, generation_tag):
+        def draw():
+            x, y = self.to_screen(node.x, node.y)
+            tags = ('scene', 'node', node.item_tag, node.tag, generation_tag)
+            if level == 'dots':
+                r = self.dot_radius()
+                self.canvas.create_oval(x - r, y - r, x + r, y + r, fill=self.highlight.fill(node), outline=node.outline,
+                                        tags=tags + ('shape',))
+                return
+            rx, ry = self.NODE_RX * self.scale, self.NODE_RY * self.scale
+            self.canvas.create_oval(x - rx, y - ry, x + rx, y + ry, fill=self.highlight.fill(node), outline=node.outline,
+                                    width=2 if node.kind == 'group' else 1, tags=tags + ('shape',))
+            font_size = max(6, round(node.font_size * min(self.scale, 1.5)))
+            self.canvas.create_text(x, y, text=node.label, font=('Arial', font_size, 'bold'),
+                                    fill=node.text_color, tags=tags)
+        return draw
+
+    def _draw_batches(self, generation, ops):
+        if generation != self.generation or not self.canvas.winfo_exists():
+            return
+        for count, op in enumerate(ops, 1):
+            op()
+            if count == self.BATCH_SIZE:
+                # Остальное - в следующих пачках, окно тем временем обрабатывает события
+                self.canvas.after(1, self._draw_batches, generation, ops)
+                return
+
+        # Поколение дорисовано - убираем предыдущее
+        if self.drawn_generation is not None:
+            self.canvas.delete(f"g{self.drawn_generation}")
+        self.drawn_generation = generation
+
+    # Мышь
+
+    def dot_radius(self):
+        """Радиус точки на холсте при низкой детализации"""
+        return max(3, self.DOT_RADIUS * self.scale)
+
+    def node_at(self, x, y):
+        """Узел под точкой холста или None - по сетке и настоящей форме узла (эллипс или точка)"""
+        world_x, world_y = self.to_world(x, y)
+        if self.level == 'dots':
+            rx = ry = self.dot_radius() / self.scale
+        else:
+            rx, ry = self.NODE_RX, self.NODE_RY
+        return self.grid.nearest(world_x, world_y, rx, ry)
+
+    def start_drag(self, event):
+        self.drag_start = (event.x, event.y)
+        self.dragged = False
+
+    def drag(self, event):
+        """Панорамирование: элементы сдвигаются сразу, новые области дорисовываются позже"""
+        if self.drag_start is None:
+            return
+        dx, dy = event.x - self.drag_start[0], event.y - self.drag_start[1]
+        if not self.dragged and abs(dx) + abs(dy) < 4:
+            return
+        self.dragged = True
+        self.drag_start = (event.x, event.y)
+        self.canvas.move('scene', dx, dy)
+        self.offset_x += dx
+        self.offset_y += dy
+        self.schedule_render()
+
+    def end_drag(self, event):
+        if self.drag_start is not None and not self.dragged:
+            node = self.node_at(event.x, event.y)
+            if node is not None and node.kind == 'group':
+                self.toggle_group(node)
+            elif node is not None and self.on_activate:
+                self.on_activate(node)
+        self.drag_start = None
+
+    def zoom_at(self, x, y, factor):
+        """Масштабирование с центром в точке холста"""
+        self.canvas.scale('scene', x, y, factor, factor)
+        self.scale *= factor
+        self.offset_x = x + (self.offset_x - x) * factor
+        self.offset_y = y + (self.offset_y - y) * factor
+        self.schedule_render()
+
+
 class DataVisualizer:
+    RELATION_GROUP_THRESHOLD = 40  # Больше связей - соседи сворачиваются в группы
+    NX_LAYOUT_LIMIT = 3000  # Больше узлов - раскладки networkx слишком медленные
+    WHOLE_GRAPH_ITERATIONS = 60
+    LAYOUT_POLL_DELAY = 100  # мс
+    # Поля сводок (статистика, признаки кластеризации); 'relations' - число связей
+    SUMMARY_FIELDS = ('phones', 'emails', 'addresses', 'relations', 'jobs', 'social_media', 'bank_accounts')
+    PEOPLE_PAGE_SIZE = 500  # Строк на странице списка людей
+
     def __init__(self, root):
         self.root = root
         self.root.title("BastardGraph")
@@ -237,27 +3236,46 @@ class DataVisualizer:
         self.openai_api_key = None
         self.openai_model = "gpt-3.5-turbo"
 
-        # Настройки геокодера
-        self.geolocator = Nominatim(user_agent="data_visualizer")
-        self.geocoded_addresses = {}
+        # Геокодер с кэшем на диске (общий с mapdemo)
+        self.geocoder = default_geocoder()
 
         # Настройки логгера
         self.setup_logging()
 
         # Данные
-        self.people = {}
+        self.people = None
+        self.relation_store = None
+        self.relation_graph = None
+        self.graph = None  # Граф для анализа связей
+        self.search_index = None
+        self.dataset = None  # Открытая база SQLite
+        self.journal = None  # Журнал изменений для резервных копий
+        self.init_data_indexes()
+        self.journal = ChangeJournal("backups", schedule=lambda: self.root.after(200, self.journal.flush))
+        self.journal.attach(self.people, self.relation_store)
         self.current_person = None
         self.graph_objects = []
+        self.graph_view = None  # Отрисовка текущего графа (GraphRenderer)
         self.search_results = []
+        self.people_page_starts = [None]  # Строка, после которой начинается каждая открытая страница списка
+        self.people_next_start = None  # Начало следующей страницы (None - страница последняя)
+        self.people_page_rows = None  # Готовые строки списка после фильтров (None - все люди по имени)
         self.file_path = None
         self.selected_node = None
-        self.node_positions = {}
         self.people_to_merge = set()
         self.people_to_analyze = set()  # Люди для анализа ChatGPT
         self.current_file_people = set()  # Люди из текущего обрабатываемого файла
-        self.graph = nx.Graph()  # Граф для анализа связей
+        self.ingestion = None  # Текущая параллельная обработка папки
+        self.ingestion_errors = []
         self.clusters = {}  # Кластеры людей
+        self.clusters_generation = None  # Поколение графа, по которому построены кластеры
         self.graph_layout = "force_atlas"  # Текущий алгоритм размещения
+        self.layout_cache = LayoutCache()
+        self.layout_job = None  # Раскладка, идущая в фоне (LayoutJob)
+        self.layout_progress = None
+        self.layout_scene = None  # (узлы, связи, place) сцены, которую раскладывает layout_job
+        self.detached_layout_job = None  # Раскладка снятого с холста графа - до повторного показа
+        self.current_view = None  # Перерисовка текущего графа (после смены стиля или алгоритма)
         self.dark_mode = False  # Режим темной темы
         self.graph_settings = {
             'node_size': 1000,
@@ -324,6 +3342,8 @@ class DataVisualizer:
         ttk.Button(self.file_frame, text="Создать резервную копию", command=self.create_backup).pack(fill=tk.X, pady=2)
         ttk.Button(self.file_frame, text="Восстановить из копии", command=self.restore_from_backup).pack(fill=tk.X,
                                                                                                          pady=2)
+        ttk.Button(self.file_frame, text="Открыть базу", command=self.open_dataset).pack(fill=tk.X, pady=2)
+        ttk.Button(self.file_frame, text="Сохранить в базу", command=self.save_to_dataset).pack(fill=tk.X, pady=2)
 
         self.settings_frame = ttk.LabelFrame(self.control_frame, text="Настройки", padding=10)
         self.settings_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -370,6 +3390,7 @@ class DataVisualizer:
         ttk.Button(self.search_frame, text="Сброс поиска", command=self.reset_search).pack(fill=tk.X, pady=2)
         ttk.Button(self.search_frame, text="Найти кратчайший путь", command=self.find_shortest_path).pack(fill=tk.X,
                                                                                                           pady=2)
+        ttk.Button(self.search_frame, text="Найти дубликаты", command=self.show_duplicates).pack(fill=tk.X, pady=2)
 
         self.filter_frame = ttk.LabelFrame(self.control_frame, text="Фильтры", padding=10)
         self.filter_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -394,11 +3415,20 @@ class DataVisualizer:
         self.people_listbox.bind('<<ListboxSelect>>', self.on_person_select)
         self.people_listbox.bind('<Button-3>', self.show_people_list_menu)
 
+        page_frame = ttk.Frame(self.people_frame)
+        page_frame.pack(fill=tk.X)
+        ttk.Button(page_frame, text="◀", width=3, command=self.previous_people_page).pack(side=tk.LEFT)
+        ttk.Button(page_frame, text="▶", width=3, command=self.next_people_page).pack(side=tk.RIGHT)
+        self.people_page_label = ttk.Label(page_frame, text="Стр. 1", anchor=tk.CENTER)
+        self.people_page_label.pack(fill=tk.X, expand=True)
+
         self.action_frame = ttk.Frame(self.control_frame)
         self.action_frame.pack(fill=tk.X, padx=5, pady=5)
 
         ttk.Button(self.action_frame, text="Показать связи", command=self.show_relations).pack(side=tk.LEFT,
                                                                                                expand=True, padx=2)
+        ttk.Button(self.action_frame, text="Весь граф", command=self.show_whole_graph).pack(side=tk.LEFT,
+                                                                                            expand=True, padx=2)
         ttk.Button(self.action_frame, text="Очистить", command=self.clear_canvas).pack(side=tk.LEFT, expand=True,
                                                                                        padx=2)
         ttk.Button(self.action_frame, text="Анализ ChatGPT", command=self.analyze_with_chatgpt).pack(side=tk.LEFT,
@@ -467,6 +3497,17 @@ class DataVisualizer:
         # Настройка прокрутки
         self.setup_scrollbars()
 
+    def init_data_indexes(self):
+        """Создает пустые реестр людей, хранилище связей и связанный с ними граф"""
+        self.people = PersonRegistry()
+        self.relation_store = RelationStore()  # Связи между людьми
+        self.relation_graph = RelationGraph(self.people, self.relation_store)
+        self.graph = self.relation_graph.graph
+        self.search_index = SearchIndex(self.people)
+        self.bulk_loading = 0  # Глубина вложенных массовых загрузок
+        if self.journal is not None:
+            self.journal.attach(self.people, self.relation_store)
+
     def _on_mousewheel(self, event):
         """Обработчик прокрутки колесиком мыши"""
         if event.num == 4 or event.delta > 0:
@@ -493,58 +3534,23 @@ class DataVisualizer:
 
     def zoom(self, event):
         """Масштабирование графа с центром на курсоре мыши"""
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
-
+        if self.graph_view is None:
+            return
         factor = 1.1 if event.delta > 0 else 0.9
         self.zoom_level *= factor
 
         # Сохраняем центр масштабирования
-        self.last_zoom_center = (x, y)
-
-        self.canvas.scale("all", x, y, factor, factor)
-
-        # Обновляем позиции узлов после масштабирования
-        for node_id, (node_x, node_y) in self.node_positions.items():
-            scaled_x = x + (node_x - x) * factor
-            scaled_y = y + (node_y - y) * factor
-            self.node_positions[node_id] = (scaled_x, scaled_y)
-
+        self.last_zoom_center = (event.x, event.y)
+        self.graph_view.zoom_at(event.x, event.y, factor)
 
     def reset_zoom(self, event=None):
-        """Сброс масштабирования с анимацией"""
-        if not hasattr(self, 'node_positions') or not self.node_positions:
-            return
-
-        # Находим центр графа
-        all_x = [pos[0] for pos in self.node_positions.values()]
-        all_y = [pos[1] for pos in self.node_positions.values()]
-        center_x = sum(all_x) / len(all_x)
-        center_y = sum(all_y) / len(all_y)
-
-        # Вычисляем текущий масштаб
-        current_scale = self.canvas.scale("all", 0, 0, 0, 0)[0]
-
-        if current_scale == 1.0:
+        """Сброс масштабирования: весь граф снова помещается на холст"""
+        if self.graph_view is None or not self.graph_view.nodes:
             return
 
-        # Плавное возвращение к масштабу 1.0
-        steps = 10
-        step_factor = (1.0 / current_scale) ** (1.0 / steps)
-
-        for _ in range(steps):
-            self.canvas.scale("all", center_x, center_y, step_factor, step_factor)
-            self.canvas.update()
-            time.sleep(0.03)
-
         self.zoom_level = 1.0
-
-        # Обновляем позиции узлов
-        for node_id in self.node_positions:
-            x, y = self.node_positions[node_id]
-            scaled_x = center_x + (x - center_x) * (1.0 / current_scale)
-            scaled_y = center_y + (y - center_y) * (1.0 / current_scale)
-            self.node_positions[node_id] = (scaled_x, scaled_y)
+        self.graph_view.fit()
+        self.graph_view.render()
 
 
     def setup_bindings(self):
@@ -567,21 +3573,16 @@ class DataVisualizer:
 
     def zoom_with_key(self, factor):
         """Масштабирование с помощью клавиш"""
+        if self.graph_view is None:
+            return
         if not hasattr(self, 'last_zoom_center') or not self.last_zoom_center:
-            center_x = self.canvas.winfo_width() / 2
-            center_y = self.canvas.winfo_height() / 2
+            width, height = self.graph_view.size()
+            center_x, center_y = width / 2, height / 2
         else:
             center_x, center_y = self.last_zoom_center
 
         self.zoom_level *= factor
-        self.canvas.scale("all", center_x, center_y, factor, factor)
-
-        # Обновляем позиции узлов
-        for node_id in self.node_positions:
-            x, y = self.node_positions[node_id]
-            scaled_x = center_x + (x - center_x) * factor
-            scaled_y = center_y + (y - center_y) * factor
-            self.node_positions[node_id] = (scaled_x, scaled_y)
+        self.graph_view.zoom_at(center_x, center_y, factor)
 
     def add_relation_dialog(self):
         """Диалог добавления новой связи"""
@@ -589,11 +3590,7 @@ class DataVisualizer:
             return
 
         # Находим выбранного человека
-        related_person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                related_person = p
-                break
+        related_person = self.selected_person()
 
         if not related_person or related_person == self.current_person:
             return
@@ -679,60 +3676,27 @@ class DataVisualizer:
             self.graph_settings['text_color'] = '#000000'
 
         # Перерисовываем граф, если он есть
-        if self.current_person:
-            self.show_relations()
+        self.redraw_graph()
 
     def update_graph_layout(self):
         """Обновляет алгоритм размещения графа"""
         self.graph_layout = self.layout_var.get()
-        if self.current_person:
-            self.show_relations()
+        self.redraw_graph()
 
     def update_graph_style(self, setting, value):
         """Обновляет настройки отображения графа"""
         self.graph_settings[setting] = value
-        if self.current_person:
-            self.show_relations()
+        self.redraw_graph()
+
+    def redraw_graph(self):
+        """Показывает текущий граф заново; раскладка берется из кэша, поэтому смена стиля ее не пересчитывает"""
+        if self.current_view is not None:
+            self.current_view()
 
     def highlight_connected_nodes(self, event):
         """Подсветка связанных узлов при наведении"""
-        if not self.current_person or not hasattr(self, 'graph'):
-            return
-
-        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
-        hovered_node = None
-
-        # Находим узел, над которым находится курсор
-        for node_id, (node_x, node_y) in self.node_positions.items():
-            if (node_x - 60 <= x <= node_x + 60 and
-                    node_y - 40 <= y <= node_y + 40):
-                hovered_node = node_id
-                break
-
-        if hovered_node:
-            # Находим все связанные узлы
-            connected_nodes = set()
-            for rel in self.current_person.relations:
-                if isinstance(rel[1], Person):
-                    node_id = f"node_{rel[1].full_name}"
-                    connected_nodes.add(node_id)
-
-            # Подсвечиваем связанные узлы
-            for node_id in self.node_positions:
-                if node_id == hovered_node:
-                    self.canvas.itemconfig(node_id, fill=self.graph_settings['highlight_color'])
-                elif node_id in connected_nodes:
-                    self.canvas.itemconfig(node_id, fill="#ffff00")  # Желтый для связанных узлов
-                else:
-                    # Возвращаем исходный цвет
-                    if 'семь' in node_id.lower() or 'супруг' in node_id.lower():
-                        self.canvas.itemconfig(node_id, fill=self.graph_settings['family_color'])
-                    elif 'работ' in node_id.lower() or 'коллег' in node_id.lower():
-                        self.canvas.itemconfig(node_id, fill=self.graph_settings['work_color'])
-                    elif 'возможн' in node_id.lower():
-                        self.canvas.itemconfig(node_id, fill="#ffa07a")
-                    else:
-                        self.canvas.itemconfig(node_id, fill=self.graph_settings['other_color'])
+        if self.graph_view is not None and event.widget is self.graph_view.canvas:
+            self.graph_view.highlight.motion(event)
 
     def show_second_level_relations(self):
         """Показывает связи второго уровня (через промежуточных людей)"""
@@ -740,158 +3704,240 @@ class DataVisualizer:
             return
 
         # Находим выбранного человека
-        related_person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                related_person = p
-                break
+        related_person = self.selected_person()
 
         if not related_person or related_person == self.current_person:
             return
 
-        # Строим граф всех связей
-        self.build_relation_graph()
-
-        # Находим все пути между текущим и выбранным человеком
+        # Собираем всех людей на путях не длиннее трех связей между текущим и выбранным человеком
         try:
-            paths = list(nx.all_simple_paths(self.graph, self.current_person.id, related_person.id, cutoff=3))
+            people_in_paths = self.relation_graph.people_between(self.current_person.id, related_person.id, 3)
         except nx.NetworkXNoPath:
             messagebox.showinfo("Информация", "Нет связей между выбранными людьми")
             return
 
-        # Собираем всех людей, участвующих в связях
-        people_in_paths = set()
-        for path in paths:
-            for person_id in path:
-                people_in_paths.add(person_id)
-
         # Показываем только этих людей и их связи
         self.show_filtered_relations(people_in_paths)
 
     def build_relation_graph(self):
-        """Строит граф всех связей между людьми"""
-        self.graph.clear()
+        """Полностью перестраивает граф всех связей между людьми
 
-        # Добавляем всех людей как узлы
-        for person in self.people.values():
-            self.graph.add_node(person.id, name=person.full_name, person=person)
-
-        # Добавляем связи между людьми
-        for person in self.people.values():
-            for rel_type, related_person, details in person.relations:
-                if isinstance(related_person, Person):
-                    self.graph.add_edge(person.id, related_person.id, type=rel_type, details=dict(details))
+        Обычно не нужен: граф обновляется при каждом изменении людей и связей.
+        """
+        self.relation_graph.rebuild()
 
     def show_filtered_relations(self, person_ids):
         """Показывает связи только между выбранными людьми"""
         self.clear_canvas()
-        self.node_positions = {}
+        self.current_view = lambda: self.show_filtered_relations(person_ids)
 
         # Создаем холст для графа
-        graph_canvas = tk.Canvas(self.inner_frame, width=1000, height=700, bg=self.graph_settings['bg_color'])
-        graph_canvas.grid(row=0, column=0, sticky="nsew")
-        self.graph_objects.append(graph_canvas)
+        graph_canvas = self._create_graph_canvas(self.graph_settings['bg_color'])
 
         # Получаем список людей для отображения
-        people_to_show = [p for p in self.people.values() if p.id in person_ids]
+        people_to_show = [p for p in map(self.people.get_by_id, person_ids) if p]
         if not people_to_show:
             graph_canvas.create_text(500, 350, text="Нет данных для отображения",
                                      font=('Arial', 12), fill=self.graph_settings['text_color'])
             return
 
-        # Создаем подграф для этих людей
-        subgraph = self.graph.subgraph(person_ids)
-
-        # Выбираем алгоритм размещения
-        if self.graph_layout == "force_atlas":
-            pos = nx.spring_layout(subgraph, k=0.5, iterations=50)
-        elif self.graph_layout == "fruchterman":
-            pos = nx.fruchterman_reingold_layout(subgraph, k=0.5)
-        else:  # circular
-            pos = nx.circular_layout(subgraph)
+        # Создаем подграф для этих людей (связи «из одного файла» разворачиваются только здесь)
+        subgraph = self.relation_graph.person_subgraph(person_ids)
 
-        # Масштабируем координаты для отображения на холсте
-        min_x = min(v[0] for v in pos.values())
-        max_x = max(v[0] for v in pos.values())
-        min_y = min(v[1] for v in pos.values())
-        max_y = max(v[1] for v in pos.values())
-
-        scale_x = 800 / (max_x - min_x) if max_x != min_x else 1
-        scale_y = 600 / (max_y - min_y) if max_y != min_y else 1
-        scale = min(scale_x, scale_y) * 0.8
-
-        center_x = (max_x + min_x) / 2
-        center_y = (max_y + min_y) / 2
-
-        # Рисуем узлы и связи
-        for node, (x, y) in pos.items():
-            person = next((p for p in self.people.values() if p.id == node), None)
+        # Узлы
+        nodes = []
+        for node_id in subgraph:
+            person = self.people.get_by_id(node_id)
             if not person:
                 continue
 
-            # Преобразуем координаты
-            canvas_x = 500 + (x - center_x) * scale * 500
-            canvas_y = 350 + (y - center_y) * scale * 350
-
-            node_id = f"node_{person.full_name}"
-            self.node_positions[node_id] = (canvas_x, canvas_y)
-
             # Цвет узла в зависимости от типа связей
             node_color = self.graph_settings['other_color']
             if person == self.current_person:
                 node_color = self.graph_settings['central_color']
             else:
-                for rel in self.current_person.relations:
-                    if isinstance(rel[1], Person) and rel[1].id == person.id:
-                        if 'семь' in rel[0].lower() or 'супруг' in rel[0].lower():
-                            node_color = self.graph_settings['family_color']
-                        elif 'работ' in rel[0].lower() or 'коллег' in rel[0].lower():
-                            node_color = self.graph_settings['work_color']
-                        break
-
-            # Рисуем узел
-            graph_canvas.create_oval(
-                canvas_x - 60, canvas_y - 40, canvas_x + 60, canvas_y + 40,
-                fill=node_color, outline='#8b4513', tags=node_id
-            )
+                for rel_type in self.relation_store.relation_types(self.current_person, person):
+                    if 'семь' in rel_type.lower() or 'супруг' in rel_type.lower():
+                        node_color = self.graph_settings['family_color']
+                    elif 'работ' in rel_type.lower() or 'коллег' in rel_type.lower():
+                        node_color = self.graph_settings['work_color']
+                    break
 
             # Имя человека (только фамилия)
             last_name = person.full_name.split()[0] if ' ' in person.full_name else person.full_name
-            graph_canvas.create_text(
-                canvas_x, canvas_y, text=last_name,
-                font=('Arial', 10, 'bold'), fill='#8b4513', tags=node_id
-            )
+            nodes.append(SceneNode(person.id, PersonRegistry.node_tag(person), last_name, node_color,
+                                   text_color='#8b4513', font_size=10, person=person))
+
+        # Связи
+        shown = {node.key for node in nodes}
+        edges = [SceneEdge(source, target, label=data.get('type', 'связь'),
+                           width=self.graph_settings['edge_width'], label_color=self.graph_settings['text_color'])
+                 for source, target, data in subgraph.edges(data=True)
+                 if source in shown and target in shown]
+
+        def place(pos):
+            # Масштабируем координаты для отображения на холсте
+            min_x = min(v[0] for v in pos.values())
+            max_x = max(v[0] for v in pos.values())
+            min_y = min(v[1] for v in pos.values())
+            max_y = max(v[1] for v in pos.values())
+
+            scale_x = 800 / (max_x - min_x) if max_x != min_x else 1
+            scale_y = 600 / (max_y - min_y) if max_y != min_y else 1
+            scale = min(scale_x, scale_y) * 0.8
+
+            center_x = (max_x + min_x) / 2
+            center_y = (max_y + min_y) / 2
+            for node in nodes:
+                x, y = pos[node.key]
+                node.x = (x - center_x) * scale
+                node.y = (y - center_y) * scale
+
+        # Раскладка выбранным алгоритмом (из кэша, если этот подграф уже раскладывался)
+        self._layout_scene(subgraph, self.graph_layout, LAYOUT_PARAMS[self.graph_layout], nodes, edges, place)
+
+    def show_whole_graph(self):
+        """Показывает весь граф связей: люди, файлы и связи между ними"""
+        self.clear_canvas()
+        self.current_view = self.show_whole_graph
 
-        # Рисуем связи
-        for edge in subgraph.edges(data=True):
-            source_person = next((p for p in self.people.values() if p.id == edge[0]), None)
-            target_person = next((p for p in self.people.values() if p.id == edge[1]), None)
-            if not source_person or not target_person:
-                continue
+        graph_canvas = self._create_graph_canvas(self.graph_settings['bg_color'])
+        graph = self.relation_graph.graph
+        if not graph:
+            graph_canvas.create_text(500, 350, text="Нет данных для отображения",
+                                     font=('Arial', 12), fill=self.graph_settings['text_color'])
+            return
 
-            source_node = f"node_{source_person.full_name}"
-            target_node = f"node_{target_person.full_name}"
-            if source_node not in self.node_positions or target_node not in self.node_positions:
-                continue
+        # networkx раскладывает за O(n²) - большой граф всегда раскладывается ForceAtlas2
+        algorithm = self.graph_layout
+        if algorithm == 'fruchterman' and len(graph) > self.NX_LAYOUT_LIMIT:
+            algorithm = 'force_atlas'
+        params = LAYOUT_PARAMS[algorithm]
+        if algorithm == 'force_atlas' and len(graph) > self.NX_LAYOUT_LIMIT:
+            params = dict(params, iterations=self.WHOLE_GRAPH_ITERATIONS)
+
+        nodes = []
+        for node_id, data in graph.nodes(data=True):
+            if self.relation_graph.is_document_node(node_id):
+                node = SceneNode(node_id, f"file_{data['name']}", data['name'], '#d3d3d3', kind='document')
+            else:
+                person = data['person']
+                node = SceneNode(node_id, PersonRegistry.node_tag(person), person.full_name.split()[0],
+                                 self.graph_settings['other_color'], person=person)
+            nodes.append(node)
+
+        edges = []
+        for source, target, data in graph.edges(data=True):
+            if 'type' in data:
+                edges.append(SceneEdge(source, target, label=data['type'], width=self.graph_settings['edge_width'],
+                                       label_color=self.graph_settings['text_color']))
+            else:
+                edges.append(SceneEdge(source, target, color='#bbbbbb', width=1, arrow=None))
 
-            x1, y1 = self.node_positions[source_node]
-            x2, y2 = self.node_positions[target_node]
+        def place(pos):
+            # Средняя длина связи - как расстояние между раскрытыми соседями группы
+            lengths = [math.dist(pos[edge.source], pos[edge.target]) for edge in edges]
+            total = sum(lengths)
+            spacing = GraphRenderer.CHILD_SPACING / (total / len(lengths)) if total else 1.0
+            for node in nodes:
+                node.x, node.y = pos[node.key][0] * spacing, pos[node.key][1] * spacing
 
-            # Рисуем линию связи
-            graph_canvas.create_line(
-                x1, y1, x2, y2,
-                arrow=tk.LAST, fill='#666666', width=self.graph_settings['edge_width']
-            )
+        self.status_bar.config(text=f"Весь граф: узлов {len(nodes)}, связей {len(edges)}")
+        self._layout_scene(graph, algorithm, params, nodes, edges, place)
 
-            # Подпись связи (посередине линии)
-            rel_type = edge[2].get('type', 'связь')
-            label_x = (x1 + x2) / 2
-            label_y = (y1 + y2) / 2
+    def _layout_scene(self, graph, algorithm, params, nodes, edges, place):
+        """Показывает сцену по раскладке графа: из кэша - сразу, иначе раскладка идет в фоне
 
-            graph_canvas.create_text(
-                label_x, label_y, text=rel_type,
-                font=('Arial', 8), fill=self.graph_settings['text_color']
-            )
+        place(позиции) переводит позиции раскладки в мировые координаты узлов сцены.
+        Пока раскладка считается, на холсте видны промежуточные позиции, а окно
+        продолжает работать; раскладку можно остановить.
+        """
+        key, positions = self.layout_cache.lookup(graph, algorithm, params)
+        detached, self.detached_layout_job = self.detached_layout_job, None
+        if detached is not None and (positions is not None or detached.key != key or detached.stopped):
+            detached.stop()
+            detached = None
+        if positions is not None:
+            self._show_layout(nodes, edges, place, positions)
+            return
+
+        self.layout_scene = (nodes, edges, place)
+        if detached is not None:
+            # Тот же граф показан заново во время раскладки (например, сменился стиль) -
+            # раскладка продолжается, ее опрос через after уже идет
+            if detached.latest is not None:
+                self._show_layout(nodes, edges, place, detached.latest)
+            self._show_layout_controls(detached)
+            self.layout_job = detached
+            return
+
+        job = LayoutJob(graph, algorithm, params, self.layout_cache.warm_start(graph, key), key)
+        if job.initial is not None:
+            self._show_layout(nodes, edges, place, job.initial)
+        self._show_layout_controls(job)
+
+        self.layout_job = job
+        self.layout_progress = None
+        job.start()
+        self.root.after(self.LAYOUT_POLL_DELAY, self._poll_layout, job)
+
+    def _show_layout_controls(self, job):
+        """Ход раскладки и кнопка остановки - под холстом"""
+        self.layout_controls = ttk.Frame(self.inner_frame)
+        self.layout_controls.grid(row=1, column=0, sticky="ew")
+        self.layout_label = ttk.Label(self.layout_controls, text="Раскладка графа...")
+        self.layout_label.pack(side=tk.LEFT, padx=5)
+        ttk.Button(self.layout_controls, text="Остановить", command=job.stop).pack(side=tk.RIGHT, padx=5)
+
+    def _show_layout(self, nodes, edges, place, positions):
+        place(positions)
+        view = self.graph_view
+        # Если пользователь уже сдвинул или масштабировал вид, он не сбрасывается
+        refit = not view.view_moved
+        view.set_scene(nodes, edges)
+        if refit:
+            view.fit()
+        view.render()
+
+    def _poll_layout(self, job):
+        """Забирает из фонового потока промежуточные и готовые позиции (вызывается через after)"""
+        if job is not self.layout_job:
+            return  # Показан другой граф
+        nodes, edges, place = self.layout_scene
+
+        done = None
+        for event in job.collect():
+            if event[0] == 'progress':
+                self.layout_progress = event
+            else:
+                done = event
+        if done is None and job.stopped and job.engine is None:
+            # Раскладку networkx не прервать - ее результат просто не ждем
+            done = ('done', job.initial, None)
+
+        if done is not None:
+            _, positions, error = done
+            self.layout_job = None
+            self.layout_controls.destroy()
+            if error is not None:
+                self.logger.error(f"Ошибка при раскладке графа: {error}")
+                messagebox.showerror("Ошибка", f"Ошибка при раскладке графа:\n{str(error)}")
+            elif job.stopped:
+                if positions is not None:
+                    self._show_layout(nodes, edges, place, positions)
+                self.status_bar.config(text="Раскладка остановлена")
+            else:
+                self._show_layout(nodes, edges, place, self.layout_cache.put(job.key, positions))
+            return
+
+        # Новые промежуточные позиции - когда дорисованы предыдущие
+        if self.layout_progress is not None and not self.graph_view.drawing:
+            _, iteration, total, positions = self.layout_progress
+            self.layout_progress = None
+            job.latest = positions
+            self._show_layout(nodes, edges, place, positions)
+            self.layout_label.config(text=f"Раскладка графа: итерация {iteration} из {total}")
+        self.root.after(self.LAYOUT_POLL_DELAY, self._poll_layout, job)
 
     def find_shortest_path(self):
         """Находит кратчайший путь между двумя людьми"""
@@ -902,34 +3948,23 @@ class DataVisualizer:
         person1_str = self.people_listbox.get(self.people_listbox.curselection()[0])
         person2_str = self.people_listbox.get(self.people_listbox.curselection()[1])
 
-        person1 = None
-        person2 = None
-
         # Находим объекты выбранных людей
-        for person in self.people.values():
-            if str(person) == person1_str:
-                person1 = person
-            if str(person) == person2_str:
-                person2 = person
-            if person1 and person2:
-                break
+        person1 = self.people.find_by_display(person1_str)
+        person2 = self.people.find_by_display(person2_str)
 
         if not person1 or not person2:
             messagebox.showerror("Ошибка", "Не удалось найти выбранных людей")
             return
 
-        # Строим граф всех связей
-        self.build_relation_graph()
-
         # Ищем кратчайший путь
         try:
-            path = nx.shortest_path(self.graph, person1.id, person2.id)
+            path = self.relation_graph.people_path(person1.id, person2.id)
         except nx.NetworkXNoPath:
             messagebox.showinfo("Информация", "Нет пути между выбранными людьми")
             return
 
         # Получаем людей на пути
-        people_in_path = [next(p for p in self.people.values() if p.id == node_id) for node_id in path]
+        people_in_path = [self.people.get_by_id(node_id) for node_id in path]
 
         # Показываем путь
         self.show_shortest_path(people_in_path)
@@ -940,27 +3975,20 @@ class DataVisualizer:
             return
 
         # Находим выбранного человека
-        related_person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                related_person = p
-                break
+        related_person = self.selected_person()
 
         if not related_person or related_person == self.current_person:
             return
 
-        # Строим граф всех связей
-        self.build_relation_graph()
-
         # Ищем кратчайший путь
         try:
-            path = nx.shortest_path(self.graph, self.current_person.id, related_person.id)
+            path = self.relation_graph.people_path(self.current_person.id, related_person.id)
         except nx.NetworkXNoPath:
             messagebox.showinfo("Информация", "Нет пути между выбранными людьми")
             return
 
         # Получаем людей на пути
-        people_in_path = [next(p for p in self.people.values() if p.id == node_id) for node_id in path]
+        people_in_path = [self.people.get_by_id(node_id) for node_id in path]
 
         # Показываем путь
         self.show_shortest_path(people_in_path)
@@ -968,12 +3996,10 @@ class DataVisualizer:
     def show_shortest_path(self, people_in_path):
         """Показывает кратчайший путь между людьми"""
         self.clear_canvas()
-        self.node_positions = {}
+        self.current_view = lambda: self.show_shortest_path(people_in_path)
 
         # Создаем холст для графа
-        graph_canvas = tk.Canvas(self.inner_frame, width=1000, height=700, bg=self.graph_settings['bg_color'])
-        graph_canvas.grid(row=0, column=0, sticky="nsew")
-        self.graph_objects.append(graph_canvas)
+        graph_canvas = self._create_graph_canvas(self.graph_settings['bg_color'])
 
         if len(people_in_path) < 2:
             graph_canvas.create_text(500, 350, text="Нет данных для отображения",
@@ -981,98 +4007,71 @@ class DataVisualizer:
             return
 
         # Располагаем людей по кругу
-        angle_step = 360 / len(people_in_path)
-        center_x, center_y = 500, 350
+        angle_step = 2 * math.pi / len(people_in_path)
         radius = 250
 
+        nodes = []
         for i, person in enumerate(people_in_path):
-            angle = math.radians(i * angle_step)
-            node_x = center_x + radius * math.cos(angle)
-            node_y = center_y + radius * math.sin(angle)
-
-            node_id = f"node_{person.full_name}"
-            self.node_positions[node_id] = (node_x, node_y)
-
-            # Цвет узла - красный для выделения пути
-            graph_canvas.create_oval(
-                node_x - 60, node_y - 40, node_x + 60, node_y + 40,
-                fill='#ff0000', outline='#8b4513', tags=node_id
-            )
-
-            # Имя человека (только фамилия)
+            # Цвет узла - красный для выделения пути; имя - только фамилия
             last_name = person.full_name.split()[0] if ' ' in person.full_name else person.full_name
-            graph_canvas.create_text(
-                node_x, node_y, text=last_name,
-                font=('Arial', 10, 'bold'), fill='#ffffff', tags=node_id
-            )
-
-        # Рисуем связи пути
-        for i in range(len(people_in_path) - 1):
-            person1 = people_in_path[i]
-            person2 = people_in_path[i + 1]
-
-            node1 = f"node_{person1.full_name}"
-            node2 = f"node_{person2.full_name}"
-
-            x1, y1 = self.node_positions[node1]
-            x2, y2 = self.node_positions[node2]
-
+            node = SceneNode(person.id, PersonRegistry.node_tag(person), last_name, '#ff0000',
+                             text_color='#ffffff', font_size=10, person=person)
+            node.x = radius * math.cos(i * angle_step)
+            node.y = radius * math.sin(i * angle_step)
+            nodes.append(node)
+
+        # Связи пути (толстые красные для выделения)
+        edges = []
+        for person1, person2 in zip(people_in_path, people_in_path[1:]):
             # Находим тип связи между этими людьми
-            rel_type = "связь"
-            for rel in person1.relations:
-                if isinstance(rel[1], Person) and rel[1].full_name == person2.full_name:
-                    rel_type = rel[0]
-                    break
+            relation_types = self.relation_store.relation_types(person1, person2)
+            rel_type = min(relation_types) if relation_types else "связь"
+            edges.append(SceneEdge(person1.id, person2.id, label=rel_type, color='#ff0000', width=4,
+                                   label_color=self.graph_settings['text_color']))
 
-            # Рисуем линию связи (толстую красную для выделения)
-            graph_canvas.create_line(
-                x1, y1, x2, y2,
-                arrow=tk.LAST, fill='#ff0000', width=4
-            )
+        self.graph_view.set_scene(nodes, edges)
+        self.graph_view.fit()
+        self.graph_view.render()
 
-            # Подпись связи (посередине линии)
-            label_x = (x1 + x2) / 2
-            label_y = (y1 + y2) / 2
+    def summary_counts(self):
+        """id человека -> количества по SUMMARY_FIELDS, без создания пустых полей и загрузки людей.
 
-            graph_canvas.create_text(
-                label_x, label_y, text=rel_type,
-                font=('Arial', 8, 'bold'), fill=self.graph_settings['text_color']
-            )
+        Для открытой базы счет идет SQL-запросом; из памяти берутся только новые и полностью
+        загруженные люди - у остальных в памяти может не быть связей.
+        """
+        counts = {}
+        loader = self.people.loader
+        if self.dataset is not None and loader is not None:
+            counts.update((row[0], row[1:]) for row in self.dataset.summary_counts())
+            for person_id in loader.deleted:
+                counts.pop(person_id, None)
+        for person in self.people.values():
+            if loader is None or person.id in loader.complete or person.id not in loader.loaded:
+                counts[person.id] = tuple(len(person.relations) if field == 'relations' else len(person.values(field))
+                                          for field in self.SUMMARY_FIELDS)
+        return counts
 
     def cluster_people(self):
         """Кластеризует людей по группам с помощью ML"""
-        if len(self.people) < 2:
+        # Признаки - количество телефонов, адресов, связей и т.д. (SUMMARY_FIELDS)
+        counts = self.summary_counts()
+        if len(counts) < 2:
             messagebox.showinfo("Информация", "Недостаточно данных для кластеризации")
             return
 
-        # Строим матрицу признаков для кластеризации
-        features = []
-        people_list = list(self.people.values())
-
-        for person in people_list:
-            # Используем количество связей, телефонов, адресов и т.д. как признаки
-            feature = [
-                len(person.phones),
-                len(person.emails),
-                len(person.addresses),
-                len(person.relations),
-                len(person.jobs),
-                len(person.social_media),
-                len(person.bank_accounts)
-            ]
-            features.append(feature)
+        person_ids = list(counts)
+        features = np.array([counts[person_id] for person_id in person_ids], dtype=float)
 
         # Определяем оптимальное количество кластеров (но не более 5)
-        n_clusters = min(5, len(people_list))
+        n_clusters = min(5, len(person_ids))
 
         # Выполняем кластеризацию
         kmeans = KMeans(n_clusters=n_clusters, random_state=42)
         clusters = kmeans.fit_predict(features)
 
         # Сохраняем кластеры
-        self.clusters = {}
-        for i, person in enumerate(people_list):
-            self.clusters[person.id] = clusters[i]
+        self.clusters = dict(zip(person_ids, clusters))
+        self.clusters_generation = self.relation_graph.generation
 
         messagebox.showinfo("Успех", f"Люди разделены на {n_clusters} кластера(ов)")
 
@@ -1081,6 +4080,14 @@ class DataVisualizer:
         sort_by = self.sort_var.get()
         group_by = self.group_var.get()
 
+        if self.dataset is not None:
+            # В памяти только загруженные из базы люди - список базы идет страницами по имени
+            if sort_by in ("по дате рождения", "по количеству связей") or group_by in ("по кластерам", "по категориям"):
+                messagebox.showinfo("Информация",
+                                    "Для открытой базы список показывается по имени, без сортировки и группировки")
+            self.update_people_list()
+            return
+
         people_list = list(self.people.values())
 
         # Сортировка
@@ -1093,7 +4100,7 @@ class DataVisualizer:
 
         # Группировка
         if group_by == "по кластерам":
-            if not self.clusters:
+            if not self.clusters or self.clusters_generation != self.relation_graph.generation:
                 self.cluster_people()
 
             # Группируем по кластерам
@@ -1102,13 +4109,13 @@ class DataVisualizer:
                 clusters[self.clusters.get(person.id, -1)].append(person)
 
             # Обновляем список
-            self.people_listbox.delete(0, tk.END)
+            rows = []
             for cluster_id in sorted(clusters.keys()):
-                self.people_listbox.insert(tk.END, f"=== Кластер {cluster_id + 1} ===")
-                for person in clusters[cluster_id]:
-                    self.people_listbox.insert(tk.END, str(person))
-                self.people_listbox.insert(tk.END, "")
+                rows.append(f"=== Кластер {cluster_id + 1} ===")
+                rows.extend(map(str, clusters[cluster_id]))
+                rows.append("")
 
+            self.update_people_list(rows)
             return
         elif group_by == "по категориям":
             # Группируем по категориям связей
@@ -1129,23 +4136,23 @@ class DataVisualizer:
                 categories[category].append(person)
 
             # Обновляем список
-            self.people_listbox.delete(0, tk.END)
+            rows = []
             for category in sorted(categories.keys()):
-                self.people_listbox.insert(tk.END, f"=== {category} ===")
-                for person in categories[category]:
-                    self.people_listbox.insert(tk.END, str(person))
-                self.people_listbox.insert(tk.END, "")
+                rows.append(f"=== {category} ===")
+                rows.extend(map(str, categories[category]))
+                rows.append("")
 
+            self.update_people_list(rows)
             return
 
         # Без группировки - просто обновляем список
-        self.people_listbox.delete(0, tk.END)
-        for person in people_list:
-            self.people_listbox.insert(tk.END, str(person))
+        self.update_people_list([str(person) for person in people_list])
 
     def show_statistics(self):
         """Показывает статистику по данным"""
-        if not self.people:
+        # Количества берутся из хранимых полей (для базы - SQL-агрегатами), поля людей не создаются
+        counts = self.summary_counts()
+        if not counts:
             messagebox.showwarning("Предупреждение", "Нет данных для отображения статистики")
             return
 
@@ -1154,16 +4161,21 @@ class DataVisualizer:
         stats_window.geometry("600x500")
 
         # Основные статистики
-        num_people = len(self.people)
-        num_phones = sum(len(p.phones) for p in self.people.values())
+        phones, emails, relations = (self.SUMMARY_FIELDS.index(field) for field in ('phones', 'emails', 'relations'))
+        num_people = len(counts)
+        num_phones = sum(row[phones] for row in counts.values())
         avg_phones = num_phones / num_people if num_people > 0 else 0
-        num_emails = sum(len(p.emails) for p in self.people.values())
+        num_emails = sum(row[emails] for row in counts.values())
         avg_emails = num_emails / num_people if num_people > 0 else 0
-        num_relations = sum(len(p.relations) for p in self.people.values())
+        num_relations = sum(row[relations] for row in counts.values())
         avg_relations = num_relations / num_people if num_people > 0 else 0
 
-        # Центральные фигуры (по количеству связей)
-        central_people = sorted(self.people.values(), key=lambda p: len(p.relations), reverse=True)[:5]
+        # Центральные фигуры (по количеству связей) - загружаются только они
+        central_people = []
+        for person_id in heapq.nlargest(5, counts, key=lambda person_id: counts[person_id][relations]):
+            person = self.people.get_by_id(person_id)
+            if person is not None:
+                central_people.append((person, counts[person_id][relations]))
 
         # Мосты между группами (люди с связями в разных кластерах)
         bridges = []
@@ -1188,8 +4200,8 @@ class DataVisualizer:
         Центральные фигуры (по количеству связей):
         """
 
-        for i, person in enumerate(central_people, 1):
-            stats_text += f"\n{i}. {person.full_name} - {len(person.relations)} связей"
+        for i, (person, relation_count) in enumerate(central_people, 1):
+            stats_text += f"\n{i}. {person.full_name} - {relation_count} связей"
 
         if bridges:
             stats_text += "\n\nМосты между группами (люди, связывающие разные кластеры):"
@@ -1197,16 +4209,18 @@ class DataVisualizer:
                 stats_text += f"\n- {person.full_name}"
 
         # Паттерны (люди с одинаковыми телефонами)
-        phone_to_people = defaultdict(list)
-        for person in self.people.values():
-            for phone in person.phones:
-                phone_to_people[phone].append(person)
-
-        common_phones = {phone: people for phone, people in phone_to_people.items() if len(people) > 1}
+        if self.dataset is not None:
+            common_phones = self.dataset.shared_identifiers('phones', 5)
+        else:
+            phone_to_people = defaultdict(list)
+            for person in self.people.values():
+                for phone in person.values('phones'):
+                    phone_to_people[phone].append(person.full_name)
+            common_phones = [(phone, names) for phone, names in phone_to_people.items() if len(names) > 1][:5]
         if common_phones:
             stats_text += "\n\nОбщие телефоны:"
-            for phone, people in list(common_phones.items())[:5]:  # Показываем только топ-5
-                names = ", ".join(p.full_name.split()[0] for p in people)
+            for phone, names in common_phones:  # Показываем только топ-5
+                names = ", ".join(name.split()[0] for name in names)
                 stats_text += f"\n- {phone}: {names}"
 
         # Отображаем статистику
@@ -1231,11 +4245,9 @@ class DataVisualizer:
         if not selection:
             return
 
-        selected_person = self.people_listbox.get(selection[0])
-        for person in self.people.values():
-            if str(person) == selected_person:
-                self.show_on_map(person)
-                break
+        person = self.people.find_by_display(self.people_listbox.get(selection[0]))
+        if person:
+            self.show_on_map(person)
 
     def show_on_map(self, person):
         """Показывает адреса человека на карте"""
@@ -1259,16 +4271,13 @@ class DataVisualizer:
         # Геокодируем адреса
         locations = []
         for address in person.addresses:
-            if address in self.geocoded_addresses:
-                locations.append(self.geocoded_addresses[address])
-            else:
-                try:
-                    location = self.geolocator.geocode(address)
-                    if location:
-                        self.geocoded_addresses[address] = (location.latitude, location.longitude)
-                        locations.append((location.latitude, location.longitude))
-                except GeocoderTimedOut:
-                    continue
+            try:
+                location = self.geocoder.geocode(address)
+            except Exception as e:
+                self.logger.error(f"Ошибка геокодирования адреса {address}: {str(e)}")
+                continue
+            if location:
+                locations.append(location['coordinates'])
 
         if not locations:
             ax.text(0.5, 0.5, "Не удалось геокодировать адреса",
@@ -1317,23 +4326,18 @@ class DataVisualizer:
             return
 
         try:
-            backup_dir = "backups"
-            if not os.path.exists(backup_dir):
-                os.makedirs(backup_dir)
-
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(backup_dir, f"backup_{timestamp}.json")
-
-            data_to_save = {
-                'people': [person.to_dict() for person in self.people.values()],
-                'timestamp': timestamp,
-                'version': '1.0'
-            }
+            if self.dataset is not None:
+                # Данные из базы SQLite сохраняются в саму базу
+                self.save_to_dataset()
+                return
 
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=2)
+            # Журнал уже содержит все изменения; в фоне он сжимается в новый снимок
+            backup_path = self.journal.compact()
+            if backup_path is None:
+                messagebox.showinfo("Информация", "Резервная копия уже создается")
+                return
 
-            messagebox.showinfo("Успех", f"Резервная копия успешно создана:\n{backup_path}")
+            messagebox.showinfo("Успех", f"Резервная копия создается в фоне:\n{backup_path}")
             self.log_action("Создание резервной копии", backup_path)
 
         except Exception as e:
@@ -1341,86 +4345,32 @@ class DataVisualizer:
             self.logger.error(f"Ошибка при создании резервной копии: {str(e)}")
 
     def restore_from_backup(self):
-        """Восстанавливает данные из резервной копии"""
+        """Восстанавливает данные из резервной копии (снимка или JSON)"""
         backup_path = filedialog.askopenfilename(
             title="Выберите файл резервной копии",
-            filetypes=(("JSON файлы", "*.json"), ("Все файлы", "*.*"))
+            filetypes=(("Резервные копии", "*.bgs *.json *.jsonl *.gz *.xz"), ("Снимки", "*.bgs"),
+                       ("JSON файлы", "*.json *.jsonl"), ("Все файлы", "*.*"))
         )
 
         if not backup_path:
             return
 
         try:
-            with open(backup_path, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-
-            # Очищаем текущие данные
-            self.people = {}
-            self.current_person = None
-            self.graph_objects = []
-            self.search_results = []
-            self.file_path = None
-            self.selected_node = None
-            self.node_positions = {}
-            self.people_to_merge = set()
-            self.people_to_analyze = set()
-            self.current_file_people = set()
-            self.graph = nx.Graph()
-            self.clusters = {}
-
-            # Восстанавливаем людей
-            for person_data in backup_data.get('people', []):
-                person = Person(person_data['full_name'], person_data.get('birth_date'))
-                person.id = person_data.get('id', str(uuid.uuid4()))
-                person.phones = set(person_data.get('phones', []))
-                person.emails = set(person_data.get('emails', []))
-                person.addresses = set(person_data.get('addresses', []))
-                person.passports = set(person_data.get('passports', []))
-                person.cars = set(person_data.get('cars', []))
-                person.jobs = set(person_data.get('jobs', []))
-                person.social_media = defaultdict(set,
-                                                  {k: set(v) for k, v in person_data.get('social_media', {}).items()})
-                person.bank_accounts = set(person_data.get('bank_accounts', []))
-                person.aliases = set(person_data.get('aliases', []))
-                person.source_files = set(person_data.get('source_files', []))
-                person.driver_license = person_data.get('driver_license')
-                person.snils = person_data.get('snils')
-                person.inn = person_data.get('inn')
-                person.created_at = person_data.get('created_at', datetime.now().isoformat())
-                person.updated_at = person_data.get('updated_at', datetime.now().isoformat())
-                person.created_by = person_data.get('created_by', 'system')
-                person.updated_by = person_data.get('updated_by', 'system')
-
-                # Восстанавливаем связи (пока только имена)
-                for rel_data in person_data.get('relations', []):
-                    related_person_name = rel_data['related_person']
-                    rel_type = rel_data['type']
-                    details = rel_data.get('details', {})
-                    person.relations.add((rel_type, related_person_name, tuple(sorted(details.items()))))
-
-                # Сохраняем человека
-                key = (person.full_name.lower(), person.birth_date)
-                self.people[key] = person
-
-            # Восстанавливаем реальные связи между объектами Person
-            for person in self.people.values():
-                new_relations = set()
-                for rel_type, related_person, frozen_details in person.relations:
-                    if not isinstance(related_person, Person):
-                        # Ищем человека по имени
-                        found = None
-                        for p in self.people.values():
-                            if p.full_name == related_person:
-                                found = p
-                                break
-                        if found:
-                            new_relations.add((rel_type, found, frozen_details))
-                        else:
-                            new_relations.add((rel_type, related_person, frozen_details))
-                    else:
-                        new_relations.add((rel_type, related_person, frozen_details))
-
-                person.relations = new_relations
+            base_path = self.journal.base_path
+            if base_path is not None and os.path.samefile(backup_path, base_path):
+                # Базовый снимок журнала восстанавливается вместе с журналом изменений после него
+                self.journal.flush()
+                self.journal.wait()
+                state = self.journal.load_state()
+                self.reset_data()
+                self.load_rows(state.rows())
+                self.journal.continue_chain()
+            else:
+                # Файл разбирается полностью до сброса: испорченная копия не стирает текущие данные
+                state = read_backup(backup_path)
+                self.reset_data()
+                self.load_rows(state.rows())
+                self.journal.set_base(backup_path)
 
             self.update_people_list()
             messagebox.showinfo("Успех", f"Данные успешно восстановлены из:\n{backup_path}")
@@ -1430,6 +4380,121 @@ class DataVisualizer:
             messagebox.showerror("Ошибка", f"Ошибка при восстановлении из резервной копии:\n{str(e)}")
             self.logger.error(f"Ошибка при восстановлении из резервной копии: {str(e)}")
 
+    def reset_data(self):
+        """Очищает текущие данные"""
+        self.close_dataset()
+        self.init_data_indexes()
+        self.current_person = None
+        self.current_view = None
+        self.graph_objects = []
+        self.search_results = []
+        self.file_path = None
+        self.selected_node = None
+        self.people_to_merge = set()
+        self.people_to_analyze = set()
+        self.current_file_people = set()
+        self.clusters = {}
+
+    def open_dataset(self):
+        """Открывает базу SQLite; люди загружаются из нее по мере обращения"""
+        path = filedialog.askopenfilename(
+            title="Открыть базу данных",
+            filetypes=(("База SQLite", "*.db *.sqlite"), ("Все файлы", "*.*"))
+        )
+        if not path:
+            return
+
+        try:
+            self.reset_data()
+            # Для базы журнал не ведется - изменения сохраняются в нее саму
+            self.journal.detach()
+            self.dataset = SQLiteDataset(path)
+            LazyPersonLoader(self.dataset, self.people, self.relation_store)
+            self.update_people_list()
+            self.status_bar.config(text=f"Открыта база: {path} | Людей: {self.dataset.count()}")
+            self.log_action("Открытие базы", path)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Ошибка при открытии базы:\n{str(e)}")
+            self.logger.error(f"Ошибка при открытии базы: {str(e)}")
+
+    def save_to_dataset(self):
+        """Сохраняет людей из памяти в открытую (или новую) базу SQLite"""
+        try:
+            if self.dataset is None:
+                path = filedialog.asksaveasfilename(
+                    title="Сохранить в базу данных",
+                    filetypes=(("База SQLite", "*.db *.sqlite"), ("Все файлы", "*.*")),
+                    defaultextension=".db"
+                )
+                if not path:
+                    return
+                self.dataset = SQLiteDataset(path)
+                LazyPersonLoader(self.dataset, self.people, self.relation_store)
+
+            self.people.loader.save()
+            self.status_bar.config(text=f"Сохранено в базу: {self.dataset.path} | Людей: {self.dataset.count()}")
+            self.log_action("Сохранение в базу", self.dataset.path)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Ошибка при сохранении в базу:\n{str(e)}")
+            self.logger.error(f"Ошибка при сохранении в базу: {str(e)}")
+
+    def close_dataset(self):
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+
+    def hydrate_person(self, person):
+        """Подгружает из базы связи человека, который открыт в интерфейсе"""
+        if person is not None and self.people.loader is not None:
+            self.people.loader.hydrate(person.id)
+
+    def load_rows(self, rows):
+        """Загружает записи снимка за один проход: люди по id, связи - ссылками на id или по именам"""
+        with self.bulk_load():
+            for kind, payload in rows:
+                if kind == 'p':
+                    person = Person.from_dict(payload, relation_store=self.relation_store)
+                    self.people[PersonRegistry.person_key(person)] = person
+                elif kind in ('r', 'n'):
+                    owner_id, relation_type, related_person, details = payload
+                    owner = self.people.get_by_id(owner_id)
+                    if kind == 'r':
+                        related_person = self.people.get_by_id(related_person)
+                    else:
+                        # Связь по имени (прежние JSON-копии) - ищем человека с таким именем
+                        related_person = self.people.find_by_name(related_person) or related_person
+                    if owner and related_person:
+                        self.relation_store.add(owner, relation_type, related_person,
+                                                RelationStore.freeze_details(details))
+                elif kind == 'h':
+                    self.relation_store.hidden_cooccurrences.add(frozenset(payload))
+
+    @staticmethod
+    def _shared_value_pairs(people_list, fields=('addresses', 'phones', 'jobs')):
+        """Находит пары людей с общими значениями через индекс значение -> люди.
+
+        Возвращает ({(i, j): {поле: множество общих значений}}, пропущенные блоки), где
+        i < j - позиции в people_list. Слишком частые значения (больше
+        EntityResolver.MAX_BLOCK_SIZE людей) не дают пар - они возвращаются как (поле, значение, размер).
+        """
+        pairs = defaultdict(dict)
+        skipped = []
+        for field in fields:
+            # Блоки: значение поля -> позиции людей, у которых оно есть
+            blocks = defaultdict(list)
+            for index, person in enumerate(people_list):
+                for value in person.values(field):
+                    blocks[value].append(index)
+
+            for value, members in blocks.items():
+                if len(members) > EntityResolver.MAX_BLOCK_SIZE:
+                    skipped.append((field, value, len(members)))
+                    continue
+                for a in range(len(members)):
+                    for b in range(a + 1, len(members)):
+                        pairs[(members[a], members[b])].setdefault(field, set()).add(value)
+        return pairs, skipped
+
     def auto_detect_relations(self):
         """Автоматически определяет типы связей на основе общих данных"""
         if not self.people:
@@ -1440,51 +4505,48 @@ class DataVisualizer:
 
         detected = 0
 
-        # Проходим по всем парам людей
+        # Сравниваем только пары, у которых есть хотя бы одно общее значение
         people_list = list(self.people.values())
-        for i in range(len(people_list)):
-            for j in range(i + 1, len(people_list)):
-                person1 = people_list[i]
-                person2 = people_list[j]
-
-                # Проверяем, есть ли уже связь между этими людьми
-                has_relation = any(
-                    isinstance(rel[1], Person) and rel[1].full_name == person2.full_name
-                    for rel in person1.relations
-                )
-                if has_relation:
-                    continue
+        shared_pairs, skipped = self._shared_value_pairs(people_list)
+        for field, value, size in skipped:
+            self.logger.warning(f"Автоопределение связей: значение {field} '{value}' есть у {size} человек, пропущено")
+        for (i, j), common in sorted(shared_pairs.items()):
+            person1 = people_list[i]
+            person2 = people_list[j]
+
+            # Проверяем, есть ли уже связь между этими людьми
+            if self.relation_store.connected(person1, person2):
+                continue
+
+            common_addresses = common.get('addresses')
+            common_phones = common.get('phones')
+            common_jobs = common.get('jobs')
+
+            # Определяем тип связи
+            relation_type = None
+            if common_addresses and not common_jobs:
+                relation_type = "семейная связь"
+            elif common_jobs and not common_addresses:
+                relation_type = "коллега"
+            elif common_addresses and common_jobs:
+                relation_type = "возможная связь"
+            elif common_phones:
+                relation_type = "знакомый"
+
+            if relation_type:
+                details = {
+                    'reason': 'автоматически определенная связь',
+                    'source_files': list(person1.source_files | person2.source_files)
+                }
+                if common_addresses:
+                    details['common_addresses'] = list(common_addresses)
+                if common_phones:
+                    details['common_phones'] = list(common_phones)
+                if common_jobs:
+                    details['common_jobs'] = list(common_jobs)
 
-                # Проверяем общие данные
-                common_addresses = person1.addresses & person2.addresses
-                common_phones = person1.phones & person2.phones
-                common_jobs = person1.jobs & person2.jobs
-
-                # Определяем тип связи
-                relation_type = None
-                if common_addresses and not common_jobs:
-                    relation_type = "семейная связь"
-                elif common_jobs and not common_addresses:
-                    relation_type = "коллега"
-                elif common_addresses and common_jobs:
-                    relation_type = "возможная связь"
-                elif common_phones:
-                    relation_type = "знакомый"
-
-                if relation_type:
-                    details = {
-                        'reason': 'автоматически определенная связь',
-                        'source_files': list(person1.source_files | person2.source_files)
-                    }
-                    if common_addresses:
-                        details['common_addresses'] = list(common_addresses)
-                    if common_phones:
-                        details['common_phones'] = list(common_phones)
-                    if common_jobs:
-                        details['common_jobs'] = list(common_jobs)
-
-                    person1.add_relation(relation_type, person2, details)
-                    detected += 1
+                person1.add_relation(relation_type, person2, details)
+                detected += 1
 
         self.status_bar.config(text=f"Определено {detected} новых связей")
         self.log_action("Автоматическое определение связей", f"определено {detected} связей")
@@ -1494,11 +4556,7 @@ class DataVisualizer:
     # ...
 
         # Находим выбранного человека
-        related_person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                related_person = p
-                break
+        related_person = self.selected_person()
 
         if not related_person or related_person == self.current_person:
             return
@@ -1648,9 +4706,9 @@ class DataVisualizer:
             prompt += (
                 f"\nИмя: {person.full_name}\n"
                 f"Дата рождения: {person.birth_date or 'неизвестна'}\n"
-                f"Телефоны: {', '.join(person.phones) if person.phones else 'нет данных'}\n"
-                f"Email: {', '.join(person.emails) if person.emails else 'нет данных'}\n"
-                f"Адреса: {', '.join(person.addresses) if person.addresses else 'нет данных'}\n"
+                f"Телефоны: {', '.join(person.values('phones')) or 'нет данных'}\n"
+                f"Email: {', '.join(person.values('emails')) or 'нет данных'}\n"
+                f"Адреса: {', '.join(person.values('addresses')) or 'нет данных'}\n"
             )
 
             # Добавляем уникальные связи между людьми в группе
@@ -1717,12 +4775,10 @@ class DataVisualizer:
         if not selection:
             return
 
-        selected_person = self.people_listbox.get(selection[0])
-        for person in self.people.values():
-            if str(person) == selected_person:
-                self.current_person = person
-                self.show_person_info()
-                break
+        person = self.people.find_by_display(self.people_listbox.get(selection[0]))
+        if person:
+            self.current_person = person
+            self.show_person_info()
 
     def add_relation_from_list(self):
         """Добавляет связь между выбранными в списке людьми"""
@@ -1734,17 +4790,9 @@ class DataVisualizer:
         person1_str = self.people_listbox.get(selections[0])
         person2_str = self.people_listbox.get(selections[1])
 
-        person1 = None
-        person2 = None
-
         # Находим объекты выбранных людей
-        for person in self.people.values():
-            if str(person) == person1_str:
-                person1 = person
-            if str(person) == person2_str:
-                person2 = person
-            if person1 and person2:
-                break
+        person1 = self.people.find_by_display(person1_str)
+        person2 = self.people.find_by_display(person2_str)
 
         if not person1 or not person2:
             messagebox.showerror("Ошибка", "Не удалось найти выбранных людей")
@@ -1792,27 +4840,16 @@ class DataVisualizer:
         person1_str = self.people_listbox.get(selections[0])
         person2_str = self.people_listbox.get(selections[1])
 
-        person1 = None
-        person2 = None
-
         # Находим объекты выбранных людей
-        for person in self.people.values():
-            if str(person) == person1_str:
-                person1 = person
-            if str(person) == person2_str:
-                person2 = person
-            if person1 and person2:
-                break
+        person1 = self.people.find_by_display(person1_str)
+        person2 = self.people.find_by_display(person2_str)
 
         if not person1 or not person2:
             messagebox.showerror("Ошибка", "Не удалось найти выбранных людей")
             return
 
         # Получаем список связей между этими людьми
-        relations = []
-        for rel in person1.relations:
-            if isinstance(rel[1], Person) and rel[1].full_name == person2.full_name:
-                relations.append(rel[0])
+        relations = sorted(self.relation_store.relation_types(person1, person2))
 
         if not relations:
             messagebox.showinfo("Информация", "Нет связей для удаления")
@@ -1841,11 +4878,9 @@ class DataVisualizer:
             return
 
         for index in selections:
-            person_str = self.people_listbox.get(index)
-            for person in self.people.values():
-                if str(person) == person_str:
-                    self.people_to_merge.add(person)
-                    break
+            person = self.people.find_by_display(self.people_listbox.get(index))
+            if person:
+                self.people_to_merge.add(person)
 
         messagebox.showinfo("Информация",
                             f"Добавлено {len(selections)} человек в список для объединения. Всего: {len(self.people_to_merge)}")
@@ -1858,11 +4893,9 @@ class DataVisualizer:
             return
 
         for index in selections:
-            person_str = self.people_listbox.get(index)
-            for person in self.people.values():
-                if str(person) == person_str:
-                    self.people_to_analyze.add(person)
-                    break
+            person = self.people.find_by_display(self.people_listbox.get(index))
+            if person:
+                self.people_to_analyze.add(person)
 
         messagebox.showinfo("Информация",
                             f"Добавлено {len(selections)} человек в список для анализа. Всего: {len(self.people_to_analyze)}")
@@ -1881,24 +4914,15 @@ class DataVisualizer:
         # Получаем список выбранных людей
         people_to_delete = []
         for index in selections:
-            person_str = self.people_listbox.get(index)
-            for key, person in list(self.people.items()):
-                if str(person) == person_str:
-                    people_to_delete.append((key, person))
-                    break
+            person = self.people.find_by_display(self.people_listbox.get(index))
+            if person:
+                people_to_delete.append((PersonRegistry.person_key(person), person))
 
         # Удаляем людей и все связанные с ними связи
         deleted_count = 0
         for key, person in people_to_delete:
             # Удаляем все связи с этим человеком
-            for other_person in self.people.values():
-                to_remove = []
-                for rel in other_person.relations:
-                    if isinstance(rel[1], Person) and rel[1].full_name == person.full_name:
-                        to_remove.append(rel)
-
-                for rel in to_remove:
-                    other_person.relations.remove(rel)
+            self.relation_store.drop_person(person)
 
             # Удаляем самого человека
             if key in self.people:
@@ -1908,26 +4932,34 @@ class DataVisualizer:
         self.update_people_list()
         messagebox.showinfo("Успех", f"Удалено {deleted_count} человек")
 
-    def merge_selected_people(self):
-        """Объединяет выбранных людей"""
-        if len(self.people_to_merge) < 2:
-            messagebox.showwarning("Предупреждение", "Выберите хотя бы двух человек для объединения")
-            return
-
+    def merge_people(self, people):
+        """Объединяет группу людей в одного, возвращает (основной человек, число объединенных)"""
         # Выбираем основного человека (с наибольшим количеством данных)
-        main_person = max(self.people_to_merge, key=lambda p: len(p.phones) + len(p.emails) + len(p.addresses))
-        self.people_to_merge.remove(main_person)
+        main_person = max(people, key=lambda p: sum(len(p.values(field)) for field in ('phones', 'emails', 'addresses')))
 
         # Объединяем остальных с основным
-        merged_count = 0
-        for person in list(self.people_to_merge):
-            if main_person.merge(person):
+        merged = []
+        for person in people:
+            if person is not main_person and main_person.merge(person):
                 # Удаляем объединенного человека
-                key = (person.full_name.lower(), person.birth_date)
+                key = PersonRegistry.person_key(person)
                 if key in self.people:
                     del self.people[key]
-                merged_count += 1
+                merged.append(person)
+        merged_count = len(merged)
+
+        self.search_index.update(main_person)
+        if self.journal is not None and merged:
+            self.journal.merged(main_person, merged)
+        return main_person, merged_count
+
+    def merge_selected_people(self):
+        """Объединяет выбранных людей"""
+        if len(self.people_to_merge) < 2:
+            messagebox.showwarning("Предупреждение", "Выберите хотя бы двух человек для объединения")
+            return
 
+        main_person, merged_count = self.merge_people(self.people_to_merge)
         self.people_to_merge.clear()
         self.update_people_list()
 
@@ -1938,32 +4970,86 @@ class DataVisualizer:
         else:
             messagebox.showinfo("Информация", "Не удалось объединить выбранных людей")
 
+    def show_duplicates(self):
+        """Окно с ранжированными кандидатами на объединение"""
+        if not self.people:
+            return
+
+        resolver = EntityResolver(self.people)
+        candidates = resolver.candidates()
+
+        window = tk.Toplevel(self.root)
+        window.title("Возможные дубликаты")
+        window.geometry("800x500")
+
+        list_frame = ttk.Frame(window)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        listbox = tk.Listbox(list_frame, selectmode=tk.EXTENDED, font=('Arial', 10))
+        listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        scrollbar = ttk.Scrollbar(list_frame, command=listbox.yview)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        listbox.config(yscrollcommand=scrollbar.set)
+
+        def fill():
+            listbox.delete(0, tk.END)
+            for score, person1, person2, reasons in candidates:
+                listbox.insert(tk.END, f"{score:.2f}  {person1}  ↔  {person2}  ({', '.join(reasons)})")
+
+        def merge(groups):
+            merged = 0
+            for group in groups:
+                merged += self.merge_people(group)[1]
+            self.update_people_list()
+            self.log_action("Объединение дубликатов", f"объединено {merged} человек")
+            messagebox.showinfo("Успех", f"Объединено {merged} человек", parent=window)
+            candidates[:] = resolver.candidates()
+            fill()
+
+        def merge_selected():
+            selected = [candidates[index] for index in listbox.curselection()]
+            if selected:
+                merge(resolver.merge_groups(selected, threshold=0))
+
+        def merge_above_threshold():
+            merge(resolver.merge_groups(candidates))
+
+        fill()
+
+        button_frame = ttk.Frame(window)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(button_frame, text="Объединить выбранные", command=merge_selected).pack(side=tk.LEFT, padx=2)
+        ttk.Button(button_frame, text=f"Объединить все с оценкой ≥ {EntityResolver.AUTO_MERGE_THRESHOLD}",
+                   command=merge_above_threshold).pack(side=tk.LEFT, padx=2)
+        ttk.Button(button_frame, text="Закрыть", command=window.destroy).pack(side=tk.RIGHT, padx=2)
+
     def show_graph_menu(self, event):
         """Показывает контекстное меню для графа"""
         # Определяем, был ли клик по узлу
         self.selected_node = None
-        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
-
-        for node_id, (node_x, node_y) in self.node_positions.items():
-            if (node_x - 60 <= x <= node_x + 60 and
-                    node_y - 40 <= y <= node_y + 40):
-                self.selected_node = node_id
-                break
+        if self.graph_view is not None and event.widget is self.graph_view.canvas:
+            node = self.graph_view.node_at(event.x, event.y)
+            if node is not None and node.kind in ('person', 'name'):
+                self.selected_node = node.key
 
         if self.selected_node:
             self.graph_menu.post(event.x_root, event.y_root)
 
+    def selected_person(self):
+        """Человек выбранного в графе узла (по id - теги узлов у тезок совпадают)"""
+        # У узла имени без карточки ключ - кортеж, человека за ним нет
+        if not isinstance(self.selected_node, str):
+            return None
+        return self.people.get_by_id(self.selected_node)
+
     def show_selected_node_info(self):
         """Показывает информацию о выбранном узле в графе"""
         if not self.selected_node:
             return
 
         # Находим человека по ID узла
-        person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                person = p
-                break
+        person = self.selected_person()
 
         if person:
             self.current_person = person
@@ -1975,11 +5061,7 @@ class DataVisualizer:
             return
 
         # Находим человека по ID узла
-        person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                person = p
-                break
+        person = self.selected_person()
 
         if person:
             self.people_to_merge.add(person)
@@ -1992,11 +5074,7 @@ class DataVisualizer:
             return
 
         # Находим человека по ID узла
-        person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                person = p
-                break
+        person = self.selected_person()
 
         if person:
             self.people_to_analyze.add(person)
@@ -2009,11 +5087,7 @@ class DataVisualizer:
             return
 
         # Находим человека по ID узла
-        person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                person = p
-                break
+        person = self.selected_person()
 
         if not person:
             return
@@ -2023,17 +5097,10 @@ class DataVisualizer:
             return
 
         # Удаляем все связи с этим человеком
-        for other_person in self.people.values():
-            to_remove = []
-            for rel in other_person.relations:
-                if isinstance(rel[1], Person) and rel[1].full_name == person.full_name:
-                    to_remove.append(rel)
-
-            for rel in to_remove:
-                other_person.relations.remove(rel)
+        self.relation_store.drop_person(person)
 
         # Удаляем самого человека
-        key = (person.full_name.lower(), person.birth_date)
+        key = PersonRegistry.person_key(person)
         if key in self.people:
             del self.people[key]
             self.update_people_list()
@@ -2046,20 +5113,13 @@ class DataVisualizer:
             return
 
         # Находим выбранного человека
-        related_person = None
-        for p in self.people.values():
-            if f"node_{p.full_name}" == self.selected_node:
-                related_person = p
-                break
+        related_person = self.selected_person()
 
         if not related_person or related_person == self.current_person:
             return
 
         # Получаем список связей между этими людьми
-        relations = []
-        for rel in self.current_person.relations:
-            if isinstance(rel[1], Person) and rel[1].full_name == related_person.full_name:
-                relations.append(rel[0])
+        relations = sorted(self.relation_store.relation_types(self.current_person, related_person))
 
         if not relations:
             messagebox.showinfo("Информация", "Нет связей для удаления")
@@ -2086,57 +5146,243 @@ class DataVisualizer:
         if folder_path:
             self.process_folder(folder_path)
 
+    def begin_bulk_load(self):
+        """Массовая загрузка: связи и индексы копятся без проверок и строятся в end_bulk_load.
+
+        Загрузки могут вкладываться (файл во время обработки папки) - индексы строятся
+        по завершении внешней.
+        """
+        self.bulk_loading += 1
+        if self.bulk_loading > 1:
+            return
+        self.people.begin_bulk()
+        self.relation_store.begin_bulk()
+
+    def end_bulk_load(self):
+        """Один проход по накопленным данным: хранилище связей, поисковый индекс и граф"""
+        if not self.bulk_loading:
+            return
+        self.bulk_loading -= 1
+        if self.bulk_loading:
+            return
+        changed_ids = self.relation_store.end_bulk()
+        self.people.end_bulk()
+        if self.journal is not None:
+            self.journal.mark(*filter(None, map(self.people.by_id.get, changed_ids)))
+        self.search_index.rebuild(self.people.values())
+        self.relation_graph.rebuild()
+
+    @contextmanager
+    def bulk_load(self):
+        self.begin_bulk_load()
+        try:
+            yield
+        finally:
+            self.end_bulk_load()
+
     def process_folder(self, folder_path):
-        """Обрабатывает все txt файлы в папке"""
+        """Обрабатывает все txt файлы в папке (разбор идет параллельно в пуле процессов)"""
+        if self.ingestion and not self.ingestion.finished:
+            messagebox.showwarning("Предупреждение", "Дождитесь окончания обработки предыдущей папки")
+            return
+
         txt_files = [f for f in os.listdir(folder_path) if f.endswith('.txt')]
-        if not txt_files:
+        if not txt_files and not self.ingest_manifest_exists(folder_path):
             messagebox.showwarning("Предупреждение", "В папке нет txt файлов")
             return
 
-        self.status_bar.config(text=f"Обработка {len(txt_files)} файлов...")
+        # Разбираются только новые и измененные файлы; остальное берется из отпечатков прошлой загрузки
+        self.ingest_manifest = IngestManifest(folder_path)
+        changed, unchanged, removed = self.ingest_manifest.scan(txt_files)
+        self.ingestion_unchanged = len(unchanged)
+        self.retracted_people = set()
+
+        self.status_bar.config(text=f"Обработка {len(changed)} файлов...")
+        self.log_action("Обработка папки", f"{folder_path}: {len(txt_files)} файлов, изменено {len(changed)}, "
+                                           f"удалено {len(removed)}")
+
+        self.ingestion = FolderIngestion([os.path.join(folder_path, f) for f in changed],
+                                         worker=fingerprint_file_worker)
+        self.ingestion_errors = []
+        self.begin_bulk_load()
+
+        for filename in removed:
+            self.retract_file_records(filename)
+            self.ingest_manifest.discard(filename)
+        for filename in unchanged:
+            # Файл не менялся, но его данных нет в памяти (например, после очистки) - записи берем из отпечатков
+            if filename not in self.relation_store.documents:
+                self.current_file_people = set()
+                for record in self.ingest_manifest.records(filename):
+                    self.apply_person_record(record, filename)
+
+        self._show_ingestion_progress()
+        self.root.after(50, self._poll_ingestion)
+
+    def _show_ingestion_progress(self):
+        """Окно прогресса обработки папки с кнопкой отмены.
+
+        Окно модальное: до конца обработки данные в режиме массовой загрузки, в нем правки
+        из интерфейса (связи, удаление людей) не проверяются и не попадают в журнал.
+        """
+        self.ingestion_window = tk.Toplevel(self.root)
+        self.ingestion_window.title("Обработка файлов")
+        self.ingestion_window.geometry("450x130")
+        self.ingestion_window.transient(self.root)
+        self.ingestion_window.protocol("WM_DELETE_WINDOW", self.cancel_ingestion)
+        self.ingestion_window.wait_visibility()
+        self.ingestion_window.grab_set()
+
+        self.ingestion_label = ttk.Label(self.ingestion_window, text="Разбор файлов...")
+        self.ingestion_label.pack(pady=10)
+
+        self.ingestion_progress = ttk.Progressbar(self.ingestion_window, maximum=self.ingestion.total)
+        self.ingestion_progress.pack(fill=tk.X, padx=20, pady=5)
+
+        ttk.Button(self.ingestion_window, text="Отмена", command=self.cancel_ingestion).pack(pady=5)
+
+    def cancel_ingestion(self):
+        """Отменяет обработку папки; уже разобранные файлы остаются загруженными"""
+        if self.ingestion and not self.ingestion.finished:
+            self.ingestion.cancel()
+            self.log_action("Обработка папки", "отменена пользователем")
+
+    def _poll_ingestion(self):
+        """Сводит готовые результаты рабочих процессов в общие данные (вызывается через after)"""
+        ingestion = self.ingestion
+
+        for file_path, result, error in ingestion.collect():
+            filename = os.path.basename(file_path)
+            if error:
+                self.ingestion_errors.append(filename)
+                self.logger.error(f"Ошибка при обработке файла {filename}: {error}")
+                continue
+
+            digest, records = result
+            if self.ingest_manifest.same_content(filename, digest) and filename in self.relation_store.documents:
+                continue
+            # Сначала отзываем то, что давала прежняя версия файла
+            self.retract_file_records(filename)
+            self.ingest_manifest.update(filename, digest, records)
 
-        # Обрабатываем каждый файл
-        for filename in txt_files:
+            # Люди из одного файла связываются через гиперребро файла (Person.add_source_file)
             self.current_file_people = set()  # Сбрасываем список людей для текущего файла
-            file_path = os.path.join(folder_path, filename)
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
+            for record in records:
+                self.apply_person_record(record, filename)
+
+        self.ingestion_progress.config(value=ingestion.completed)
+        self.ingestion_label.config(text=f"Обработано {ingestion.completed} из {ingestion.total} файлов")
+        self.status_bar.config(text=f"Обработка файлов: {ingestion.completed}/{ingestion.total} | "
+                                    f"Людей: {len(self.people)}")
 
-            self.parse_data(content, source_file=filename)
+        if ingestion.finished:
+            self._finish_ingestion()
+        else:
+            self.root.after(50, self._poll_ingestion)
 
-            # Создаем связи между всеми людьми из одного файла
-            self.create_relations_within_file()
+    def _finish_ingestion(self):
+        ingestion = self.ingestion
+        ingestion.close()
+        self.ingestion_window.destroy()
 
+        # Связи между файлами у людей с отозванными данными пересчитываются заново
+        self.retract_cross_file_relations(self.retracted_people)
+        removed_count = self.remove_orphaned_people(self.retracted_people)
+        self.retracted_people = set()
         # После загрузки всех файлов устанавливаем связи между людьми из разных файлов
         self.create_cross_file_relations()
+        self.end_bulk_load()
+
+        try:
+            self.ingest_manifest.save()
+        except OSError as e:
+            self.logger.error(f"Не удалось сохранить отпечатки файлов: {e}")
 
         self.update_people_list()
-        self.status_bar.config(text=f"Загружено {len(txt_files)} файлов | Людей: {len(self.people)}")
-        messagebox.showinfo("Успех", f"Обработано {len(txt_files)} файлов, найдено {len(self.people)} человек")
+        self.status_bar.config(text=f"Загружено {ingestion.completed} файлов | Людей: {len(self.people)}")
+
+        message = f"Обработано {ingestion.completed} из {ingestion.total} файлов, найдено {len(self.people)} человек"
+        if self.ingestion_unchanged:
+            message += f"\n\nБез изменений (не разбирались): {self.ingestion_unchanged}"
+        if removed_count:
+            message += f"\nУдалено людей без источников: {removed_count}"
+        if ingestion.cancelled:
+            message += "\n\nОбработка была отменена"
+        if self.ingestion_errors:
+            message += f"\n\nНе удалось обработать файлов: {len(self.ingestion_errors)}"
+        messagebox.showinfo("Успех", message)
+        self.log_action("Обработка папки", message.replace("\n", " "))
 
-    def create_relations_within_file(self):
-        """Создает связи между всеми людьми из одного файла"""
-        if len(self.current_file_people) < 2:
-            return
+    @staticmethod
+    def ingest_manifest_exists(folder_path):
+        return os.path.exists(IngestManifest(folder_path).path)
 
-        people_list = list(self.current_file_people)
-        for i in range(len(people_list)):
-            for j in range(i + 1, len(people_list)):
-                person1 = people_list[i]
-                person2 = people_list[j]
+    def retract_file_records(self, filename):
+        """Отзывает данные, которые дала прежняя версия файла (по записям из отпечатков).
 
-                # Добавляем связь с указанием источника и причины
-                details = {
-                    'source_files': list(person1.source_files),
-                    'reason': 'из одного файла'
-                }
-                person1.add_relation("связь", person2, details)
+        Значения, которые есть и в других файлах, после отзыва возвращаются из их записей.
+        """
+        manifest = self.ingest_manifest
+        for record in manifest.records(filename):
+            key = manifest.record_key(record)
+            person = self.people.get(key)
+            if person is None:  # Человек объединен с другим или удален вручную
+                continue
+
+            for field in ('phones', 'emails', 'addresses', 'passports', 'cars', 'jobs', 'bank_accounts'):
+                if record.get(field) and person.values(field):
+                    person.values(field).difference_update(record[field])
+            for field in ('snils', 'inn', 'driver_license'):
+                if field in record and getattr(person, field) == record[field]:
+                    setattr(person, field, None)
+            for platform, accounts in record.get('social_media', {}).items():
+                social_media = person.values('social_media')
+                if platform in social_media:
+                    social_media[platform].difference_update(accounts)
+                    if not social_media[platform]:
+                        del social_media[platform]
+            person.remove_source_file(filename)
+
+            for other_file, other_record in manifest.person_records(key):
+                if other_file != filename:
+                    self.apply_person_record(other_record, other_file)
+            self.retracted_people.add(person)
+            if self.journal is not None:
+                self.journal.mark(person)
+
+    def retract_cross_file_relations(self, people):
+        """Удаляет связи между файлами (create_cross_file_relations), чтобы построить их заново"""
+        for person in people:
+            for relation_type, related_person, details in list(self.relation_store.explicit_relations(person)):
+                if (relation_type == "возможная связь" and isinstance(related_person, Person) and
+                        dict(details).get('reason') == 'одинаковые фамилия и имя в разных файлах'):
+                    person.remove_relation(relation_type, related_person)
+                    person.touch("system")
+
+    def remove_orphaned_people(self, people):
+        """Удаляет людей, у которых после отзыва не осталось ни файлов, ни данных, ни явных связей"""
+        removed = 0
+        for person in people:
+            key = PersonRegistry.person_key(person)
+            if self.people.get(key) is not person or person.values('source_files'):
+                continue
+            if any(person.values(field) for field in Person.CONTAINER_FIELDS):
+                continue
+            if person.snils or person.inn or person.driver_license or self.relation_store.explicit_relations(person):
+                continue
+            self.relation_store.drop_person(person)
+            del self.people[key]
+            if self.people.bulk and self.journal is not None:
+                # В режиме массовой загрузки реестр не уведомляет журнал
+                self.journal.person_removed(person)
+            removed += 1
+        return removed
 
     def create_cross_file_relations(self):
         """Создает связи между людьми из разных файлов с одинаковыми именами"""
         people_by_name = defaultdict(list)
         for person in self.people.values():
-            name_key = (person.full_name.split()[0], person.full_name.split()[1])  # Фамилия и имя
+            name_key = tuple(person.full_name.split()[:2])  # Фамилия и имя (или только фамилия)
             people_by_name[name_key].append(person)
 
         # Для каждой группы людей с одинаковыми фамилией и именем
@@ -2144,10 +5390,15 @@ class DataVisualizer:
             if len(people_group) > 1:
                 # Сортируем по количеству файлов-источников
                 people_group.sort(key=lambda p: len(p.source_files), reverse=True)
-                main_person = people_group[0]
 
-                # Добавляем связи с остальными
-                for person in people_group[1:]:
+                # Связываем все пары из разных файлов; в очень больших группах - только с основным
+                if len(people_group) > EntityResolver.MAX_BLOCK_SIZE:
+                    pairs = ((people_group[0], person) for person in people_group[1:])
+                else:
+                    pairs = ((people_group[i], people_group[j])
+                             for i in range(len(people_group)) for j in range(i + 1, len(people_group)))
+
+                for main_person, person in pairs:
                     # Проверяем, что люди из разных файлов
                     if not main_person.source_files.intersection(person.source_files):
                         details = {
@@ -2158,171 +5409,108 @@ class DataVisualizer:
 
     def parse_data(self, content, source_file=None):
         """Парсит данные из текста файла"""
-        sections = re.split(r'=== (.*?) ===', content)[1:]
+        for record in parse_records(content):
+            self.apply_person_record(record, source_file)
 
-        for i in range(0, len(sections), 2):
-            section_name = sections[i].strip()
-            section_content = sections[i + 1].strip()
+    def process_person_data(self, data, source, source_file=None):
+        record = extract_person_record(data)
+        if record:
+            self.apply_person_record(record, source_file)
 
-            if not section_name or not section_content:
-                continue
+    def apply_person_record(self, record, source_file=None):
+        """Добавляет запись о человеке (результат разбора) в общие данные"""
+        # Создаем или получаем объект человека
+        person = self._get_or_create_person(record['full_name'], record.get('birth_date'))
+        if source_file:
+            person.add_source_file(source_file)
+            self.current_file_people.add(person)  # Добавляем человека в список текущего файла
 
-            self.parse_section(section_name, section_content, source_file)
+        for field in ('phones', 'emails', 'addresses', 'passports', 'cars', 'jobs', 'bank_accounts'):
+            if record.get(field):
+                # Адреса, места работы и т.п. повторяются у многих людей - храним одну копию строки
+                getattr(person, field).update(map(sys.intern, record[field]))
 
-    def parse_section(self, section_name, section_content, source_file=None):
-        lines = [line.strip() for line in section_content.split('\n') if line.strip()]
+        for field in ('snils', 'inn', 'driver_license'):
+            if field in record:
+                setattr(person, field, record[field])
 
-        # Общая сводка
-        if section_name.lower().startswith('общая сводка'):
-            self.parse_general_summary(lines, source_file)
+        for platform, accounts in record.get('social_media', {}).items():
+            person.social_media[platform].update(accounts)
 
-        # Все остальные разделы
-        else:
-            person_data = {}
-            for line in lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    person_data[key.strip().lower()] = value.strip()
+        if not self.bulk_loading:
+            self.search_index.update(person)
+        if self.journal is not None:
+            self.journal.mark(person)
+        return person
 
-            self.process_person_data(person_data, section_name, source_file)
+    def _get_or_create_person(self, full_name, birth_date=None):
+        normalized_name = Person.normalize_name(full_name)
+        key = (normalized_name.lower(), birth_date)
 
-    def parse_general_summary(self, lines, source_file=None):
-        current_person = None
-        data = {}
+        if key not in self.people:
+            self.people[key] = Person(normalized_name, birth_date, relation_store=self.relation_store)
 
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                key = key.strip().lower()
-                value = value.strip()
-                data[key] = value
-            elif line.startswith('---'):
-                if data:
-                    self.process_person_data(data, "Общая сводка", source_file)
-                    data = {}
+        return self.people[key]
 
-        if data:
-            self.process_person_data(data, "Общая сводка", source_file)
+    def update_people_list(self, rows=None):
+        """Показывает первую страницу списка людей (rows - готовые строки после фильтров)"""
+        self.people_page_rows = rows
+        self.people_page_starts = [None]
+        self.show_people_page()
 
-    def process_person_data(self, data, source, source_file=None):
-        # Извлекаем основные данные о человеке
-        full_name = None
-        birth_date = None
+    def next_people_page(self):
+        if self.people_next_start is not None:
+            self.people_page_starts.append(self.people_next_start)
+            self.show_people_page()
 
-        # Пытаемся найти имя в разных полях
-        for field in ['фио', 'имя клиента', 'наименование клиента', 'фам', 'ф.и.о.', 'личности']:
-            if field in data:
-                name_data = data[field]
-                # Извлекаем все возможные имена из строки
-                names = re.findall(r'[А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)?', name_data)
-                if names:
-                    full_name = names[0]
-                    break
+    def previous_people_page(self):
+        if len(self.people_page_starts) > 1:
+            self.people_page_starts.pop()
+            self.show_people_page()
 
-                # Пробуем извлечь имя из строк типа "Коваль Павел Павлович 05.08.1990"
-                name_parts = re.split(r'\s+', name_data)
-                if len(name_parts) >= 3 and re.match(r'\d{2}\.\d{2}\.\d{4}', name_parts[-1]):
-                    full_name = ' '.join(name_parts[:3])
-                    birth_date = name_parts[-1]
-                    break
+    def show_people_page(self):
+        """Строки списка после начала текущей страницы, не больше PEOPLE_PAGE_SIZE.
 
-        # Если имя не найдено, пропускаем запись
-        if not full_name:
+        Из базы читается только одна страница (сами люди загружаются при выборе); люди
+        в памяти - новые и измененные - вставляются в нее по порядку.
+        """
+        start = self.people_page_starts[-1]
+        size = self.PEOPLE_PAGE_SIZE
+        if self.people_page_rows is not None:
+            # Готовые строки листаются по номеру строки
+            start = start or 0
+            entries = self.people_page_rows[start:start + size + 1]
+            self.people_next_start = start + size if len(entries) > size else None
+            self._fill_people_page(entries[:size])
             return
 
-        # Пытаемся найти дату рождения
-        if not birth_date:
-            for field in ['день рождения', 'дата рождения', 'birth_date', 'дата']:
-                if field in data:
-                    date_str = data[field]
-                    if re.match(r'\d{2}\.\d{2}\.\d{4}', date_str):
-                        birth_date = date_str
-                        break
-                    elif re.match(r'\d{4}-\d{2}-\d{2}', date_str):
-                        birth_date = datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')
-                        break
-
-        # Создаем или получаем объект человека
-        person = self._get_or_create_person(full_name, birth_date)
-        if source_file:
-            person.source_files.add(source_file)
-            self.current_file_people.add(person)  # Добавляем человека в список текущего файла
-
-        # Добавляем телефоны
-        if 'телефон' in data:
-            phones = re.findall(r'[\d\(\)\+\- ]{7,}', data['телефон'])
-            for phone in phones:
-                clean_phone = re.sub(r'[^\d]', '', phone)
-                if len(clean_phone) >= 10:
-                    person.phones.add(clean_phone)
-
-        # Добавляем email
-        if 'email' in data:
-            emails = re.findall(r'[\w\.-]+@[\w\.-]+', data['email'])
-            person.emails.update(emails)
-
-        # Добавляем адреса
-        if 'адрес' in data:
-            address = data['адрес']
-            if address and len(address) > 5:  # Минимальная длина для адреса
-                person.addresses.add(address)
-
-        # Добавляем паспортные данные
-        if 'паспорт' in data:
-            passport = data['паспорт']
-            if passport and len(passport) >= 6:  # Минимальная длина для паспорта
-                person.passports.add(passport)
-
-        # Добавляем автомобили
-        if 'автомобили' in data:
-            cars = re.findall(r'[А-ЯЁа-яё]\d{3}[А-ЯЁа-яё]{2}\d{2,3}', data['автомобили'])
-            person.cars.update(cars)
-
-        # Добавляем СНИЛС
-        if 'снилс' in data:
-            snils = data['снилс']
-            if len(snils) >= 11:
-                person.snils = snils
-
-        # Добавляем ИНН
-        if 'инн' in data:
-            inn = data['инн']
-            if len(inn) >= 10:
-                person.inn = inn
-
-        # Добавляем водительские права
-        if 'водительское удостоверение' in data:
-            license_num = data['водительское удостоверение']
-            if len(license_num) >= 6:
-                person.driver_license = license_num
-
-        # Добавляем информацию о работе
-        if 'место работы' in data:
-            person.jobs.add(data['место работы'])
-
-        # Добавляем социальные сети
-        if 'ссылка' in data and ('vk.com' in data['ссылка'] or 'ok.ru' in data['ссылка']):
-            person.social_media['vk' if 'vk.com' in data['ссылка'] else 'ok'].add(data['ссылка'])
-
-        # Добавляем банковские счета
-        if 'банк' in data or 'счет' in data:
-            bank_info = data.get('банк', '') + ' ' + data.get('счет', '')
-            if bank_info.strip():
-                person.bank_accounts.add(bank_info.strip())
-
-    def _get_or_create_person(self, full_name, birth_date=None):
-        normalized_name = Person.normalize_name(full_name)
-        key = (normalized_name.lower(), birth_date)
-
-        if key not in self.people:
-            self.people[key] = Person(normalized_name, birth_date)
+        entries = [display for display in map(str, self.people.values()) if start is None or display > start]
+        if self.dataset is not None:
+            loader = self.people.loader
+            # Строки людей, которые уже в памяти или удалены, пропускаются - берем следующие.
+            # Лишняя строка показывает, есть ли следующая страница
+            after = start
+            found = 0
+            while found <= size:
+                rows = self.dataset.displays_after(after, size + 1)
+                for person_id, display in rows:
+                    if person_id not in self.people.by_id and (loader is None or person_id not in loader.deleted):
+                        entries.append(display)
+                        found += 1
+                if len(rows) <= size:
+                    break
+                after = rows[-1][1]
 
-        return self.people[key]
+        # Первые size строк объединения - ровно начало списка после start
+        entries = heapq.nsmallest(size + 1, set(entries))
+        self.people_next_start = entries[size - 1] if len(entries) > size else None
+        self._fill_people_page(entries[:size])
 
-    def update_people_list(self):
+    def _fill_people_page(self, entries):
         self.people_listbox.delete(0, tk.END)
-        for person in sorted(self.people.values(), key=lambda p: p.full_name):
-            self.people_listbox.insert(tk.END, str(person))
+        for entry in entries:
+            self.people_listbox.insert(tk.END, entry)
+        self.people_page_label.config(text=f"Стр. {len(self.people_page_starts)}")
 
     def reset_search(self):
         """Сбрасывает результаты поиска и показывает всех людей"""
@@ -2337,17 +5525,17 @@ class DataVisualizer:
             selected_person = self.people_listbox.get(selection[0])
 
             # Находим выбранного человека
-            for person in self.people.values():
-                if str(person) == selected_person:
-                    self.current_person = person
-                    self.show_person_info()
-                    break
+            person = self.people.find_by_display(selected_person)
+            if person:
+                self.current_person = person
+                self.show_person_info()
 
     def show_person_info(self):
         self.clear_canvas()
 
         if not self.current_person:
             return
+        self.hydrate_person(self.current_person)
 
         # Создаем Notebook для вкладок
         notebook = ttk.Notebook(self.inner_frame)
@@ -2516,103 +5704,112 @@ class DataVisualizer:
             messagebox.showwarning("Предупреждение", "Сначала выберите человека из списка")
             return
 
+        self.hydrate_person(self.current_person)
         self.clear_canvas()
-        self.node_positions = {}
+        self.current_view = self.show_relations
 
         # Создаем холст для графа
-        graph_canvas = tk.Canvas(self.inner_frame, width=1000, height=700, bg='white')
-        graph_canvas.grid(row=0, column=0, sticky="nsew")
-        self.graph_objects.append(graph_canvas)
+        graph_canvas = self._create_graph_canvas('white')
 
         # Центральный узел - текущий человек
-        center_x, center_y = 500, 350
-        node_id = f"node_{self.current_person.full_name}"
-        self.node_positions[node_id] = (center_x, center_y)
-
-        graph_canvas.create_oval(center_x - 60, center_y - 40, center_x + 60, center_y + 40,
-                                 fill='#a6d8ff', outline='#005599', tags=node_id)
-        graph_canvas.create_text(center_x, center_y, text=self.current_person.full_name.split()[0],
-                                 font=('Arial', 12, 'bold'), fill='#003366', tags=node_id)
+        center = SceneNode(self.current_person.id, PersonRegistry.node_tag(self.current_person),
+                           self.current_person.full_name.split()[0], '#a6d8ff', outline='#005599',
+                           text_color='#003366', font_size=12, person=self.current_person)
 
         # Добавляем связанных людей
         relations = list(self.current_person.relations)
         if not relations:
-            graph_canvas.create_text(center_x, center_y + 100, text="Нет информации о связях",
-                                     font=('Arial', 10), fill='gray')
+            self.graph_view.set_scene([center], [])
+            self.graph_view.fit()
+            self.graph_view.render()
+            graph_canvas.create_text(500, 450, text="Нет информации о связях", font=('Arial', 10), fill='gray')
             return
 
-        angle_step = 360 / len(relations)
-        current_angle = 0
-
-        for rel_type, related_person, details in relations:
-            # Находим связанного человека (если это объект Person)
-            if isinstance(related_person, Person):
-                person_obj = related_person
-                person_name = related_person.full_name
-            else:
-                # Ищем человека по имени в нашей базе
-                person_obj = None
-                person_name = related_person
-                for p in self.people.values():
-                    if p.full_name == related_person or related_person in p.full_name:
-                        person_obj = p
-                        break
-
-            # Координаты связанного узла
-            rad = math.radians(current_angle)
-            node_x = center_x + 250 * math.cos(rad)
-            node_y = center_y + 250 * math.sin(rad)
-
-            # ID узла
-            if person_obj:
-                node_id = f"node_{person_obj.full_name}"
-            else:
-                node_id = f"node_{person_name}_{current_angle}"
-
-            self.node_positions[node_id] = (node_x, node_y)
+        entries = [self._relation_scene_entry(i, center, rel_type, related_person, dict(details))
+                   for i, (rel_type, related_person, details) in enumerate(relations)]
 
-            # Цвет узла в зависимости от типа связи
-            if 'семь' in rel_type.lower() or 'супруг' in rel_type.lower():
-                node_color = '#ffb6c1'  # Розовый для семейных связей
-            elif 'работ' in rel_type.lower() or 'коллег' in rel_type.lower():
-                node_color = '#98fb98'  # Зеленый для рабочих связей
-            elif 'возможн' in rel_type.lower():
-                node_color = '#ffa07a'  # Светло-коралловый для возможных связей
-            else:
-                node_color = '#ffd700'  # Золотой для остальных
-
-            # Рисуем узел связанного человека
-            graph_canvas.create_oval(node_x - 60, node_y - 40, node_x + 60, node_y + 40,
-                                     fill=node_color, outline='#8b4513', tags=node_id)
-
-            # Имя связанного человека (только фамилия)
-            last_name = person_name.split()[0] if ' ' in person_name else person_name
-            graph_canvas.create_text(node_x, node_y, text=last_name,
-                                     font=('Arial', 10, 'bold'), fill='#8b4513', tags=node_id)
+        if len(entries) <= self.RELATION_GROUP_THRESHOLD:
+            nodes, edges = map(list, zip(*entries))
+        else:
+            # У «хаба» соседи сворачиваются в группы по типу связи (связи «из одного файла» - по файлу)
+            groups = defaultdict(list)
+            for (rel_type, _, details), entry in zip(relations, entries):
+                details = dict(details)
+                if rel_type == RelationStore.COOCCURRENCE_TYPE and details.get('source_files'):
+                    groups[(rel_type, details['source_files'][0])].append(entry)
+                else:
+                    groups[(rel_type, None)].append(entry)
+
+            nodes, edges = [], []
+            for (rel_type, source_file), members in sorted(groups.items(), key=lambda item: -len(item[1])):
+                label = f"{source_file or rel_type} ({len(members)})"
+                group = SceneNode(('group', rel_type, source_file), f"group_{len(nodes)}", label,
+                                  self._relation_node_color(rel_type), kind='group')
+                # Раскрытые соседи соединяются с узлом группы, а не с центром
+                for _, edge in members:
+                    edge.source = group.key
+                group.children = ([node for node, _ in members], [edge for _, edge in members])
+                nodes.append(group)
+                edges.append(SceneEdge(center.key, group.key, label=rel_type))
+
+        # Узлы первого уровня - по кругу радиусом 250 (больше, если узлы на нем не помещаются)
+        angle_step = 2 * math.pi / len(nodes)
+        radius = max(250, len(nodes) * 2 * GraphRenderer.NODE_RX / (2 * math.pi))
+        for i, node in enumerate(nodes):
+            node.x = radius * math.cos(i * angle_step)
+            node.y = radius * math.sin(i * angle_step)
+
+        self.graph_view.set_scene([center] + nodes, edges)
+        self.graph_view.fit()
+        self.graph_view.render()
+        if len(relations) > self.RELATION_GROUP_THRESHOLD:
+            self.status_bar.config(text=f"Связей: {len(relations)} | Групп: {len(nodes)} "
+                                        f"(щелчок по группе раскрывает ее)")
 
-            # Рисуем линию связи
-            graph_canvas.create_line(center_x, center_y, node_x, node_y,
-                                     arrow=tk.LAST, fill='#666666', width=2)
+    @staticmethod
+    def _relation_node_color(rel_type):
+        """Цвет узла в зависимости от типа связи"""
+        rel_type = rel_type.lower()
+        if 'семь' in rel_type or 'супруг' in rel_type:
+            return '#ffb6c1'  # Розовый для семейных связей
+        if 'работ' in rel_type or 'коллег' in rel_type:
+            return '#98fb98'  # Зеленый для рабочих связей
+        if 'возможн' in rel_type:
+            return '#ffa07a'  # Светло-коралловый для возможных связей
+        return '#ffd700'  # Золотой для остальных
+
+    def _relation_scene_entry(self, index, center, rel_type, related_person, details):
+        """Узел связанного человека и связь к нему от центрального узла"""
+        # Находим связанного человека (если это объект Person)
+        if isinstance(related_person, Person):
+            person_obj = related_person
+            person_name = related_person.full_name
+        else:
+            # Ищем человека по имени в нашей базе
+            person_obj = self.people.find_by_name(related_person)
+            person_name = related_person
 
-            # Подпись связи
-            label_x = center_x + 125 * math.cos(rad)
-            label_y = center_y + 125 * math.sin(rad)
+        if person_obj:
+            key, tag = person_obj.id, PersonRegistry.node_tag(person_obj)
+        else:
+            key, tag = ('name', person_name, index), f"node_{person_name}_{index}"
 
-            # Добавляем информацию об источниках и причинах, если есть
-            label_text = rel_type
-            if details:
-                details_text = []
-                if 'source_files' in details:
-                    details_text.append(f"источники: {len(details['source_files'])}")
-                if 'reason' in details:
-                    details_text.append(f"причина: {details['reason']}")
-                if details_text:
-                    label_text += f"\n({'; '.join(details_text)})"
+        # Имя связанного человека (только фамилия)
+        last_name = person_name.split()[0] if ' ' in person_name else person_name
+        node = SceneNode(key, tag, last_name, self._relation_node_color(rel_type),
+                         kind='person' if person_obj else 'name', person=person_obj)
 
-            graph_canvas.create_text(label_x, label_y, text=label_text,
-                                     font=('Arial', 8), fill='#333333')
+        # Добавляем информацию об источниках и причинах, если есть
+        label_text = rel_type
+        details_text = []
+        if 'source_files' in details:
+            details_text.append(f"источники: {len(details['source_files'])}")
+        if 'reason' in details:
+            details_text.append(f"причина: {details['reason']}")
+        if details_text:
+            label_text += f"\n({'; '.join(details_text)})"
 
-            current_angle += angle_step
+        return node, SceneEdge(center.key, key, label=label_text)
 
     def search_data(self):
         query = self.search_entry.get().strip().lower()
@@ -2620,88 +5817,11 @@ class DataVisualizer:
             messagebox.showwarning("Предупреждение", "Введите поисковый запрос")
             return
 
-        self.search_results = []
-
-        # Ищем по всем полям всех людей
-        for person in self.people.values():
-            # Проверяем имя и алиасы
-            if (query in person.full_name.lower() or
-                any(query in alias.lower() for alias in person.aliases)):
-                self.search_results.append(person)
-                continue
-
-            # Проверяем телефоны
-            for phone in person.phones:
-                if query in phone:
-                    self.search_results.append(person)
-                    break
-
-            # Проверяем email
-            for email in person.emails:
-                if query in email.lower():
-                    self.search_results.append(person)
-                    break
-
-            # Проверяем адреса
-            for address in person.addresses:
-                if query in address.lower():
-                    self.search_results.append(person)
-                    break
-
-            # Проверяем автомобили
-            for car in person.cars:
-                if query in car.lower():
-                    self.search_results.append(person)
-                    break
-
-            # Проверяем паспорта
-            for passport in person.passports:
-                if query in passport:
-                    self.search_results.append(person)
-                    break
-
-            # Проверяем СНИЛС
-            if person.snils and query in person.snils:
-                self.search_results.append(person)
-                continue
-
-            # Проверяем ИНН
-            if person.inn and query in person.inn:
-                self.search_results.append(person)
-                continue
-
-            # Проверяем водительские права
-            if person.driver_license and query in person.driver_license:
-                self.search_results.append(person)
-                continue
-
-            # Проверяем места работы
-            for job in person.jobs:
-                if query in job.lower():
-                    self.search_results.append(person)
-                    break
-
-            # Проверяем социальные сети
-            for platform, accounts in person.social_media.items():
-                for account in accounts:
-                    if query in account.lower():
-                        self.search_results.append(person)
-                        break
-
-            # Проверяем банковские счета
-            for account in person.bank_accounts:
-                if query in account.lower():
-                    self.search_results.append(person)
-                    break
-
-            # Проверяем файлы-источники
-            for source in person.source_files:
-                if query in source.lower():
-                    self.search_results.append(person)
-                    break
-
-        # Удаляем дубликаты
-        self.search_results = list(set(self.search_results))
+        # Ищем по всем полям всех людей через триграммный индекс (и в базе, если она открыта)
+        found_ids = self.search_index.search(query)
+        if self.people.loader is not None:
+            found_ids = list(dict.fromkeys(found_ids + self.people.loader.search(query)))
+        self.search_results = [self.people.get_by_id(person_id) for person_id in found_ids]
 
         # Обновляем список
         self.people_listbox.delete(0, tk.END)
@@ -2716,20 +5836,17 @@ class DataVisualizer:
             return
 
         try:
-            data_to_save = {
-                'people': [person.to_dict() for person in self.people.values()],
-                'timestamp': datetime.now().isoformat()
-            }
-
             file_path = filedialog.asksaveasfilename(
                 title="Сохранить данные",
-                filetypes=(("JSON файлы", "*.json"), ("Все файлы", "*.*")),
+                filetypes=(("JSON файлы", "*.json"), ("Снимки", "*.bgs"), *self.EXPORT_FILETYPES[1:]),
                 defaultextension=".json"
             )
 
             if file_path:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(data_to_save, f, ensure_ascii=False, indent=2)
+                if file_path.endswith('.bgs'):
+                    write_snapshot(file_path, self.people, self.relation_store)
+                else:
+                    StreamingExporter(file_path).write(self.people.values(), timestamp=datetime.now().isoformat())
 
                 messagebox.showinfo("Успех", "Данные успешно сохранены!")
                 self.status_bar.config(text=f"Данные сохранены в: {file_path}")
@@ -2737,26 +5854,29 @@ class DataVisualizer:
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка при сохранении данных:\n{str(e)}")
 
+    # Форматы потокового экспорта (сжатие выбирается по расширению)
+    EXPORT_FILETYPES = (
+        ("JSON файлы", "*.json"),
+        ("JSON Lines", "*.jsonl"),
+        ("Сжатые JSON", "*.json.gz *.json.xz"),
+        ("Сжатые JSON Lines", "*.jsonl.gz *.jsonl.xz"),
+        ("Все файлы", "*.*"),
+    )
+
     def export_to_json(self):
         if not self.people:
             messagebox.showwarning("Предупреждение", "Нет данных для экспорта")
             return
 
         try:
-            data_to_export = {
-                'people': [person.to_dict() for person in self.people.values()],
-                'timestamp': datetime.now().isoformat()
-            }
-
             file_path = filedialog.asksaveasfilename(
                 title="Экспорт в JSON",
-                filetypes=(("JSON файлы", "*.json"), ("Все файлы", "*.*")),
+                filetypes=self.EXPORT_FILETYPES,
                 defaultextension=".json"
             )
 
             if file_path:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(data_to_export, f, ensure_ascii=False, indent=2)
+                StreamingExporter(file_path).write(self.people.values(), timestamp=datetime.now().isoformat())
 
                 messagebox.showinfo("Успех", "Данные успешно экспортированы в JSON!")
                 self.status_bar.config(text=f"Данные экспортированы в: {file_path}")
@@ -2816,64 +5936,64 @@ class DataVisualizer:
                         f.write(f'<div class="item">ИНН: {escape(person.inn)}</div>\n')
                     if person.driver_license:
                         f.write(f'<div class="item">Водительское удостоверение: {escape(person.driver_license)}</div>\n')
-                    if person.source_files:
-                        files = ", ".join(escape(f) for f in person.source_files)
+                    if person.values('source_files'):
+                        files = ", ".join(escape(f) for f in person.values('source_files'))
                         f.write(f'<div class="item">Источники данных: {files}</div>\n')
-                    if person.aliases:
-                        aliases = ", ".join(escape(a) for a in person.aliases)
+                    if person.values('aliases'):
+                        aliases = ", ".join(escape(a) for a in person.values('aliases'))
                         f.write(f'<div class="item">Другие варианты имени: {aliases}</div>\n')
                     f.write('</div>\n')
 
                     # Контактные данные
-                    if person.phones or person.emails or person.addresses:
+                    if person.values('phones') or person.values('emails') or person.values('addresses'):
                         f.write('<div class="section">\n')
                         f.write('<h3>Контактные данные</h3>\n')
-                        if person.phones:
+                        if person.values('phones'):
                             f.write('<div class="item">Телефоны:</div>\n')
-                            for phone in person.phones:
+                            for phone in person.values('phones'):
                                 f.write(f'<div class="item" style="margin-left:40px;">{escape(phone)}</div>\n')
-                        if person.emails:
+                        if person.values('emails'):
                             f.write('<div class="item">Email:</div>\n')
-                            for email in person.emails:
+                            for email in person.values('emails'):
                                 f.write(f'<div class="item" style="margin-left:40px;">{escape(email)}</div>\n')
-                        if person.addresses:
+                        if person.values('addresses'):
                             f.write('<div class="item">Адреса:</div>\n')
-                            for address in person.addresses:
+                            for address in person.values('addresses'):
                                 f.write(f'<div class="item" style="margin-left:40px;">{escape(address)}</div>\n')
                         f.write('</div>\n')
 
                     # Документы
-                    if person.passports:
+                    if person.values('passports'):
                         f.write('<div class="section">\n')
                         f.write('<h3>Документы</h3>\n')
                         f.write('<div class="item">Паспорта:</div>\n')
-                        for passport in person.passports:
+                        for passport in person.values('passports'):
                             f.write(f'<div class="item" style="margin-left:40px;">{escape(passport)}</div>\n')
                         f.write('</div>\n')
 
                     # Транспорт
-                    if person.cars:
+                    if person.values('cars'):
                         f.write('<div class="section">\n')
                         f.write('<h3>Транспорт</h3>\n')
                         f.write('<div class="item">Автомобили:</div>\n')
-                        for car in person.cars:
+                        for car in person.values('cars'):
                             f.write(f'<div class="item" style="margin-left:40px;">{escape(car)}</div>\n')
                         f.write('</div>\n')
 
                     # Финансы
-                    if person.bank_accounts:
+                    if person.values('bank_accounts'):
                         f.write('<div class="section">\n')
                         f.write('<h3>Финансы</h3>\n')
                         f.write('<div class="item">Банковские счета:</div>\n')
-                        for account in person.bank_accounts:
+                        for account in person.values('bank_accounts'):
                             f.write(f'<div class="item" style="margin-left:40px;">{escape(account)}</div>\n')
                         f.write('</div>\n')
 
                     # Социальные сети
-                    if any(person.social_media.values()):
+                    if any(dict(person.values('social_media')).values()):
                         f.write('<div class="section">\n')
                         f.write('<h3>Социальные сети</h3>\n')
-                        for platform, accounts in person.social_media.items():
+                        for platform, accounts in dict(person.values('social_media')).items():
                             if accounts:
                                 f.write(f'<div class="item">{platform.upper()}:</div>\n')
                                 for account in accounts:
@@ -2881,11 +6001,11 @@ class DataVisualizer:
                         f.write('</div>\n')
 
                     # Работа
-                    if person.jobs:
+                    if person.values('jobs'):
                         f.write('<div class="section">\n')
                         f.write('<h3>Работа</h3>\n')
                         f.write('<div class="item">Места работы:</div>\n')
-                        for job in person.jobs:
+                        for job in person.values('jobs'):
                             f.write(f'<div class="item" style="margin-left:40px;">{escape(job)}</div>\n')
                         f.write('</div>\n')
 
@@ -2943,14 +6063,11 @@ class DataVisualizer:
 
         try:
             self.current_file_people = set()  # Сбрасываем список людей для текущего файла
-            with open(self.file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-
             filename = os.path.basename(self.file_path)
-            self.parse_data(content, source_file=filename)
-
-            # Создаем связи между всеми людьми из этого файла
-            self.create_relations_within_file()
+            # Люди из этого файла связываются через гиперребро файла; файл читается по разделам
+            with self.bulk_load():
+                for record in parse_file_records(self.file_path):
+                    self.apply_person_record(record, filename)
 
             self.update_people_list()
             self.status_bar.config(text=f"Загружено: {self.file_path} | Людей: {len(self.people)}")
@@ -2962,10 +6079,42 @@ class DataVisualizer:
     def clear_canvas(self):
         for widget in self.inner_frame.winfo_children():
             widget.destroy()
+        if self.layout_job is not None:
+            # Если тот же граф сразу покажут заново (смена стиля), раскладка подхватывается
+            # в _layout_scene, иначе останавливается
+            if self.detached_layout_job is not None:
+                self.detached_layout_job.stop()
+            self.detached_layout_job, self.layout_job = self.layout_job, None
+            self.root.after_idle(self._drop_detached_layout)
         self.graph_objects = []
-        self.node_positions = {}
+        self.graph_view = None
+        self.current_view = None
         self.selected_node = None
 
+    def _drop_detached_layout(self):
+        job, self.detached_layout_job = self.detached_layout_job, None
+        if job is not None and job is not self.layout_job:
+            job.stop()
+
+    def _create_graph_canvas(self, bg):
+        """Холст графа со своей отрисовкой (GraphRenderer), панорамированием и контекстным меню"""
+        graph_canvas = tk.Canvas(self.inner_frame, width=1000, height=700, bg=bg)
+        graph_canvas.grid(row=0, column=0, sticky="nsew")
+        self.graph_objects.append(graph_canvas)
+
+        self.graph_view = GraphRenderer(graph_canvas, on_activate=self.select_graph_node)
+        self.graph_view.highlight.color = self.graph_settings['highlight_color']
+        graph_canvas.bind("<Button-3>", self.show_graph_menu)
+        graph_canvas.bind("<Motion>", self.highlight_connected_nodes)
+        graph_canvas.bind("<Leave>", self.graph_view.highlight.leave)
+        return graph_canvas
+
+    def select_graph_node(self, node):
+        """Щелчок по узлу человека выбирает его для команд контекстного меню"""
+        self.selected_node = node.key
+        if node.person is not None:
+            self.status_bar.config(text=f"Выбран: {node.person.full_name}")
+
     def copy_to_clipboard(self, text):
         """Копирует текст в буфер обмена"""
         self.root.clipboard_clear()
@@ -2976,4 +6125,5 @@ class DataVisualizer:
 if __name__ == "__main__":
     root = tk.Tk()
     app = DataVisualizer(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    app.journal.flush()
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""Локальная замена Nominatim для проверки геокодирования без доступа к сети.
+
+Отвечает на /search в формате Nominatim: координаты вычисляются из хеша запроса
+(одинаковый запрос - одинаковая точка), запросы со словами из NOT_FOUND_WORDS не находятся.
+При превышении --rate запросов в секунду отвечает 429, как настоящий сервис.
+
+Запуск:
+    python geocoder_stub.py --port 8088 --rate 20
+    BGRAPH_GEOCODER_URL=http://127.0.0.1:8088 BGRAPH_GEOCODER_RATE=20 python mapdemo.py
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+NOT_FOUND_WORDS = ('несуществующ', 'nowhere')
+
+# Центр и размах выдаваемых координат (Москва и окрестности)
+CENTER = (55.75, 37.62)
+SPREAD = 0.5
+
+
+def stub_place(query):
+    """Место в формате ответа Nominatim или None"""
+    if any(word in query.lower() for word in NOT_FOUND_WORDS):
+        return None
+    digest = hashlib.md5(query.lower().encode('utf-8')).digest()
+    lat = CENTER[0] + (digest[0] / 255 - 0.5) * SPREAD
+    lon = CENTER[1] + (digest[1] / 255 - 0.5) * SPREAD
+    return {
+        'place_id': int.from_bytes(digest[:4], 'big'),
+        'lat': f"{lat:.6f}",
+        'lon': f"{lon:.6f}",
+        'display_name': f"{query} (тестовый геокодер)",
+        'address': {'road': query}
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/search':
+            self.send_error(404)
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            now = time.monotonic()
+            server.recent = [t for t in server.recent if now - t < 1.0]
+            limited = server.rate and len(server.recent) >= server.rate
+            if not limited:
+                server.recent.append(now)
+        if limited:
+            self.send_error(429, "Too Many Requests")
+            return
+
+        if server.delay:
+            time.sleep(server.delay)
+
+        query = parse_qs(url.query).get('q', [''])[0]
+        place = stub_place(query)
+        body = json.dumps([place] if place else [], ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=8088, rate=0, delay=0.0, verbose=False):
+    """Создает сервер (port=0 - любой свободный порт); запуск - serve_forever()"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.recent = []
+    server.requests = 0
+    server.rate = rate
+    server.delay = delay
+    server.verbose = verbose
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Тестовый геокодер, совместимый с Nominatim /search")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--rate', type=float, default=0, help="лимит запросов в секунду (0 - без лимита)")
+    parser.add_argument('--delay', type=float, default=0.0, help="задержка ответа в секундах")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.rate, args.delay, args.verbose)
+    print(f"Тестовый геокодер: http://{args.host}:{server.server_port}/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
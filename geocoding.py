@@ -0,0 +1,434 @@
+"""Геокодирование адресов с постоянным кэшем (общее для Bgraph и mapdemo)"""
+import bisect
+import csv
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderServiceError
+
+# Кэш лежит рядом с программами, чтобы оба приложения пользовались одним файлом
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geocode_cache.db')
+USER_AGENT = 'bgraph_geocoder'
+# Свой сервер Nominatim (или geocoder_stub.py для проверок) и допустимая частота запросов к нему
+GEOCODER_URL = os.environ.get('BGRAPH_GEOCODER_URL')
+GEOCODER_RATE = float(os.environ.get('BGRAPH_GEOCODER_RATE', 1.0))
+# Локальный справочник адресов (CSV) - геокодирование без сети
+GAZETTEER_PATH = os.environ.get('BGRAPH_GAZETTEER')
+
+# Таймауты, недоступность и ограничения сервиса - временные ошибки, они не кэшируются
+GEOCODER_ERRORS = (GeocoderServiceError,)
+
+logger = logging.getLogger('geocoding')
+
+
+def normalize_address(address):
+    """Ключ кэша: нижний регистр, ё -> е, единые пробелы вокруг знаков препинания"""
+    address = address.lower().replace('ё', 'е')
+    address = re.sub(r'\s*([,;])\s*', r'\1 ', address)
+    address = re.sub(r'\.\s*', '. ', address)
+    address = re.sub(r'\s+', ' ', address)
+    return address.strip(' ,.;')
+
+
+class GeocodeCache:
+    """Кэш результатов геокодирования в SQLite по нормализованному адресу.
+
+    Хранит и найденные координаты, и отрицательные ответы («адрес не найден»),
+    у каждой записи свой срок жизни.
+    """
+
+    POSITIVE_TTL = 180 * 24 * 3600
+    NEGATIVE_TTL = 7 * 24 * 3600
+
+    def __init__(self, path=CACHE_PATH, positive_ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL):
+        self.path = path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        # Одно соединение на все потоки, запросы сериализуются блокировкой
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS geocode (
+                    key TEXT PRIMARY KEY,
+                    found INTEGER NOT NULL,
+                    lat REAL,
+                    lon REAL,
+                    found_address TEXT,
+                    search_address TEXT,
+                    raw TEXT,
+                    expires REAL NOT NULL
+                )""")
+
+    def lookup(self, address):
+        """Возвращает (есть ли свежая запись, результат или None для «не найден»)"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT found, lat, lon, found_address, search_address, raw FROM geocode "
+                "WHERE key = ? AND expires > ?", (normalize_address(address), time.time())).fetchone()
+        if row is None:
+            return False, None
+        found, lat, lon, found_address, search_address, raw = row
+        if not found:
+            return True, None
+        return True, {
+            'address': address,
+            'search_address': search_address or address,
+            'coordinates': (lat, lon),
+            'found_address': found_address,
+            'raw': json.loads(raw) if raw else {}
+        }
+
+    def put(self, address, result):
+        """Сохраняет результат; None - отрицательный ответ с коротким сроком жизни"""
+        if result is None:
+            row = (normalize_address(address), 0, None, None, None, None, None,
+                   time.time() + self.negative_ttl)
+        else:
+            lat, lon = result['coordinates']
+            row = (normalize_address(address), 1, lat, lon, result.get('found_address'),
+                   result.get('search_address'), json.dumps(result.get('raw') or {}, ensure_ascii=False),
+                   time.time() + self.positive_ttl)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def purge(self):
+        """Удаляет просроченные записи"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM geocode WHERE expires <= ?", (time.time(),))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class NullCache:
+    """Заглушка кэша для локальных источников, которые отвечают быстрее, чем кэш"""
+
+    def lookup(self, address):
+        return False, None
+
+    def put(self, address, result):
+        pass
+
+
+class TokenBucket:
+    """Ограничитель частоты: в среднем rate запросов в секунду, всплеск до capacity запросов"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Ждет, пока появится свободный запрос"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class NominatimBackend:
+    """Один клиент Nominatim на процесс; частота запросов ограничена (по правилам сервиса - 1 в секунду)"""
+
+    def __init__(self, user_agent=USER_AGENT, url=GEOCODER_URL, rate=GEOCODER_RATE, timeout=15):
+        if url:
+            parts = urlsplit(url)
+            self.client = Nominatim(user_agent=user_agent, domain=parts.netloc + parts.path.rstrip('/'),
+                                    scheme=parts.scheme or 'http')
+        else:
+            self.client = Nominatim(user_agent=user_agent)
+        self.rate_limiter = TokenBucket(rate)
+        self.timeout = timeout
+
+    def geocode(self, query):
+        """Ищет адрес, возвращает {'coordinates', 'found_address', 'raw'} или None"""
+        self.rate_limiter.acquire()
+        location = self.client.geocode(query, addressdetails=True, timeout=self.timeout, language='ru')
+        if not location:
+            return None
+        return {
+            'coordinates': (location.latitude, location.longitude),
+            'found_address': location.address,
+            'raw': location.raw
+        }
+
+
+class GazetteerBackend:
+    """Офлайн-геокодер по справочнику адресов из CSV.
+
+    Колонки: region, city, street, house, lat, lon (house и street могут быть пустыми - тогда
+    строка задает центр улицы или города). Названия разбиваются на нормализованные слова без
+    типов объектов (ул., г., обл. ...), по словам строится обратный индекс; неполные слова
+    запроса дополняются по отсортированному словарю. Если адрес не найден целиком, ответом
+    может быть только населенный пункт (строка без улицы и дома), название которого есть в запросе.
+    """
+
+    STOP_WORDS = frozenset((
+        'г', 'гор', 'город', 'ул', 'улица', 'д', 'дом', 'пр', 'пр-т', 'просп', 'проспект', 'пер', 'переулок',
+        'обл', 'область', 'р-н', 'район', 'россия', 'рф', 'корп', 'корпус', 'стр', 'строение', 'кв',
+        'квартира', 'оф', 'офис', 'пом', 'помещение', 'пос', 'поселок', 'п', 'с', 'село', 'дер', 'деревня',
+        'ш', 'шоссе', 'б-р', 'бульвар', 'наб', 'набережная', 'пл', 'площадь', 'респ', 'республика', 'край',
+        'мкр', 'микрорайон', 'пгт', 'тер', 'лит', 'литера'))
+    MIN_PREFIX = 3
+
+    def __init__(self, path=GAZETTEER_PATH):
+        self.path = path
+        # Строки справочника: (широта, долгота, найденный адрес, номер дома)
+        self.places = []
+        # Слово -> номера строк
+        self.postings = defaultdict(list)
+        # Строки населенных пунктов (без улицы и дома) -> слова названия города (или региона)
+        self.localities = {}
+        self.load(path)
+
+    @classmethod
+    def words(cls, text):
+        """Нормализованные слова названий без типов объектов, чисел и номеров домов (12а, 12к1)"""
+        text = text.lower().replace('ё', 'е')
+        return [word for word in re.findall(r'[0-9a-zа-я]+(?:-[0-9a-zа-я]+)*', text)
+                if word not in cls.STOP_WORDS and not re.fullmatch(r'\d+[а-я]?\d*', word) and len(word) > 1]
+
+    @staticmethod
+    def house_number(text):
+        """Номер дома из адреса: '12', '12а', '12/3', '12к1'"""
+        text = text.lower().replace('ё', 'е')
+        text = re.sub(r'\b(кв|оф|пом|каб)\b\.?\s*\d+\S*', ' ', text)  # квартиры и офисы - не дома
+        match = (re.search(r'\b(?:д|дом)\b\.?\s*(\d+[^\s,]*)', text) or
+                 re.search(r'(?<![\d-])(\d{1,5}(?:/\d+)?[а-я]?)\b(?!-)', text))
+        if not match:
+            return ''
+        return re.sub(r'[^0-9a-zа-я/]', '', match.group(1))
+
+    def load(self, path):
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                street = row.get('street') or ''
+                house = row.get('house') or ''
+                place_id = len(self.places)
+                parts = [part for part in (row.get('region'), row.get('city'), street, house) if part]
+                self.places.append((float(row['lat']), float(row['lon']), ', '.join(parts),
+                                    self.house_number('д. ' + house) if house else ''))
+                words = set(self.words(' '.join(parts[:-1] if house else parts)))
+                for word in words:
+                    self.postings[word].append(place_id)
+                if not street and not house:
+                    self.localities[place_id] = set(self.words(row.get('city') or row.get('region') or ''))
+        self.vocabulary = sorted(self.postings)
+
+    def expand(self, word):
+        """Номера строк для слова; неизвестное слово ищется как начало слов словаря"""
+        posting = self.postings.get(word)
+        if posting is not None:
+            return set(posting)
+        if len(word) < self.MIN_PREFIX:
+            return None
+        start = bisect.bisect_left(self.vocabulary, word)
+        end = bisect.bisect_left(self.vocabulary, word + '\uffff')
+        if start == end:
+            return None
+        ids = set()
+        for known in self.vocabulary[start:end]:
+            ids.update(self.postings[known])
+        return ids
+
+    def covers(self, query_words, word):
+        """Есть ли слово справочника в запросе (целиком или началом не короче MIN_PREFIX)"""
+        return word in query_words or any(
+            len(query_word) >= self.MIN_PREFIX and word.startswith(query_word) for query_word in query_words)
+
+    def geocode(self, query):
+        """Ищет адрес в справочнике, возвращает {'coordinates', 'found_address', 'raw'} или None"""
+        query_words = set(self.words(query))
+        postings = [self.expand(word) for word in query_words]
+        known = [ids for ids in postings if ids is not None]
+        if not known:
+            return None
+
+        # Адрес должен совпасть целиком: пересечение по всем словам, от самых редких
+        candidates = set()
+        if len(known) == len(postings):
+            known.sort(key=len)
+            candidates = known[0]
+            for ids in known[1:]:
+                candidates = candidates & ids
+                if not candidates:
+                    break
+
+        if not candidates:
+            # Без части слов нашлось бы другое место - отвечаем только населенным пунктом из адреса
+            localities = {place_id for ids in known for place_id in ids if place_id in self.localities}
+            localities = [place_id for place_id in localities
+                          if all(self.covers(query_words, word) for word in self.localities[place_id])]
+            if not localities:
+                return None
+            best = min(localities, key=lambda place_id: (
+                -len(self.localities[place_id]), len(self.places[place_id][2]), place_id))
+            lat, lon, found_address, _ = self.places[best]
+            return {
+                'coordinates': (lat, lon),
+                'found_address': found_address,
+                'raw': {'source': 'gazetteer', 'place_id': best, 'precision': 'locality'}
+            }
+
+        house = self.house_number(query)
+        # Точный дом, затем центр улицы/города, затем самые короткие (наименее уточненные) строки
+        best = min(candidates, key=lambda place_id: (
+            self.places[place_id][3] != house if house else self.places[place_id][3] != '',
+            self.places[place_id][3] != '',
+            len(self.places[place_id][2]),
+            place_id))
+        lat, lon, found_address, _ = self.places[best]
+        return {
+            'coordinates': (lat, lon),
+            'found_address': found_address,
+            'raw': {'source': 'gazetteer', 'place_id': best}
+        }
+
+
+class Geocoder:
+    """Геокодер с кэшем: сначала кэш, затем источник (backend) по вариантам запроса"""
+
+    def __init__(self, backend=None, cache=None):
+        self.backend = backend or NominatimBackend()
+        self.cache = cache if cache is not None else GeocodeCache()
+
+    def geocode(self, address, variants=None, retries=1, retry_delay=2):
+        """Возвращает {'address', 'search_address', 'coordinates', 'found_address', 'raw'} или None.
+
+        «Не найден» запоминается, только если все варианты получили ответ без ошибок связи.
+        """
+        cached, result = self.cache.lookup(address)
+        if cached:
+            return result
+
+        failed = False
+        for search_address in variants or (address,):
+            for attempt in range(retries):
+                try:
+                    found = self.backend.geocode(search_address)
+                except GEOCODER_ERRORS as e:
+                    if attempt == retries - 1:
+                        logger.warning(f"Ошибка геокодирования для '{search_address}': {str(e)}")
+                        failed = True
+                    else:
+                        time.sleep(retry_delay)
+                    continue
+
+                if found:
+                    result = dict(found, address=address, search_address=search_address)
+                    self.cache.put(address, result)
+                    return result
+                break
+
+        if not failed:
+            self.cache.put(address, None)
+        return None
+
+
+class GeocodingPipeline:
+    """Фоновое геокодирование списка адресов в пуле потоков.
+
+    Одинаковые после нормализации адреса геокодируются один раз, ответы из кэша отдаются сразу,
+    остальные запросы идут параллельно через ограничитель частоты источника. Ход работы
+    передается через очередь events: ('progress', готово, всего, адрес, результат), а в конце
+    ('done', результаты в порядке исходных адресов).
+    """
+
+    def __init__(self, geocoder, variants=None, retries=1, workers=4):
+        self.geocoder = geocoder
+        self.variants = variants
+        self.retries = retries
+        self.workers = workers
+        self.events = queue.SimpleQueue()
+        self.cancelled = False
+        self.thread = None
+
+    def start(self, addresses):
+        self.thread = threading.Thread(target=self._run, args=(list(addresses),), daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """Прекращает геокодирование; уже полученные результаты будут в событии 'done'"""
+        self.cancelled = True
+
+    def _geocode(self, address):
+        variants = self.variants(address) if self.variants else None
+        return self.geocoder.geocode(address, variants, retries=self.retries)
+
+    def _run(self, addresses):
+        results = {}
+        try:
+            self._geocode_all(addresses, results)
+        except Exception as e:
+            # Например, кэш заблокирован другим процессом - без 'done' окно прогресса ждало бы вечно
+            logger.error(f"Ошибка фонового геокодирования: {str(e)}")
+        finally:
+            self.events.put(('done', [results.get(normalize_address(address)) for address in addresses]))
+
+    def _geocode_all(self, addresses, results):
+        unique = {}
+        for address in addresses:
+            unique.setdefault(normalize_address(address), address)
+
+        total = len(unique)
+        misses = []
+        for key, address in unique.items():
+            cached, result = self.geocoder.cache.lookup(address)
+            if cached:
+                results[key] = result
+                self.events.put(('progress', len(results), total, address, result))
+            else:
+                misses.append((key, address))
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = {executor.submit(self._geocode, address): (key, address) for key, address in misses}
+        try:
+            for future in as_completed(futures):
+                if self.cancelled:
+                    break
+                key, address = futures[future]
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    logger.error(f"Неизвестная ошибка для '{address}': {str(e)}")
+                    results[key] = None
+                self.events.put(('progress', len(results), total, address, results[key]))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_default_geocoder = None
+_default_lock = threading.Lock()
+
+
+def default_geocoder():
+    """Общий геокодер приложения (создается при первом обращении)"""
+    global _default_geocoder
+    with _default_lock:
+        if _default_geocoder is None:
+            if GAZETTEER_PATH:
+                # Офлайн-справочник отвечает за микросекунды - кэш и ограничение частоты не нужны
+                _default_geocoder = Geocoder(GazetteerBackend(GAZETTEER_PATH), NullCache())
+            else:
+                _default_geocoder = Geocoder()
+        return _default_geocoder
@@ -2,15 +2,14 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 from tkinter import ttk
 import folium
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
 import webbrowser
 import os
 import re
-import time
 import json
+import queue
 import openai
 from datetime import datetime
+from geocoding import GeocodingPipeline, default_geocoder
 
 
 class MapApp:
@@ -151,6 +150,9 @@ class MapApp:
 
         self.addresses = []
         self.geocoded_locations = []
+        # Общий с Bgraph геокодер с кэшем на диске
+        self.geocoder = default_geocoder()
+        self.pipeline = None
 
     def toggle_openai(self):
         """Включение/выключение OpenAI"""
@@ -412,39 +414,6 @@ class MapApp:
 
         return ' '.join(capitalized_words)
 
-    def geocode_address(self, address, retry_count=3):
-        """Расширенное геокодирование адреса"""
-        if self.extended_geocoding_var.get():
-            retry_count = 5
-
-        geolocator = Nominatim(user_agent=f"ai_map_app_{int(time.time())}")
-
-        search_variants = self.generate_search_variants(address)
-
-        for search_address in search_variants:
-            for attempt in range(retry_count):
-                try:
-                    location = geolocator.geocode(search_address, addressdetails=True, timeout=15, language='ru')
-                    if location:
-                        return {
-                            'address': address,
-                            'search_address': search_address,
-                            'coordinates': (location.latitude, location.longitude),
-                            'found_address': location.address,
-                            'raw': location.raw
-                        }
-                    time.sleep(1)
-
-                except (GeocoderTimedOut, GeocoderUnavailable) as e:
-                    if attempt == retry_count - 1:
-                        print(f"Ошибка геокодирования для '{search_address}': {str(e)}")
-                    time.sleep(2)
-                except Exception as e:
-                    print(f"Неизвестная ошибка для '{search_address}': {str(e)}")
-                    break
-
-        return None
-
     def generate_search_variants(self, address):
         """Генерация вариантов поиска"""
         variants = [address]
@@ -462,58 +431,91 @@ class MapApp:
         return variants
 
     def show_map(self):
-        """Создание и отображение карты"""
+        """Запускает фоновое геокодирование; карта строится, когда придут все результаты"""
         if not self.addresses:
             messagebox.showwarning("Предупреждение", "Нет адресов для отображения!")
             return
+        if self.pipeline is not None:
+            messagebox.showwarning("Предупреждение", "Геокодирование уже выполняется")
+            return
 
         self.status_var.set("Начинаем геокодирование адресов...")
-        self.root.update()
-
-        successful_markers = 0
-        failed_addresses = []
+        self.show_map_button.config(state=tk.DISABLED)
         self.geocoded_locations = []
+        self.geocoding_addresses = list(self.addresses)
 
         # Прогресс-окно
-        progress_window = tk.Toplevel(self.root)
-        progress_window.title("Геокодирование адресов")
-        progress_window.geometry("450x150")
-        progress_window.transient(self.root)
-        progress_window.grab_set()
-
-        progress_label = tk.Label(progress_window, text="Обработка адресов...", font=("Arial", 10))
-        progress_label.pack(pady=10)
-
-        progress_var = tk.DoubleVar()
-        progress_bar = ttk.Progressbar(progress_window, variable=progress_var, maximum=len(self.addresses))
-        progress_bar.pack(fill=tk.X, padx=20, pady=5)
-
-        count_label = tk.Label(progress_window, text="0/0", font=("Arial", 9))
-        count_label.pack()
-
-        status_label = tk.Label(progress_window, text="", font=("Arial", 8))
-        status_label.pack()
-
-        # Геокодируем адреса
-        for i, address in enumerate(self.addresses):
-            progress_var.set(i)
-            progress_label.config(text=f"Обработка: {address[:45]}...")
-            count_label.config(text=f"{i + 1}/{len(self.addresses)}")
-            status_label.config(text="Геокодирование...")
-            progress_window.update()
-
-            location_data = self.geocode_address(address)
+        self.progress_window = tk.Toplevel(self.root)
+        self.progress_window.title("Геокодирование адресов")
+        self.progress_window.geometry("450x170")
+        self.progress_window.transient(self.root)
+        self.progress_window.protocol("WM_DELETE_WINDOW", self.cancel_geocoding)
+
+        self.progress_label = tk.Label(self.progress_window, text="Обработка адресов...", font=("Arial", 10))
+        self.progress_label.pack(pady=10)
+
+        self.progress_var = tk.DoubleVar()
+        self.progress_bar = ttk.Progressbar(self.progress_window, variable=self.progress_var,
+                                            maximum=len(self.geocoding_addresses))
+        self.progress_bar.pack(fill=tk.X, padx=20, pady=5)
+
+        self.count_label = tk.Label(self.progress_window, text="0/0", font=("Arial", 9))
+        self.count_label.pack()
+
+        self.progress_status_label = tk.Label(self.progress_window, text="", font=("Arial", 8))
+        self.progress_status_label.pack()
+
+        tk.Button(self.progress_window, text="Отмена", command=self.cancel_geocoding).pack(pady=5)
+
+        # Геокодирование идет в пуле потоков, окно остается отзывчивым
+        retry_count = 5 if self.extended_geocoding_var.get() else 3
+        self.pipeline = GeocodingPipeline(self.geocoder, self.generate_search_variants, retries=retry_count)
+        self.pipeline.start(self.geocoding_addresses)
+        self.root.after(100, self.poll_geocoding)
+
+    def cancel_geocoding(self):
+        """Останавливает геокодирование; карта строится по уже найденным адресам"""
+        if self.pipeline is not None:
+            self.pipeline.cancel()
+            self.progress_status_label.config(text="Отмена...")
+
+    def poll_geocoding(self):
+        """Забирает события фонового геокодирования из очереди (вызывается через after)"""
+        while True:
+            try:
+                event = self.pipeline.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event[0] == 'progress':
+                _, done, total, address, result = event
+                self.progress_bar.config(maximum=total)
+                self.progress_var.set(done)
+                self.progress_label.config(text=f"Обработка: {address[:45]}...")
+                self.count_label.config(text=f"{done}/{total}")
+                self.progress_status_label.config(text="✓ Успешно" if result else "✗ Не найдено")
+            else:
+                self.finish_geocoding(event[1])
+                return
+
+        self.root.after(100, self.poll_geocoding)
+
+    def finish_geocoding(self, results):
+        self.pipeline = None
+        self.progress_window.destroy()
+        self.show_map_button.config(state=tk.NORMAL if self.addresses else tk.DISABLED)
+
+        failed_addresses = []
+        for address, location_data in zip(self.geocoding_addresses, results):
             if location_data:
-                self.geocoded_locations.append(location_data)
-                successful_markers += 1
-                status_label.config(text="✓ Успешно")
+                self.geocoded_locations.append(dict(location_data, address=address))
             else:
                 failed_addresses.append(address)
-                status_label.config(text="✗ Не найдено")
-
-            time.sleep(1)  # Задержка для API
+        self.create_map(failed_addresses)
 
-        progress_window.destroy()
+    def create_map(self, failed_addresses):
+        """Создание и отображение карты по геокодированным адресам"""
+        successful_markers = len(self.geocoded_locations)
 
         if not self.geocoded_locations:
             messagebox.showerror("Ошибка", "Не удалось геокодировать ни один адрес!")
@@ -563,14 +565,14 @@ class MapApp:
         webbrowser.open(f'file://{os.path.abspath(map_file)}')
 
         # Результаты
-        result_message = f"Успешно размещено {successful_markers} из {len(self.addresses)} адресов"
+        result_message = f"Успешно размещено {successful_markers} из {len(self.geocoding_addresses)} адресов"
         if failed_addresses:
             result_message += f"\n\nНе найдены адреса ({len(failed_addresses)}):\n" + "\n".join(failed_addresses[:10])
             if len(failed_addresses) > 10:
                 result_message += f"\n... и еще {len(failed_addresses) - 10} адресов"
 
         messagebox.showinfo("Результат", result_message)
-        self.status_var.set(f"Карта создана: {successful_markers}/{len(self.addresses)} адресов")
+        self.status_var.set(f"Карта создана: {successful_markers}/{len(self.geocoding_addresses)} адресов")
 
     def clear_addresses(self):
         """Очистка всех адресов"""